@@ -0,0 +1,113 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+# Function to normalise a question for exact matching (case, punctuation and spacing are ignored)
+def normalize_question(question):
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub(" ", question.lower())).strip()
+
+
+# In-memory cache of chain results for repeated and paraphrased questions.
+# Lookups try the normalised question first, then the most similar cached question
+# (cosine similarity of query embeddings at or above `similarity_threshold`).
+# Entries belong to one vector-store version: after re-ingestion they are no longer served.
+# Answers scoped to a subset of sources are only served for that same scope.
+# Expired entries (TTL) are dropped on access and the least recently used entry is evicted
+# once `max_entries` is reached.
+class AnswerCache:
+    def __init__(self, max_entries=config.ANSWER_CACHE_MAX_ENTRIES, ttl=config.ANSWER_CACHE_TTL_SECONDS,
+                 similarity_threshold=config.ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (store_version, normalised question) -> entry
+        self._lock = threading.Lock()
+
+    # Drop expired entries and entries built against another version of the store
+    def _purge(self, store_version):
+        now = time.time()
+        stale = [
+            key for key, entry in self._entries.items()
+            if key[0] != store_version or now - entry["created"] > self.ttl
+        ]
+        for key in stale:
+            del self._entries[key]
+
+    # Return (result, "exact" | "semantic") for a cached answer, or (None, None) on a miss.
+    # `embed` is only called when there is no exact match, so exact hits cost no embedding.
+    def lookup(self, question, store_version, embed=None, sources=()):
+        scope = tuple(sorted(sources))
+        key = (store_version, scope, normalize_question(question))
+        with self._lock:
+            self._purge(store_version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry["result"], "exact"
+            candidates = [(k, e) for k, e in self._entries.items() if e["embedding"] is not None and k[1] == scope]
+
+        if embed is not None and candidates:
+            query = _unit(embed(question))
+            scores = np.stack([e["embedding"] for _, e in candidates]) @ query
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity_threshold:
+                best_key, best_entry = candidates[best]
+                with self._lock:
+                    if best_key in self._entries:
+                        self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                return best_entry["result"], "semantic"
+
+        with self._lock:
+            self.misses += 1
+        return None, None
+
+    def put(self, question, store_version, result, embedding=None, sources=()):
+        key = (store_version, tuple(sorted(sources)), normalize_question(question))
+        entry = {
+            "result": result,
+            "embedding": _unit(embedding) if embedding is not None else None,
+            "created": time.time(),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "lookups": lookups,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+# Function to L2-normalise a vector so dot products are cosine similarities
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
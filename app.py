@@ -1,15 +1,32 @@
 import os
 import streamlit as st
 import time
-from langchain.chains import RetrievalQAWithSourcesChain
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import UnstructuredURLLoader
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
-from langchain_openai import ChatOpenAI
+import uuid
 from dotenv import load_dotenv
-import pandas as pd
-import matplotlib.pyplot as plt
+import config
+from index_sync import SyncResult, indexed_sources, store_version
+from instrumentation import get_tracer
+from metrics_store import ALL_SESSIONS, bucket_edge, get_metrics_store
+from client import RemoteAnswerStream, RemoteRefineStream, SmartSearchClient
+from resources import (
+    get_answer_cache, get_chain, get_embeddings, get_index_sync, get_llm, get_recrawl_worker, get_refine_chain,
+    get_text_splitter, invalidate_store
+)
+
+# Startup is kept light: ingestion, LangChain, the vector store and the LLM client are imported
+# and built only when a URL is processed or a question is asked, and pandas/matplotlib only once
+# there is history to chart (see `python startup_profile.py`). Feedback and response times go to
+# the durable metrics store (metrics_store.py) and the charts read its running aggregates, so
+# neither the session state nor the render time grows with the number of questions asked.
+
+
+# Function to load the charting libraries, the first time there is something to plot
+def plotting():
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
+    return pd, plt
+
 
 # Initialize Streamlit UI
 st.title("SmartSearch: Research Tool 🌐🔗 🔍")
@@ -25,11 +42,15 @@ st.session_state.user_api_key = st.sidebar.text_input(
     value=st.session_state.user_api_key
 )
 
+# With a query server configured (SMARTSEARCH_SERVER_URL) the app is a thin client: ingestion,
+# retrieval, generation and the answer cache run on the shared server, which uses its own API key
+server_client = SmartSearchClient(config.SERVER_URL) if config.SERVER_URL else None
+
 # Ensure the API Key is provided before continuing
-if not st.session_state.user_api_key:
+if not st.session_state.user_api_key and server_client is None:
     st.sidebar.warning("Please provide your OpenAI API Key to proceed.")
     st.stop()
-else:
+elif st.session_state.user_api_key:
     os.environ["OPENAI_API_KEY"] = st.session_state.user_api_key
 
 # Initialize session state for additional functionalities
@@ -39,14 +60,19 @@ if "last_query" not in st.session_state:
     st.session_state.last_query = ""
 if "rating" not in st.session_state:
     st.session_state.rating = 3  # Default slider value
-if "feedback_history" not in st.session_state:
-    st.session_state.feedback_history = []  # To track ratings over time
-if "query_times" not in st.session_state:
-    st.session_state.query_times = []  # To track query response times
+if "answered" not in st.session_state:
+    st.session_state.answered = {"key": None}  # The last question answered, see the query section below
+if "metrics_session" not in st.session_state:
+    st.session_state.metrics_session = uuid.uuid4().hex  # Tags this session's feedback and timings
 
 # Optional debugging checkbox
 debug_mode = st.sidebar.checkbox("Enable Debugging")
 
+# Feedback and response time charts for this session, or for everyone using this app
+metrics_store = get_metrics_store()
+all_sessions = st.sidebar.checkbox("Show metrics from all sessions")
+metrics_scope = ALL_SESSIONS if all_sessions else st.session_state.metrics_session
+
 # Sidebar for input URLs
 urls = []
 for i in range(3):
@@ -55,63 +81,144 @@ for i in range(3):
 
 # Button to process URLs
 process_url_clicked = st.sidebar.button("Process URLs")
-vectorstore_path = "chroma_vectorstore"
+vectorstore_path = config.VECTORSTORE_PATH
 main_placeholder = st.empty()
 
-# Initialize Language Model
-try:
-    llm = ChatOpenAI(
-        model="gpt-4",
-        temperature=0.6,
-        max_tokens=500
-    )
-except Exception as e:
-    st.error("Failed to initialize the language model. Please check your OpenAI API Key.")
-    st.stop()
+# Optionally answer from a subset of the indexed sources; a sharded store then only searches the shards holding them
+available_sources = server_client.sources() if server_client is not None else indexed_sources(vectorstore_path)
+search_scope = tuple(st.sidebar.multiselect("Answer only from these sources (all when empty):", available_sources))
+
+# A store deleted from disk must not be served from cached connections
+if not os.path.exists(vectorstore_path):
+    invalidate_store()
 
-# Function to load data from URLs
+# Function to get the store's background re-crawl worker (started on first use), or None when
+# re-crawling is disabled or a query server keeps the index instead
+def recrawl_worker():
+    if server_client is not None or not config.RECRAWL_INTERVAL_SECONDS:
+        return None
+    return get_recrawl_worker(st.session_state.user_api_key, vectorstore_path)
+
+# Function to load data from URLs, yielding each document as soon as its page is fetched and parsed.
+# Loaded pages are tracked for re-crawling, so later changes are indexed in the background.
 def load_data(urls):
-    loader = UnstructuredURLLoader(urls=urls)
+    from ingestion import describe_result, iter_ingest
+
+    worker = recrawl_worker()
     main_placeholder.text("Data Loading... Started...")
-    data = loader.load()
-    if debug_mode:
-        st.write(f"Loaded data: {data}")  # For debugging purposes
-    return data
+    for result in iter_ingest(urls):
+        main_placeholder.text(f"Data Loading... {describe_result(result)}")
+        if debug_mode:
+            st.write(describe_result(result))  # Per-URL fetch and parse timings
+        if result.ok:
+            if worker is not None:
+                worker.registry.track(result.url, result.headers)
+            if debug_mode:
+                st.write(f"Loaded data: {result.document}")  # For debugging purposes
+            yield result.document
 
-# Function to split text into chunks
+# Function to split text into chunks, yielded one at a time as the embedding stage asks for them
 def split_data(data):
-    text_splitter = RecursiveCharacterTextSplitter(
-        separators=['\n\n', '\n', '.', ','],
-        chunk_size=1200,
-        chunk_overlap=100
-    )
+    from chunking import iter_split_documents
+
+    text_splitter = get_text_splitter(config.CHUNK_SIZE, config.CHUNK_OVERLAP)
     main_placeholder.text("Splitting Text... Started...")
-    docs = text_splitter.split_documents(data)
-    if debug_mode:
-        st.write(f"Split documents: {docs}")
-    return docs
-
-# Function to create embeddings and store them in Chroma
-def create_embeddings(docs):
-    embeddings = OpenAIEmbeddings()
-    vectorstore = Chroma.from_documents(docs, embeddings, persist_directory=vectorstore_path)
-    main_placeholder.text("Creating Embedding Vectors... Completed.")
-    st.write("Embeddings created and stored in Chroma successfully.")
-    return vectorstore
-
-# Process URLs and create embeddings when button is clicked
+    for doc in iter_split_documents(data, text_splitter):
+        if debug_mode:
+            st.write(f"Split document: {doc}")
+        yield doc
+
+# Function to create embeddings for one document: new chunks are upserted, vanished chunks deleted,
+# and pages whose content has not changed since the last run are skipped entirely
+def create_embeddings(document, index_sync):
+    result = index_sync.sync_document(document, split_data, get_embeddings(st.session_state.user_api_key))
+    if result.skipped:
+        main_placeholder.text(f"No changes in {result.source}, skipping...")
+    else:
+        main_placeholder.text(
+            f"Creating Embedding Vectors... {result.source}: {result.added} new, "
+            f"{result.deleted} removed, {result.unchanged} unchanged chunks."
+        )
+    return result
+
+# Function to index URLs on the query server, returning the same sync results as local ingestion
+def ingest_on_server(urls):
+    main_placeholder.text("Data Loading... Sent to the query server...")
+    sync_results = []
+    for entry in server_client.ingest(url for url in urls if url):
+        main_placeholder.text(f"Data Loading... {entry['url']}: {'OK' if entry['ok'] else entry['error']}")
+        if debug_mode:
+            st.write(entry)  # Per-URL fetch and parse timings and chunk counts
+        if entry["ok"]:
+            sync_results.append(SyncResult(
+                entry["source"], entry["added"], entry["deleted"], entry["unchanged"], entry["skipped"]
+            ))
+    return sync_results
+
+# Function to start streaming an answer, from the query server when one is configured
+def stream_answer(question, on_sources=None):
+    if server_client is not None:
+        return RemoteAnswerStream(server_client, question, on_sources=on_sources, sources=search_scope)
+    from streaming import AnswerStream
+
+    ensure_llm()
+    recrawl_worker()  # keeps the index fresh in the background from now on
+    chain = get_chain(st.session_state.user_api_key, vectorstore_path, search_scope)  # reused across reruns
+    return AnswerStream(chain, {"question": question}, on_sources=on_sources, final_answer_only=True)
+
+# Function to start streaming a refined answer: one LLM call over the first answer's retrieved
+# passages, with the original question and the user's feedback (no new retrieval)
+def stream_refinement(question, result, rating, comment):
+    if server_client is not None:
+        return RemoteRefineStream(server_client, question, result, rating, comment)
+    from refinement import refine_stream
+
+    ensure_llm()
+    return refine_stream(get_refine_chain(st.session_state.user_api_key), question, result, rating, comment)
+
+# Function to initialize the Language Model on first use (built once per API key and reused across reruns)
+def ensure_llm():
+    try:
+        get_llm(st.session_state.user_api_key)
+    except Exception as e:
+        st.error("Failed to initialize the language model. Please check your OpenAI API Key.")
+        st.stop()
+
+# Process URLs and create embeddings when button is clicked.
+# Each page is split and embedded as soon as it arrives instead of waiting for the slowest URL.
 vectorstore = None
 if process_url_clicked and urls:
-    data = load_data(urls)
-    if data:
-        docs = split_data(data)
-        if docs:
-            vectorstore = create_embeddings(docs)
-            time.sleep(2)
-        else:
-            st.write("No content found in the URLs provided.")
+    if server_client is not None:
+        sync_results = ingest_on_server(urls)
     else:
+        index_sync = get_index_sync(vectorstore_path)
+        vectorstore = index_sync.vectorstore
+        with get_tracer().span("ingest", urls=len(urls)) as ingest_span:
+            sync_results = [create_embeddings(document, index_sync) for document in load_data(urls)]
+            # Pages indexed earlier whose boilerplate changed with this batch are re-indexed too
+            from ingestion import resync_stale
+
+            boilerplate = getattr(get_text_splitter(config.CHUNK_SIZE, config.CHUNK_OVERLAP), "boilerplate", None)
+            resynced = [sync for _, sync in resync_stale(index_sync, split_data, boilerplate,
+                                                         get_embeddings(st.session_state.user_api_key)) if sync]
+            ingest_span.set("pages", len(sync_results))
+            ingest_span.set("pages_resynced", len(resynced))
+            ingest_span.set("chunks_added", sum(result.added for result in sync_results))
+    if debug_mode:
+        st.write(f"Sync results: {sync_results}")
+        if server_client is None:
+            st.write(f"Re-indexed for boilerplate changes: {resynced}")
+            from embedding_cache import get_cache
+
+            st.write(f"Embedding cache: {get_cache().stats()}")  # Hits/misses since startup
+    if not sync_results:
         st.write("Failed to load data from URLs.")
+    elif all(result.skipped for result in sync_results):
+        st.write("No new or updated content found in the provided URLs.")
+    elif not any(result.added or result.unchanged for result in sync_results):
+        st.write("No content found in the URLs provided.")
+    else:
+        st.write("Embeddings created and stored in the vector store successfully.")
 
 # Query input and feedback loop
 query = st.text_input("Enter your question:", value=st.session_state.last_query if not st.session_state.satisfied else "")
@@ -121,34 +228,73 @@ if query and query != st.session_state.last_query:
     st.session_state.last_query = query
 
 if query and not st.session_state.satisfied:
-    if vectorstore is not None or os.path.exists(vectorstore_path):
-        if vectorstore is None:
-            vectorstore = Chroma(persist_directory=vectorstore_path, embedding_function=OpenAIEmbeddings())
-        
-        # Initialize retrieval chain with source document support
-        chain = RetrievalQAWithSourcesChain.from_llm(
-            llm=llm, 
-            retriever=vectorstore.as_retriever(), 
-            return_source_documents=True
-        )
-        
-        # Measure query response time
+    if server_client is not None or vectorstore is not None or os.path.exists(vectorstore_path):
+        # Measure query response time. Repeated and paraphrased questions are answered from the
+        # answer cache as long as the vector store has not been re-indexed since; everything else
+        # streams token by token, with the retrieved sources shown as soon as retrieval finishes.
+        # A query server keeps one answer cache for all its users instead. The answer is kept in
+        # the session, so the reruns of the feedback form show it again without looking it up,
+        # asking or timing it a second time.
+        answer_key = (query, search_scope)
+        answered = st.session_state.answered if st.session_state.answered["key"] == answer_key else None
         start_time = time.time()
-        result = chain.invoke({"question": query})
-        response_time = time.time() - start_time
-        st.session_state.query_times.append(response_time)
-        
+        result, cache_hit = None, None
+        if answered is not None:
+            result, cache_hit = answered["result"], answered["cache_hit"]
+        elif server_client is None:
+            answer_cache = get_answer_cache()
+            embed_query = get_embeddings(st.session_state.user_api_key).embed_query
+            version = store_version(vectorstore_path)
+            result, cache_hit = answer_cache.lookup(query, version, embed=embed_query, sources=search_scope)
+
         # Display the answer
         st.header("Answer")
-        st.write(result["answer"])
+        answer_container = st.container()
+        sources_placeholder = st.empty()
 
-        # Display the sources if available
+        # Function to list the retrieved documents' sources while the answer is still being generated
+        def show_retrieved_sources(documents):
+            with sources_placeholder.container():
+                st.subheader("Sources:")
+                for source in dict.fromkeys(doc.metadata.get("source", "Unknown") for doc in documents):
+                    st.write(source)
+
+        rerank_report = None
+        if answered is not None:
+            answer_container.write(result["answer"])
+            response_time, rerank_report = answered["response_time"], answered["rerank_report"]
+        else:
+            if result is None:
+                answer_stream = stream_answer(query, on_sources=show_retrieved_sources)
+                answer_container.write_stream(answer_stream)
+                result = answer_stream.result
+                first_token_time = answer_stream.time_to_first_token
+                rerank_report = answer_stream.rerank_report
+                if server_client is None:
+                    answer_cache.put(query, version, result, embedding=embed_query(query), sources=search_scope)
+            else:
+                answer_container.write(result["answer"])
+                first_token_time = time.time() - start_time
+            response_time = time.time() - start_time
+            metrics_store.record_timing(st.session_state.metrics_session, response_time, first_token_time, cache_hit)
+            st.session_state.answered = {"key": answer_key, "result": result, "cache_hit": cache_hit,
+                                         "response_time": response_time, "rerank_report": rerank_report}
+        if debug_mode and cache_hit:
+            st.write(f"Answered from the answer cache ({cache_hit} match).")
+        if debug_mode and rerank_report is not None:
+            st.write(
+                f"Re-ranking kept {rerank_report.selected} of {rerank_report.candidates} passages "
+                f"({rerank_report.packed_tokens} prompt tokens, {rerank_report.tokens_saved} saved)."
+            )
+
+        # Display the sources cited in the answer if available
         sources = result.get("sources", "")
         if sources:
-            st.subheader("Sources:")
-            sources_list = sources.split("\n")
-            for source in sources_list:
-                st.write(source)
+            with sources_placeholder.container():
+                st.subheader("Sources:")
+                sources_list = sources.split("\n")
+                for source in sources_list:
+                    st.write(source)
 
         # Collect user feedback
         with st.form("feedback_form"):
@@ -177,82 +323,116 @@ if query and not st.session_state.satisfied:
             submitted = st.form_submit_button("Submit Feedback")
 
         if submitted:
-            # Save feedback to session state
+            # Save feedback to the metrics store
             st.session_state.rating = temp_rating
-            st.session_state.feedback_history.append({
-                "query": query,
-                "answer": result["answer"],
-                "sources": sources,
-                "rating": temp_rating,
-                "comments": feedback_comment,
-                "response_time": response_time
-            })
+            metrics_store.record_feedback(
+                st.session_state.metrics_session, query, result["answer"], sources, temp_rating, feedback_comment,
+                response_time
+            )
 
             # Process refinement only if the rating is less than 4
             if temp_rating < 4:
                 st.warning(f"Refining the response based on your feedback (Rating: {temp_rating}/5). Please wait...")
-                refined_query = (
-                    f"Refine this answer based on feedback: I rated it {temp_rating}/5. "
-                    f"{feedback_comment if feedback_comment else 'No additional comments provided.'}"
-                )
-                refined_result = chain.invoke({"question": refined_query})
                 st.write("Refined Answer:")
-                st.write(refined_result["answer"])
+                st.write_stream(stream_refinement(query, result, temp_rating, feedback_comment))
             else:
                 st.success(
                     f"Execution completed successfully! The answer was accepted with a rating of {st.session_state.rating}/5."
                 )
                 st.write("Thank you for your feedback! You can now ask another question.")
                 st.session_state.satisfied = True  # Mark satisfaction as True.
+                st.session_state.answered = {"key": None}  # Asking the same question again answers it anew
 
-# Visualization for feedback ratings
-if st.session_state.feedback_history:
+# Query server counters (answer cache, stage latencies) for the panels below, fetched once per rerun
+server_stats = server_client.stats() if server_client is not None else None
+
+# Visualization for feedback ratings, from the per-rating counts
+rating_counts = metrics_store.rating_counts(metrics_scope)
+if rating_counts:
     st.subheader("Feedback Ratings Distribution")
-    
-    feedback_df = pd.DataFrame(st.session_state.feedback_history)
-    if not feedback_df.empty:
-        feedback_summary = feedback_df["rating"].value_counts().sort_index()
-
-        # Plot a colorful bar chart
-        fig, ax = plt.subplots()
-        feedback_summary.plot.bar(
-            ax=ax,
-            color=['red', 'orange', 'yellow', 'green', 'blue'],  # Distinct colors for each rating
-            edgecolor='black'
-        )
-        ax.set_title("Number of Queries by Feedback Rating")
-        ax.set_xlabel("Feedback Rating (1 to 5)")
-        ax.set_ylabel("Number of Queries")
-        ax.grid(axis='y', linestyle='--', alpha=0.7)
-        
-        st.pyplot(fig)
-
-# Visualization for query response times
-if st.session_state.query_times:
+    _, plt = plotting()
+
+    # Plot a colorful bar chart
+    colors = {1: 'red', 2: 'orange', 3: 'yellow', 4: 'green', 5: 'blue'}  # Distinct colors for each rating
+    fig, ax = plt.subplots()
+    ax.bar(
+        [str(rating) for rating in rating_counts],
+        list(rating_counts.values()),
+        color=[colors.get(rating, 'gray') for rating in rating_counts],
+        edgecolor='black'
+    )
+    ax.set_title("Number of Queries by Feedback Rating")
+    ax.set_xlabel("Feedback Rating (1 to 5)")
+    ax.set_ylabel("Number of Queries")
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+
+    st.pyplot(fig)
+
+# Visualization for query response times: the most recent questions, the latency histogram
+# and answer cache hit rates alongside
+response_summary = metrics_store.latency_summary("response", metrics_scope)
+if response_summary["count"]:
     st.subheader("Query Response Times")
-    response_df = pd.DataFrame({"Query #": range(1, len(st.session_state.query_times) + 1), "Response Time (s)": st.session_state.query_times})
+    _, plt = plotting()
+    chart_column, cache_column = st.columns([3, 1])
+    recent = metrics_store.recent_timings(metrics_scope)
+    query_numbers = range(response_summary["count"] - len(recent) + 1, response_summary["count"] + 1)
+    response_times = [total for total, _ in recent]
+    first_token_times = [float("nan") if first_token is None else first_token for _, first_token in recent]
     fig, ax = plt.subplots()
-    ax.plot(response_df["Query #"], response_df["Response Time (s)"], marker='o', color='purple', linewidth=2)
-    ax.set_title("Response Time per Query")
+    ax.plot(query_numbers, response_times, marker='o', color='purple', linewidth=2, label="Total")
+    ax.plot(query_numbers, first_token_times, marker='s', color='teal', linewidth=2, label="First token")
+    ax.set_title(f"Response Time per Query (last {len(recent)})")
     ax.set_xlabel("Query #")
     ax.set_ylabel("Response Time (seconds)")
     ax.grid(axis='both', linestyle='--', alpha=0.7)
-    st.pyplot(fig)
+    ax.legend()
+    chart_column.pyplot(fig)
 
-# Add download button for feedback logs
-if st.session_state.feedback_history:
-    st.subheader("Download Feedback Logs")
+    histogram = metrics_store.latency_histogram("response", metrics_scope)
+    fig, ax = plt.subplots()
+    ax.bar([f"≤{bucket_edge(bucket):.2g}s" for bucket in histogram], [count for count, _ in histogram.values()],
+           color='purple', edgecolor='black')
+    ax.set_title("Response Time Distribution")
+    ax.set_xlabel("Response Time")
+    ax.set_ylabel("Number of Queries")
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+    chart_column.pyplot(fig)
 
-    # Create a DataFrame from the feedback history
-    feedback_df = pd.DataFrame(st.session_state.feedback_history)
+    cache_column.metric("Response time p50 / p95", f"{response_summary['p50']:.2g}s / {response_summary['p95']:.2g}s")
+    cache_stats = server_stats["answer_cache"] if server_client is not None else get_answer_cache().stats()
+    cache_column.metric("Answer cache hit rate", f"{cache_stats['hit_rate']:.0%}")
+    cache_column.metric("Exact hits", cache_stats["exact_hits"])
+    cache_column.metric("Near-duplicate hits", cache_stats["semantic_hits"])
+    cache_column.metric("Misses", cache_stats["misses"])
 
-    # Convert the DataFrame to CSV
-    csv_data = feedback_df.to_csv(index=False)
+# Latency breakdown per pipeline stage (fetch, parse, split, embed, upsert, retrieve, rerank, generate)
+# over the most recent spans recorded by this Streamlit process, or by the query server
+stage_stats = server_stats["stages"] if server_client is not None else get_tracer().stage_stats()
+if stage_stats:
+    st.subheader("Latency Breakdown by Stage")
+    pd, plt = plotting()
+    stage_df = pd.DataFrame([
+        {"Stage": stage, "Count": values["count"], "p50 (ms)": values["p50"] * 1000, "p95 (ms)": values["p95"] * 1000}
+        for stage, values in stage_stats.items()
+    ])
+    table_column, stage_chart_column = st.columns([2, 3])
+    table_column.dataframe(stage_df.round(1), hide_index=True)
+    fig, ax = plt.subplots()
+    stage_df.plot.barh(x="Stage", y=["p50 (ms)", "p95 (ms)"], ax=ax, color=["teal", "purple"])
+    ax.invert_yaxis()
+    ax.set_title("Stage Latency (p50 / p95)")
+    ax.set_xlabel("Milliseconds")
+    ax.grid(axis='x', linestyle='--', alpha=0.7)
+    stage_chart_column.pyplot(fig)
 
-    # Provide a download link for the CSV file
+# Add download button for feedback logs, streamed from the metrics store when clicked
+if rating_counts:
+    st.subheader("Download Feedback Logs")
     st.download_button(
         label="Download Feedback Logs as CSV",
-        data=csv_data,
+        data=lambda: metrics_store.export_feedback_csv(metrics_scope),
         file_name="feedback_logs.csv",
         mime="text/csv"
     )
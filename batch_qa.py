@@ -0,0 +1,105 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import config
+from streaming import AnswerStream
+
+
+# Function to read questions from a JSONL file ({"id": ..., "question": ...} objects or plain
+# strings per line) or a CSV file with a "question" column and an optional "id" column.
+# Items without an id are numbered by their position in the file.
+def read_questions(path):
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for number, row in enumerate(rows, start=1):
+            if isinstance(row, str):
+                row = {"question": row}
+            question = (row.get("question") or "").strip()
+            if question:
+                yield str(row.get("id") or number), question
+
+
+# Function to prepare an output file for resuming an interrupted run: the file is rewritten
+# with one answered record per id, dropping failed records (their questions are asked again
+# and appended), records without an id and lines cut short by the interruption. Returns the
+# ids already answered.
+def prepare_resume(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    temporary = f"{path}.resume"
+    with open(path, encoding="utf-8") as f, open(temporary, "w", encoding="utf-8") as out:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(record, dict) or record.get("id") is None or record.get("error"):
+                continue
+            if str(record["id"]) not in done:
+                done.add(str(record["id"]))
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(temporary, path)
+    return done
+
+
+# Function to answer one question and describe the outcome as a JSON-serialisable record
+# with the answer, its sources and per-stage timings (seconds). `on_sources(documents)` and
+# `on_token(text)` observe the answer while it streams.
+def answer_question(chain, item_id, question, on_sources=None, on_token=None):
+    start = time.perf_counter()
+    record = {"id": item_id, "question": question}
+    stream = AnswerStream(chain, {"question": question}, on_sources=on_sources, final_answer_only=True)
+    try:
+        for token in stream:
+            if on_token is not None:
+                on_token(token)
+        result = stream.result
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        record["timings"] = {"total": time.perf_counter() - start}
+        return record
+
+    record["answer"] = result["answer"].strip()
+    record["sources"] = [source.strip() for source in result.get("sources", "").split(",") if source.strip()]
+    record["retrieved"] = list(dict.fromkeys(doc.metadata.get("source", "") for doc in stream.source_documents))
+    record["timings"] = {
+        "retrieval": stream.retrieval_time,
+        "first_token": stream.time_to_first_token,
+        "generation": stream.total_time - (stream.retrieval_time or 0.0),
+        "total": stream.total_time,
+    }
+    if stream.rerank_report is not None:
+        record["prompt_tokens"] = stream.rerank_report.packed_tokens
+        record["prompt_tokens_saved"] = stream.rerank_report.tokens_saved
+    return record
+
+
+# Function to answer (id, question) pairs with `answer(id, question) -> record` (e.g. a
+# partial of answer_question, or a server client's ask), with at most `concurrency` questions
+# in flight, yielding records as they complete. Questions are pulled from the iterable
+# lazily, so question sets of any size run in constant memory.
+def iter_answers(answer, items, concurrency=config.ASK_CONCURRENCY):
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        try:
+            while True:
+                for item_id, question in items:
+                    pending.add(executor.submit(answer, item_id, question))
+                    if len(pending) >= concurrency:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
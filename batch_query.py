@@ -0,0 +1,106 @@
+import functools
+import itertools
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import config
+from batch_qa import answer_question, iter_answers
+
+# Batched question answering. Instead of one embedding call, one vector search and one LLM call
+# per question, a batch of questions is embedded in one request and searched in one matrix-level
+# top-k pass over the stored vectors (Chroma's multi-query search, the memory-mapped index's
+# batch scan, or both fanned out over shards). BM25 search, fusion and re-ranking stay per
+# question. Chunks retrieved by several questions of the batch are shared as one Document. Only
+# then do the generation calls fan out, `concurrency` at a time, through the usual
+# RetrievalQAWithSourcesChain with the retrieved passages filled in.
+# main_python.py ask uses it for question files (--batch-size); `python benchmark.py
+# --batch-sizes 1,16,256` measures queries/sec per batch size.
+
+
+# Function to search many query vectors at once: one list of (document, distance) per vector,
+# closest first. Stores with their own batch search (memory-mapped index, sharded view) use it;
+# a Chroma collection answers every vector in a single query.
+def batch_similarity_search(vectorstore, vectors, k, filter=None):
+    if not len(vectors):
+        return []
+    if hasattr(vectorstore, "batch_similarity_search"):
+        return vectorstore.batch_similarity_search(vectors, k=k, filter=filter)
+    found = vectorstore._collection.query(
+        query_embeddings=[list(map(float, vector)) for vector in vectors], n_results=k, where=filter,
+        include=["documents", "metadatas", "distances"]
+    )
+    return [
+        [(Document(id=chunk_id, page_content=text or "", metadata=metadata or {}), distance)
+         for chunk_id, text, metadata, distance in zip(ids, texts, metadatas, distances)]
+        for ids, texts, metadatas, distances in zip(found["ids"], found["documents"], found["metadatas"],
+                                                     found["distances"])
+    ]
+
+
+# Passages retrieved for a batch of questions
+@dataclass
+class BatchRetrieval:
+    documents: list  # one document list per question; a chunk found by several questions is one shared object
+    passages: int  # passages over all questions
+    unique_passages: int  # distinct chunks among them
+    seconds: float
+
+
+# Function to retrieve for many questions at once with a retriever from pipeline.make_retriever
+# (HybridRetriever, optionally wrapped by RerankingRetriever); other retrievers are invoked per question
+def batch_retrieve(retriever, questions):
+    from hybrid_retrieval import HybridRetriever, document_key
+    from reranking import RerankingRetriever
+
+    questions = list(questions)
+    start = time.perf_counter()
+    inner = retriever.retriever if isinstance(retriever, RerankingRetriever) else retriever
+    if isinstance(inner, HybridRetriever):
+        candidates = inner.batch_search(questions)
+    else:
+        candidates = [inner.invoke(question) for question in questions]
+
+    shared = {}
+    candidates = [[shared.setdefault(document_key(document), document) for document in found] for found in candidates]
+    if inner is not retriever:
+        documents = [retriever.select(question, found) for question, found in zip(questions, candidates)]
+    else:
+        documents = candidates
+    return BatchRetrieval(
+        documents=documents,
+        passages=sum(len(found) for found in candidates),
+        unique_passages=len(shared),
+        seconds=time.perf_counter() - start,
+    )
+
+
+# Retriever returning passages retrieved beforehand, so the QA chain generates without retrieving again
+class PrecomputedRetriever(BaseRetriever):
+    documents: Any  # question -> documents
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.documents.get(query, [])
+
+
+# Function to answer (id, question) pairs `batch_size` at a time: each batch is retrieved together,
+# then its generation calls fan out `concurrency` at a time through answer_question. Yields the
+# answer records as they complete, each with the batch's retrieval time and passage counts.
+def iter_batch_answers(llm, retriever, items, batch_size=config.ASK_BATCH_SIZE, concurrency=config.ASK_CONCURRENCY):
+    from pipeline import make_chain
+
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batch_size))
+        if not batch:
+            return
+        retrieval = batch_retrieve(retriever, [question for _, question in batch])
+        documents = dict(zip((question for _, question in batch), retrieval.documents))
+        chain = make_chain(llm, PrecomputedRetriever(documents=documents))
+        for record in iter_answers(functools.partial(answer_question, chain), batch, concurrency):
+            record["batch"] = {"size": len(batch), "retrieval": retrieval.seconds, "passages": retrieval.passages,
+                               "unique_passages": retrieval.unique_passages}
+            yield record
@@ -0,0 +1,330 @@
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from reporting import report_header
+
+# Offline end-to-end benchmark of the ingest and query paths.
+#   python benchmark.py --sizes 10,100,1000,10000 --output benchmark_results.json
+#   python benchmark.py --sizes 1000 --compare benchmark_results.json
+#   python benchmark.py --split-memory 1,100,500 [--split-mode materialized]
+#   python benchmark.py --sizes 1000 --batch-sizes 1,16,64,256
+#   SMARTSEARCH_VECTOR_BACKEND=mmap python benchmark.py --sizes 1000   (settings pass through)
+# Each corpus size runs in a fresh subprocess against the fixture corpus (fixture_corpus.py)
+# served on localhost, with the hash embedder and the fake streaming chat model in place of
+# OpenAI, its own vector store and an empty embedding cache, so every run starts cold and
+# peak memory is measured per size. Results are written as JSON for diffing between commits.
+# --split-memory measures the split -> embed -> write stage alone on corpora of the given
+# sizes in MB (--page-mb per page; a size up to one page is a single page), writing to a sink
+# that discards vectors, so peak memory reflects the ingest pipeline rather than the store.
+# --batch-sizes also answers max(--queries, largest batch) questions through batch_query.py at
+# each batch size and reports retrieval and end-to-end queries/sec; each batch size asks its own
+# questions, so the query embedding cache does not favour later ones.
+
+
+# Function to run one corpus size in this process and return its measurements
+def run_size(args):
+    # Imported here: the environment must select the fake backends before config is loaded
+    import functools
+
+    import config
+    from batch_qa import answer_question, iter_answers
+    from fixture_corpus import FixtureServer, questions
+    from ingestion import iter_ingest
+    from instrumentation import get_tracer
+    from pipeline import Pipeline
+
+    tracer = get_tracer()
+    size = int(args.size)
+    pages = max(1, math.ceil(size / args.paragraphs))
+    pipeline = Pipeline(path=os.path.join(args.workdir, "store"), chunk_size=args.chunk_size or config.CHUNK_SIZE,
+                        chunk_overlap=args.chunk_overlap if args.chunk_overlap is not None else config.CHUNK_OVERLAP)
+    result = {"size": size, "pages": pages}
+
+    with FixtureServer(pages, args.paragraphs) as server:
+        start = time.perf_counter()
+        added = loaded = 0
+        with tracer.span("ingest", urls=pages):
+            for ingested in iter_ingest(server.urls(), parse_workers=args.parse_workers):
+                if ingested.ok:
+                    loaded += 1
+                    added += pipeline.index_sync.sync_document(ingested.document, pipeline.split_documents).added
+        elapsed = time.perf_counter() - start
+    if not loaded:  # the query numbers would measure an empty index
+        raise RuntimeError(f"None of the {pages} fixture pages could be ingested")
+    result["chunks"] = added
+    result["ingest"] = {
+        "seconds": elapsed,
+        "docs_per_second": loaded / elapsed,
+        "chunks_per_second": added / elapsed,
+        "failed_pages": pages - loaded,
+    }
+
+    items = [(str(i), question) for i, (question, _) in enumerate(questions(pages, args.queries))]
+    expected = {str(i): answer for i, (_, answer) in enumerate(questions(pages, args.queries))}
+    start = time.perf_counter()
+    records = list(iter_answers(functools.partial(answer_question, pipeline.chain), items, args.concurrency))
+    elapsed = time.perf_counter() - start
+    result["query"] = {
+        "seconds": elapsed,
+        "queries_per_second": len(records) / elapsed,
+        "errors": sum(1 for record in records if record.get("error")),
+        # Share of answers quoting the expected price: a cheap guard against speed-ups that break retrieval
+        "answer_accuracy": sum(expected[r["id"]] in r.get("answer", "") for r in records) / max(len(records), 1),
+    }
+
+    if args.batch_sizes:
+        result["batches"] = run_batches(args, pipeline, pages)
+
+    result["stages"] = tracer.stage_stats()
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KiB on Linux
+    result["peak_memory_mb"] = usage * scale / 2 ** 20
+    result["peak_child_memory_mb"] = children * scale / 2 ** 20  # parse worker processes
+    result["config"] = {"retrieval_mode": config.RETRIEVAL_MODE, "rerank": config.RERANK_ENABLED,
+                        "qa_chain_type": config.QA_CHAIN_TYPE, "vector_backend": config.VECTOR_BACKEND,
+                        "chunk_unit": config.CHUNK_UNIT, "chunk_size": pipeline.chunk_size}
+    return result
+
+
+# Function to measure batched question answering at each of --batch-sizes: retrieval alone
+# (batch_retrieve), then retrieval and generation (iter_batch_answers)
+def run_batches(args, pipeline, pages):
+    from batch_query import batch_retrieve, iter_batch_answers
+    from fixture_corpus import questions
+
+    sizes = [int(value) for value in args.batch_sizes.split(",")]
+    count = max(args.queries, *sizes)
+    results = []
+    for batch_size in sizes:
+        asked = questions(pages, count, seed=f"batch:{batch_size}")
+        texts = [question for question, _ in asked]
+        retriever = pipeline.chain.retriever
+        passages = unique = 0
+        start = time.perf_counter()
+        for first in range(0, count, batch_size):
+            retrieval = batch_retrieve(retriever, texts[first:first + batch_size])
+            passages += retrieval.passages
+            unique += retrieval.unique_passages
+        retrieval_seconds = time.perf_counter() - start
+
+        items = [(str(i), question) for i, question in enumerate(texts)]
+        start = time.perf_counter()
+        records = list(iter_batch_answers(pipeline.llm, retriever, items, batch_size, args.concurrency))
+        elapsed = time.perf_counter() - start
+        results.append({
+            "batch_size": batch_size,
+            "questions": count,
+            "retrieval_queries_per_second": count / retrieval_seconds,
+            "queries_per_second": len(records) / elapsed,
+            "unique_passage_share": unique / max(passages, 1),  # what deduplication leaves of the retrieved passages
+            "errors": sum(1 for record in records if record.get("error")),
+            "answer_accuracy": sum(asked[int(r["id"])][1] in r.get("answer", "") for r in records) / max(len(records), 1),
+        })
+    return results
+
+
+# Function to stream a synthetic corpus of `args.size` MB through splitting and embedding and
+# return its measurements. "streaming" is the ingest path (chunks pulled lazily by the embedding
+# scheduler); "materialized" splits everything, then embeds everything, for comparison.
+def run_split_memory(args):
+    import config
+    from chunking import iter_split_documents
+    from embedding_scheduler import EmbeddingJob, EmbeddingScheduler
+    from fake_backends import HashEmbeddings
+    from fixture_corpus import page_paragraphs
+    from langchain_core.documents import Document
+    from pipeline import make_text_splitter
+
+    pool = page_paragraphs(0, 200)
+    page_chars = int(args.page_mb * 2 ** 20)
+    pages = max(1, round(args.size / args.page_mb))
+    page_chars = int(args.size * 2 ** 20) if pages == 1 else page_chars
+
+    # Pages are generated one at a time, so the corpus itself is never held in memory
+    def documents():
+        for index in range(pages):
+            texts, length, position = [], 0, index
+            while length < page_chars:
+                texts.append(pool[position % len(pool)])
+                length += len(texts[-1]) + 2
+                position += 7
+            yield Document(page_content="\n\n".join(texts), metadata={"source": f"page/{index}"})
+
+    splitter = make_text_splitter(args.chunk_size or config.CHUNK_SIZE,
+                                  args.chunk_overlap if args.chunk_overlap is not None else config.CHUNK_OVERLAP)
+    embeddings = HashEmbeddings(dim=64)
+    counts = {"chunks": 0}
+
+    def sink(batch, vectors):
+        counts["chunks"] += len(batch)
+
+    scale = 1 if sys.platform == "darwin" else 1024
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+    start = time.perf_counter()
+    if args.split_mode == "materialized":
+        chunks = splitter.split_documents(list(documents()))
+        sink(chunks, embeddings.embed_documents([chunk.page_content for chunk in chunks]))
+    else:
+        jobs = (EmbeddingJob(str(i), chunk.page_content, chunk.metadata)
+                for i, chunk in enumerate(iter_split_documents(documents(), splitter)))
+        EmbeddingScheduler(embeddings).run(jobs, sink)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+    return {
+        "size_mb": args.size, "pages": pages, "mode": args.split_mode, "chunks": counts["chunks"],
+        "seconds": elapsed, "mb_per_second": args.size / elapsed,
+        "baseline_memory_mb": baseline, "peak_memory_mb": peak, "peak_growth_mb": peak - baseline,
+    }
+
+
+# Function to run one corpus size in a fresh subprocess with its own store and embedding cache
+def run_size_subprocess(args, size):
+    with tempfile.TemporaryDirectory(prefix="smartsearch-bench-") as workdir:
+        env = {
+            **os.environ,
+            "SMARTSEARCH_FAKE_BACKENDS": "1",
+            "SMARTSEARCH_FAKE_LLM_LATENCY": str(args.llm_latency),
+            "SMARTSEARCH_FAKE_LLM_TOKEN_LATENCY": str(args.token_latency),
+            "SMARTSEARCH_FAKE_EMBED_LATENCY": str(args.embed_latency),
+            "SMARTSEARCH_EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+            "SMARTSEARCH_TRACE_EXPORT": "none",
+        }
+        command = [
+            sys.executable, os.path.abspath(__file__), "--worker", "--size", str(size), "--workdir", workdir,
+            "--paragraphs", str(args.paragraphs), "--queries", str(args.queries),
+            "--concurrency", str(args.concurrency), "--parse-workers", str(args.parse_workers),
+            "--page-mb", str(args.page_mb), "--split-mode", args.split_mode,
+        ]
+        if args.chunk_size:
+            command += ["--chunk-size", str(args.chunk_size)]
+        if args.chunk_overlap is not None:
+            command += ["--chunk-overlap", str(args.chunk_overlap)]
+        if args.batch_sizes:
+            command += ["--batch-sizes", args.batch_sizes]
+        if args.split_memory:
+            command += ["--split-memory", args.split_memory]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise RuntimeError(f"Benchmark for size {size} failed:\n{completed.stderr[-4000:]}")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+# Headline numbers compared by --compare (higher is better unless listed in _LOWER_IS_BETTER)
+_HEADLINE = [
+    ("ingest", "docs_per_second"), ("ingest", "chunks_per_second"),
+    ("query", "queries_per_second"), ("query", "answer_accuracy"), (None, "peak_memory_mb"),
+]
+_LOWER_IS_BETTER = {"peak_memory_mb"}
+
+
+# Function to print headline metrics of this run next to a previous report
+def compare(results, baseline_report):
+    baseline = {entry["size"]: entry for entry in baseline_report["results"]}
+    for entry in results:
+        old = baseline.get(entry["size"])
+        if old is None:
+            continue
+        print(f"size={entry['size']}")
+        for section, metric in _HEADLINE:
+            new_value = entry[section][metric] if section else entry[metric]
+            old_value = old[section][metric] if section else old[metric]
+            change = (new_value - old_value) / old_value if old_value else 0.0
+            better = change < 0 if metric in _LOWER_IS_BETTER else change > 0
+            flag = "" if abs(change) < 0.05 else (" better" if better else " WORSE")
+            print(f"  {metric:<20} {old_value:12.2f} -> {new_value:12.2f} ({change:+.1%}){flag}")
+
+
+# Function to run --split-memory sizes and write their measurements
+def split_memory_report(args):
+    results = []
+    for size in [float(value) for value in args.split_memory.split(",")]:
+        result = run_size_subprocess(args, size)
+        results.append(result)
+        print(
+            f"{size:>7g} MB {result['pages']:>5} pages {result['chunks']:>8} chunks | "
+            f"{result['mb_per_second']:6.1f} MB/s | peak {result['peak_memory_mb']:6.0f} MB "
+            f"(+{result['peak_growth_mb']:.0f} MB over baseline, {result['mode']})"
+        )
+    report = {**report_header(), "split_memory": results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingest/query benchmark with fake backends")
+    parser.add_argument("--sizes", default="10,100,1000", help="comma-separated corpus sizes in chunks")
+    parser.add_argument("--paragraphs", type=int, default=20, help="paragraphs (about one chunk each) per page")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--parse-workers", type=int, default=2)
+    parser.add_argument("--chunk-size", type=int, help="chunk size in SMARTSEARCH_CHUNK_UNIT (default: the configured one)")
+    parser.add_argument("--chunk-overlap", type=int)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="fake LLM seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="fake LLM seconds between tokens")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="fake seconds per embedding request")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="previous result file to compare against")
+    parser.add_argument("--batch-sizes", help="comma-separated batch sizes: also benchmark batched question answering")
+    parser.add_argument("--split-memory", help="comma-separated corpus sizes in MB: benchmark split/embed memory only")
+    parser.add_argument("--page-mb", type=float, default=1.0, help="page size in MB for --split-memory corpora")
+    parser.add_argument("--split-mode", choices=["streaming", "materialized"], default="streaming")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=float, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_split_memory(args) if args.split_memory else run_size(args)))
+        return
+
+    baseline = None
+    if args.compare:  # read first: it may be the file about to be overwritten
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.split_memory:
+        return split_memory_report(args)
+
+    results = []
+    for size in [int(value) for value in args.sizes.split(",")]:
+        result = run_size_subprocess(args, size)
+        results.append(result)
+        print(
+            f"size={size:>7} chunks={result['chunks']:>7} "
+            f"ingest {result['ingest']['docs_per_second']:8.1f} docs/s {result['ingest']['chunks_per_second']:9.1f} chunks/s | "
+            f"query {result['query']['queries_per_second']:6.1f} q/s accuracy {result['query']['answer_accuracy']:.0%} | "
+            f"peak {result['peak_memory_mb']:.0f} MB"
+        )
+        for batch in result.get("batches", []):
+            print(
+                f"  batch={batch['batch_size']:>4} retrieval {batch['retrieval_queries_per_second']:8.1f} q/s | "
+                f"end-to-end {batch['queries_per_second']:7.1f} q/s accuracy {batch['answer_accuracy']:.0%} | "
+                f"{batch['unique_passage_share']:.0%} of passages unique"
+            )
+
+    report = {
+        **report_header(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("worker", "size", "workdir")},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if baseline is not None:
+        compare(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
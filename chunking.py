@@ -0,0 +1,378 @@
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from itertools import islice
+from urllib.parse import urlsplit
+
+import config
+from tokenization import count_tokens
+
+# Streaming split stage: chunks are produced lazily, one bounded segment of text at a time,
+# instead of splitting whole documents into one list. Consumers pull chunks as they have room
+# for them (see IndexSync.sync_source), so the chunk list and the embeddings of a long page
+# are never held in memory at once.
+#
+# With CHUNK_UNIT "tokens" (the default) pages are split by StructuredTokenSplitter: along the
+# elements unstructured found (headings, paragraphs, list items, tables), packed into chunks of
+# up to CHUNK_SIZE tokens of the local tokenizer, so each retrieved passage costs about the same
+# share of the prompt. A BoilerplateIndex leaves out blocks repeated across the pages of a site
+# (navigation, footers, cookie notices). `python chunking.py URL ...` reports what this saves
+# over the character splitter: chunks embedded and prompt tokens per query.
+
+ELEMENTS_KEY = "elements"  # document metadata set by ingestion.to_document: (category, length) per element
+HEADING_CATEGORIES = {"Title"}
+_WHITESPACE = re.compile(r"\s+")
+
+
+# Function to split a text lazily with a LangChain text splitter. The text is split in segments
+# of about `segment_chars`; the last chunk of each segment is not emitted but re-split with the
+# next segment, so chunks never end at a segment boundary. Texts shorter than one segment
+# produce exactly the chunks of text_splitter.split_text.
+def iter_split_text(text, text_splitter, segment_chars=config.SPLIT_SEGMENT_CHARS):
+    # A segment must hold several chunks, or the carried-over tail would never shrink
+    segment_chars = max(segment_chars, 4 * getattr(text_splitter, "_chunk_size", 0))
+    start = 0
+    while len(text) - start > segment_chars:
+        segment = text[start:start + segment_chars]
+        chunks = text_splitter.split_text(segment)
+        tail = segment.rfind(chunks[-1]) if len(chunks) > 1 else 0
+        if tail <= 0:  # no usable boundary (or blank segment): emit the segment as split
+            yield from chunks
+            start += segment_chars
+            continue
+        yield from chunks[:-1]
+        start += tail
+    yield from text_splitter.split_text(text[start:])
+
+
+# Function to split documents lazily, yielding one chunk Document at a time with a copy of
+# its document's metadata (the streaming counterpart of text_splitter.split_documents).
+# Splitters with their own split_document (StructuredTokenSplitter) split each document themselves.
+def iter_split_documents(documents, text_splitter, segment_chars=config.SPLIT_SEGMENT_CHARS):
+    from langchain_core.documents import Document  # not needed by iter_windows users (index_sync)
+
+    for document in documents:
+        if hasattr(text_splitter, "split_document"):
+            yield from text_splitter.split_document(document)
+            continue
+        metadata = chunk_metadata(document)
+        for text in iter_split_text(document.page_content, text_splitter, segment_chars):
+            yield Document(page_content=text, metadata=dict(metadata))
+
+
+# Function to give the metadata a document's chunks carry (everything but the element layout)
+def chunk_metadata(document):
+    return {key: value for key, value in document.metadata.items() if key != ELEMENTS_KEY}
+
+
+# Function to yield the (category, text) blocks of a document: its unstructured elements when
+# ingestion recorded them, otherwise its paragraphs (blank-line separated) as "Text"
+def iter_blocks(document):
+    text = document.page_content
+    elements = document.metadata.get(ELEMENTS_KEY)
+    if elements is None:
+        start = 0
+        while start < len(text):
+            end = text.find("\n\n", start)
+            end = len(text) if end < 0 else end
+            if text[start:end].strip():
+                yield "Text", text[start:end].strip()
+            start = end + 2
+        return
+    position = 0
+    for category, length in elements:
+        block = text[position:position + length].strip()
+        position += length + 2  # to_document joins elements with a blank line
+        if block:
+            yield category, block
+
+
+# Function to build the splitter for blocks longer than a chunk: token-sized pieces, tables cut between rows
+def make_block_splitter(chunk_size, chunk_overlap, table=False):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
+        separators=["\n", " "] if table else ["\n\n", "\n", ". ", ", ", " "],
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=count_tokens,
+    )
+
+
+# Splits documents along their structure into chunks of at most `chunk_size` tokens. Consecutive
+# blocks of a section are packed together; a heading starts a new chunk and is repeated at the
+# top of every chunk of its section (a heading with no content after it is dropped). When a
+# chunk is full, its last blocks up to `chunk_overlap` tokens start the next one. Blocks longer
+# than a chunk are split by tokens on their own. `totals` counts what was split and left out.
+class StructuredTokenSplitter:
+    def __init__(self, chunk_size=config.CHUNK_SIZE, chunk_overlap=config.CHUNK_OVERLAP, boilerplate=None):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.boilerplate = boilerplate
+        self.totals = Counter()
+        self._lock = threading.Lock()  # documents may be split on several threads (server, re-crawls)
+
+    def split_document(self, document):
+        from langchain_core.documents import Document
+
+        metadata = chunk_metadata(document)
+        blocks = iter_blocks(document)
+        if self.boilerplate is not None:
+            blocks, dropped = self.boilerplate.filter(metadata.get("source", ""), list(blocks))
+            self._count(documents=1, boilerplate_blocks=len(dropped),
+                        boilerplate_tokens=sum(count_tokens(text) for _, text in dropped))
+        else:
+            self._count(documents=1)
+        for text, tokens in self._pack(blocks):
+            self._count(chunks=1, chunk_tokens=tokens)
+            yield Document(page_content=text, metadata=dict(metadata))
+
+    # All chunks of some documents as a list (the LangChain text splitter method)
+    def split_documents(self, documents):
+        return list(iter_split_documents(documents, self))
+
+    def _count(self, **counts):
+        with self._lock:
+            self.totals.update(counts)
+
+    # Yield (chunk text, tokens) for a stream of blocks
+    def _pack(self, blocks):
+        headings, parts, size = [], [], 0  # parts: (text, tokens) of the chunk being filled
+        for category, text in blocks:
+            if category in HEADING_CATEGORIES:
+                if parts:
+                    yield _join(headings, parts)
+                    headings = []
+                headings = (headings + [text])[-2:]  # a subheading keeps the heading right above it
+                parts, size = [], 0
+                continue
+            heading_tokens = sum(count_tokens(heading) for heading in headings)
+            budget = max(self.chunk_size - heading_tokens, self.chunk_size // 2)
+            for piece, tokens in self._pieces(category, text, budget):
+                if parts and size + tokens > budget:
+                    yield _join(headings, parts)
+                    parts = _overlap(parts, self.chunk_overlap)
+                    size = sum(part_tokens for _, part_tokens in parts)
+                    if size + tokens > budget:
+                        parts, size = [], 0
+                parts.append((piece, tokens))
+                size += tokens
+        if parts:
+            yield _join(headings, parts)
+
+    # Yield (text, tokens) pieces of one block, splitting it when it exceeds `budget` tokens
+    def _pieces(self, category, text, budget):
+        tokens = count_tokens(text)
+        if tokens <= budget:
+            yield text, tokens
+            return
+        splitter = make_block_splitter(budget, min(self.chunk_overlap, budget // 2), table=category == "Table")
+        for piece in iter_split_text(text, splitter):
+            yield piece, count_tokens(piece)
+
+
+# Function to summarise a StructuredTokenSplitter's totals on one line
+def describe_totals(totals):
+    line = f"Split {totals['documents']} pages into {totals['chunks']} chunks"
+    if totals["chunks"]:
+        line += f" of {totals['chunk_tokens'] / totals['chunks']:.0f} tokens on average"
+    if totals["boilerplate_blocks"]:
+        line += f"; left out {totals['boilerplate_blocks']} boilerplate blocks ({totals['boilerplate_tokens']} tokens)"
+    return line
+
+
+# Function to join a chunk's headings and parts into its text and token count
+def _join(headings, parts):
+    texts = headings + [text for text, _ in parts]
+    return "\n\n".join(texts), sum(count_tokens(heading) for heading in headings) + sum(t for _, t in parts)
+
+
+# Function to keep the trailing parts of a full chunk that fit in `overlap` tokens
+def _overlap(parts, overlap):
+    kept, size = [], 0
+    for text, tokens in reversed(parts):
+        if size + tokens > overlap:
+            break
+        kept.insert(0, (text, tokens))
+        size += tokens
+    return kept
+
+
+# Function to hash a block for boilerplate detection (case and whitespace do not matter)
+def block_hash(text):
+    return hashlib.sha256(_WHITESPACE.sub(" ", text).strip().lower().encode("utf-8")).hexdigest()
+
+
+# Records which pages of each site (URL host) contain each block, in SQLite next to the vector
+# store. A block found on at least `min_pages` pages of a site is boilerplate: it stays in the
+# first page that had it and is left out of every other one, so it is embedded and retrieved
+# once rather than once per page. Headings are never filtered (StructuredTokenSplitter drops
+# the ones left without content). Indexing a page can change what other pages should leave out
+# (a block becomes boilerplate, or a page releases a block another page left out); those pages
+# are marked stale, and every ingest path re-indexes them after its batch (stale(),
+# ingestion.resync_stale), as does the re-crawl worker.
+class BoilerplateIndex:
+    def __init__(self, path, min_pages=config.BOILERPLATE_MIN_PAGES):
+        self.path = path
+        self.min_pages = min_pages
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blocks (id INTEGER PRIMARY KEY, site TEXT, hash TEXT, source TEXT,"
+            " UNIQUE (site, hash, source))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS blocks_source ON blocks (site, source)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS stale (source TEXT PRIMARY KEY)")
+        self._conn.commit()
+
+    # Record the blocks of a page and split them into (kept blocks, boilerplate left out)
+    def filter(self, source, blocks):
+        site = urlsplit(source).netloc or source
+        hashes = [None if category in HEADING_CATEGORIES else block_hash(text) for category, text in blocks]
+        current = set(filter(None, hashes))
+        with self._lock:
+            known = {row[0] for row in self._conn.execute(
+                "SELECT hash FROM blocks WHERE site = ? AND source = ?", (site, source)
+            )}
+            changed = sorted(known ^ current)
+            before = self._pages(site, changed)
+            self._conn.executemany("DELETE FROM blocks WHERE site = ? AND hash = ? AND source = ?",
+                                   [(site, digest, source) for digest in known - current])
+            self._conn.executemany("INSERT OR IGNORE INTO blocks (site, hash, source) VALUES (?, ?, ?)",
+                                   [(site, digest, source) for digest in current - known])
+            after = self._pages(site, changed)
+            stale = {page for digest in changed for page in set(before.get(digest, [])) | set(after.get(digest, []))
+                     if page != source and self._left_out(before.get(digest, []), page)
+                     != self._left_out(after.get(digest, []), page)}
+            self._conn.execute("DELETE FROM stale WHERE source = ?", (source,))
+            self._conn.executemany("INSERT OR IGNORE INTO stale VALUES (?)", [(page,) for page in stale])
+            pages = self._pages(site, sorted(current))
+            self._conn.commit()
+        kept, dropped = [], []
+        for block, digest in zip(blocks, hashes):
+            boilerplate = digest is not None and self._left_out(pages.get(digest, [source]), source)
+            (dropped if boilerplate else kept).append(block)
+        return kept, dropped
+
+    # Whether `page` leaves out a block found on `pages` (first one first)
+    def _left_out(self, pages, page):
+        return len(pages) >= self.min_pages and page in pages and pages[0] != page
+
+    # Sources containing each of `hashes` on a site, first one first (called with the lock held)
+    def _pages(self, site, hashes):
+        pages = {}
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            for digest, page in self._conn.execute(
+                f"SELECT hash, source FROM blocks WHERE site = ? AND hash IN ({','.join('?' * len(batch))})"
+                " ORDER BY id", [site] + batch
+            ):
+                pages.setdefault(digest, []).append(page)
+        return pages
+
+    # Pages to re-index because what they should leave out changed since they were last split
+    def stale(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT source FROM stale ORDER BY source")]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Function to group an iterable into lists of at most `size` items, pulling lazily
+def iter_windows(items, size=config.SYNC_WINDOW_CHUNKS):
+    items = iter(items)
+    while True:
+        window = list(islice(items, size))
+        if not window:
+            return
+        yield window
+
+
+# Function to describe a list of chunk token counts: count, total and p50/p95/max per chunk
+def token_stats(tokens):
+    from instrumentation import percentile
+
+    tokens = sorted(tokens)
+    if not tokens:
+        return {"chunks": 0, "tokens": 0, "p50": 0, "p95": 0, "max": 0}
+    return {"chunks": len(tokens), "tokens": sum(tokens), "p50": percentile(tokens, 50),
+            "p95": percentile(tokens, 95), "max": tokens[-1]}
+
+
+# Function to split the same documents with the character splitter and with the structured
+# token splitter (boilerplate left out as it would be in a fresh store) and compare them:
+# chunks and tokens embedded, chunk sizes, and the prompt tokens of `passages` stuffed passages
+def savings_report(documents, chunk_size, chunk_overlap, char_size, char_overlap, passages):
+    from pipeline import make_text_splitter
+
+    characters = make_text_splitter(char_size, char_overlap, unit="characters")
+    structured = StructuredTokenSplitter(chunk_size, chunk_overlap, BoilerplateIndex(":memory:"))
+    report = {}
+    for name, splitter in (("characters", characters), ("tokens", structured)):
+        stats = token_stats([count_tokens(chunk.page_content) for chunk in iter_split_documents(documents, splitter)])
+        stats["prompt_tokens_mean"] = passages * stats["tokens"] / max(stats["chunks"], 1)
+        stats["prompt_tokens_max"] = passages * stats["max"]
+        report[name] = stats
+    report["tokens"]["boilerplate_blocks"] = structured.totals["boilerplate_blocks"]
+    report["tokens"]["boilerplate_tokens"] = structured.totals["boilerplate_tokens"]
+    old, new = report["characters"], report["tokens"]
+    report["saved"] = {
+        "chunks": 1 - new["chunks"] / old["chunks"] if old["chunks"] else 0.0,
+        "embedded_tokens": 1 - new["tokens"] / old["tokens"] if old["tokens"] else 0.0,
+        "prompt_tokens": 1 - new["prompt_tokens_mean"] / old["prompt_tokens_mean"] if old["chunks"] else 0.0,
+    }
+    return report
+
+
+# Function to print a savings report
+def describe_report(report, passages):
+    for name in ("characters", "tokens"):
+        stats = report[name]
+        print(
+            f"{name:<10} {stats['chunks']:>6} chunks {stats['tokens']:>8} tokens embedded | tokens per chunk "
+            f"p50 {stats['p50']:5.0f} p95 {stats['p95']:5.0f} max {stats['max']:5.0f} | "
+            f"{passages} passages: {stats['prompt_tokens_mean']:6.0f} prompt tokens (at most {stats['prompt_tokens_max']:.0f})"
+        )
+    print(f"Boilerplate left out: {report['tokens']['boilerplate_blocks']} blocks, "
+          f"{report['tokens']['boilerplate_tokens']} tokens")
+    saved = report["saved"]
+    print(f"Saved: {saved['chunks']:.0%} of chunks, {saved['embedded_tokens']:.0%} of embedded tokens, "
+          f"{saved['prompt_tokens']:.0%} of prompt tokens per query")
+
+
+def main():
+    from dotenv import load_dotenv
+
+    from ingestion import describe_result, iter_ingest
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Compare character and structured token chunking on some pages")
+    parser.add_argument("urls", nargs="+", help="pages to fetch and split")
+    parser.add_argument("--chunk-size", type=int, default=config.CHUNK_TOKENS, help="tokens per chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=config.CHUNK_OVERLAP_TOKENS)
+    parser.add_argument("--char-size", type=int, default=config.CHUNK_CHARS, help="characters per chunk to compare with")
+    parser.add_argument("--char-overlap", type=int, default=config.CHUNK_OVERLAP_CHARS)
+    parser.add_argument("--passages", type=int, default=config.RERANK_MAX_PASSAGES if config.RERANK_ENABLED
+                        else config.RETRIEVAL_K, help="passages stuffed into each prompt")
+    args = parser.parse_args()
+
+    documents = []
+    for result in iter_ingest(args.urls):
+        print(describe_result(result))
+        if result.ok:
+            documents.append(result.document)
+    describe_report(savings_report(documents, args.chunk_size, args.chunk_overlap, args.char_size, args.char_overlap,
+                                   args.passages), args.passages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import json
+import time
+import urllib.error
+import urllib.request
+
+import config
+
+# Thin HTTP client for server.py, used by the Streamlit app and the CLI when
+# SMARTSEARCH_SERVER_URL is set. Only the standard library is needed to talk to the server.
+
+
+class ServerError(Exception):
+    pass
+
+
+class SmartSearchClient:
+    def __init__(self, base_url=config.SERVER_URL, timeout=300, retries=3):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+
+    # POST a JSON body and return the open response, waiting and retrying while the server is busy (503)
+    def _post(self, path, payload):
+        data = json.dumps(payload).encode("utf-8")
+        for attempt in range(self.retries + 1):
+            request = urllib.request.Request(
+                f"{self.base_url}{path}", data=data, headers={"Content-Type": "application/json"}
+            )
+            try:
+                return urllib.request.urlopen(request, timeout=self.timeout)
+            except urllib.error.HTTPError as e:
+                if e.code != 503 or attempt == self.retries:
+                    raise ServerError(f"{path} failed with HTTP {e.code}: {e.read().decode('utf-8', 'replace')}")
+                time.sleep(float(e.headers.get("Retry-After") or 1) * (attempt + 1))
+            except urllib.error.URLError as e:
+                raise ServerError(f"Cannot reach the server at {self.base_url}: {e.reason}")
+
+    def _get(self, path):
+        try:
+            with urllib.request.urlopen(f"{self.base_url}{path}", timeout=self.timeout) as response:
+                return json.load(response)
+        except urllib.error.URLError as e:
+            raise ServerError(f"Cannot reach the server at {self.base_url}: {e}")
+
+    # Answer one question, optionally only from some sources; returns the server's answer record
+    # (answer, sources, timings)
+    def ask(self, item_id, question, sources=()):
+        with self._post("/ask", {"id": item_id, "question": question, "sources": list(sources)}) as response:
+            return json.load(response)
+
+    # Answer one question, yielding NDJSON events ("sources", "token", "done", "error") as they arrive
+    def ask_events(self, question, sources=()):
+        with self._post("/ask", {"question": question, "stream": True, "sources": list(sources)}) as response:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+
+    # Refine an answer over the passages it was written from (one LLM call on the server, no
+    # retrieval), yielding NDJSON events ("token", "done", "error") as they arrive
+    def refine_events(self, question, answer, passages, rating, comment):
+        payload = {"question": question, "answer": answer, "passages": passages, "rating": rating, "comment": comment}
+        with self._post("/refine", payload) as response:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+
+    # Index URLs on the server; returns one dict per URL (ok, error, added, deleted, unchanged, skipped, ...)
+    def ingest(self, urls):
+        with self._post("/ingest", {"urls": list(urls)}) as response:
+            return json.load(response)["results"]
+
+    # Sources indexed on the server, for scoping questions
+    def sources(self):
+        return self._get("/sources")["sources"]
+
+    def health(self):
+        return self._get("/health")
+
+    def stats(self):
+        return self._get("/stats")
+
+
+# Server-backed counterpart of streaming.AnswerStream with the same interface: iterating yields
+# answer text as it streams; `result`, `source_documents` and the timings are set once it ends.
+# The result keeps the retrieved passages ("source_documents") for refinement.
+class RemoteAnswerStream:
+    def __init__(self, client, question, on_sources=None, sources=()):
+        self.client = client
+        self.question = question
+        self.on_sources = on_sources
+        self.sources = sources
+        self.result = None
+        self.record = None
+        self.source_documents = []
+        self.rerank_report = None
+        self.time_to_first_token = None
+        self.retrieval_time = None
+        self.total_time = None
+
+    def _events(self):
+        return self.client.ask_events(self.question, self.sources)
+
+    def __iter__(self):
+        from langchain_core.documents import Document  # keeps the thin client's import free of LangChain
+
+        start = time.perf_counter()
+        for event in self._events():
+            if event["event"] == "sources":
+                self.retrieval_time = time.perf_counter() - start
+                passages = event.get("passages") or [{"source": s, "content": ""} for s in event["sources"]]
+                self.source_documents = [
+                    Document(page_content=passage["content"], metadata={"source": passage["source"]})
+                    for passage in passages
+                ]
+                if self.on_sources:
+                    self.on_sources(self.source_documents)
+            elif event["event"] == "token":
+                if self.time_to_first_token is None:
+                    self.time_to_first_token = time.perf_counter() - start
+                yield event["text"]
+            elif event["event"] == "error":
+                raise ServerError(event["error"])
+            elif event["event"] == "done":
+                self.record = event["record"]
+                self.result = {"answer": self.record["answer"], "sources": ", ".join(self.record["sources"]),
+                               "source_documents": self.source_documents}
+        self.total_time = time.perf_counter() - start
+        if self.time_to_first_token is None:
+            self.time_to_first_token = self.total_time
+
+    def wait(self):
+        for _ in self:
+            pass
+        return self.result
+
+
+# Server-side refinement of a RemoteAnswerStream result (see refinement.py), streamed the same way
+class RemoteRefineStream(RemoteAnswerStream):
+    def __init__(self, client, question, result, rating, comment):
+        super().__init__(client, question)
+        self.answer = result["answer"]
+        self.passages = [
+            {"source": document.metadata.get("source", ""), "content": document.page_content}
+            for document in result.get("source_documents") or []
+        ]
+        self.rating = rating
+        self.comment = comment
+
+    def _events(self):
+        return self.client.refine_events(self.question, self.answer, self.passages, self.rating, self.comment)
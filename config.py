@@ -0,0 +1,172 @@
+import os
+
+# Shared configuration for the Streamlit apps and the command-line script.
+# Every value can be overridden through the environment (or the .env file).
+
+# Location of the persisted vector store
+VECTORSTORE_PATH = os.getenv("SMARTSEARCH_VECTORSTORE_PATH", "chroma_vectorstore")
+
+# URL ingestion: bounded fetch/parse pools, per-URL timeout (seconds) and retries
+FETCH_MAX_WORKERS = int(os.getenv("SMARTSEARCH_FETCH_WORKERS", "8"))
+PARSE_MAX_WORKERS = int(os.getenv("SMARTSEARCH_PARSE_WORKERS", "2"))
+FETCH_TIMEOUT = float(os.getenv("SMARTSEARCH_FETCH_TIMEOUT", "20"))
+FETCH_RETRIES = int(os.getenv("SMARTSEARCH_FETCH_RETRIES", "2"))
+FETCH_USER_AGENT = os.getenv(
+    "SMARTSEARCH_USER_AGENT",
+    "Mozilla/5.0 (compatible; SmartSearchBot/1.0)"
+)
+
+# On-disk embedding cache keyed by SHA-256 of (model, chunk text), capped with LRU eviction
+EMBEDDING_CACHE_PATH = os.getenv("SMARTSEARCH_EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("SMARTSEARCH_EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+# Manifest (inside the vector store directory) with the store's version, and the SQLite table
+# beside it tracking the page hash and chunk IDs of every source
+INDEX_MANIFEST_NAME = "index_manifest.json"
+INDEX_SOURCES_NAME = "index_sources.sqlite3"
+
+# Background re-crawl (recrawl.py): ingested pages are re-checked with conditional GETs every
+# RECRAWL_INTERVAL_SECONDS; the worker looks for due pages every RECRAWL_POLL_SECONDS.
+# 0 keeps the apps and the query server from starting the worker.
+RECRAWL_INTERVAL_SECONDS = float(os.getenv("SMARTSEARCH_RECRAWL_INTERVAL_SECONDS", "3600"))
+RECRAWL_POLL_SECONDS = float(os.getenv("SMARTSEARCH_RECRAWL_POLL_SECONDS", "30"))
+RECRAWL_REGISTRY_NAME = "recrawl_registry.sqlite3"
+
+# Embedding scheduler: token-budgeted batches, parallel requests and rate limits of the embedding API
+EMBED_BATCH_TOKENS = int(os.getenv("SMARTSEARCH_EMBED_BATCH_TOKENS", "8000"))
+EMBED_BATCH_SIZE = int(os.getenv("SMARTSEARCH_EMBED_BATCH_SIZE", "256"))
+EMBED_MAX_IN_FLIGHT = int(os.getenv("SMARTSEARCH_EMBED_MAX_IN_FLIGHT", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("SMARTSEARCH_EMBED_MAX_RETRIES", "5"))
+EMBED_BACKOFF_SECONDS = float(os.getenv("SMARTSEARCH_EMBED_BACKOFF_SECONDS", "1"))
+EMBED_REQUESTS_PER_MINUTE = int(os.getenv("SMARTSEARCH_EMBED_REQUESTS_PER_MINUTE", "3000"))
+EMBED_TOKENS_PER_MINUTE = int(os.getenv("SMARTSEARCH_EMBED_TOKENS_PER_MINUTE", "1000000"))
+
+# Vector store backend: "chroma", or "mmap" for the compact NumPy index in vector_index.py
+# (quantized float16/int8 vectors in memory-mapped segments). Search is exact until the index
+# holds VECTOR_INDEX_IVF_MIN_ROWS vectors; from then on "ivf" probes only VECTOR_INDEX_NPROBE
+# lists, while "exact" keeps scanning every row
+VECTOR_BACKEND = os.getenv("SMARTSEARCH_VECTOR_BACKEND", "chroma").lower()
+VECTOR_INDEX_DTYPE = os.getenv("SMARTSEARCH_VECTOR_INDEX_DTYPE", "float16").lower()
+VECTOR_INDEX_SEARCH = os.getenv("SMARTSEARCH_VECTOR_INDEX_SEARCH", "ivf").lower()
+VECTOR_INDEX_NPROBE = int(os.getenv("SMARTSEARCH_VECTOR_INDEX_NPROBE", "8"))
+VECTOR_INDEX_IVF_MIN_ROWS = int(os.getenv("SMARTSEARCH_VECTOR_INDEX_IVF_MIN_ROWS", "20000"))
+VECTOR_INDEX_COMPACT_SEGMENTS = int(os.getenv("SMARTSEARCH_VECTOR_INDEX_COMPACT_SEGMENTS", "16"))
+VECTOR_INDEX_DB_NAME = "vector_index.sqlite3"
+
+# Chunking used by every entry point (app, CLI, server); evaluation.py compares alternatives.
+# CHUNK_UNIT "tokens" splits along the page structure into chunks of CHUNK_SIZE tokens
+# (chunking.StructuredTokenSplitter); "characters" is the former fixed character-size splitter.
+# CHUNK_SIZE and CHUNK_OVERLAP are in that unit.
+CHUNK_UNIT = os.getenv("SMARTSEARCH_CHUNK_UNIT", "tokens").lower()
+CHUNK_TOKENS = 350
+CHUNK_OVERLAP_TOKENS = 50
+CHUNK_CHARS = 1500
+CHUNK_OVERLAP_CHARS = 200
+CHUNK_SIZE = int(os.getenv("SMARTSEARCH_CHUNK_SIZE", CHUNK_TOKENS if CHUNK_UNIT == "tokens" else CHUNK_CHARS))
+CHUNK_OVERLAP = int(os.getenv("SMARTSEARCH_CHUNK_OVERLAP",
+                              CHUNK_OVERLAP_TOKENS if CHUNK_UNIT == "tokens" else CHUNK_OVERLAP_CHARS))
+
+# Boilerplate: with token chunking, blocks found on BOILERPLATE_MIN_PAGES pages of a site
+# (navigation, footers) are indexed from the first of them only (0 disables)
+BOILERPLATE_MIN_PAGES = int(os.getenv("SMARTSEARCH_BOILERPLATE_MIN_PAGES", "3"))
+BOILERPLATE_DB_NAME = "boilerplate.sqlite3"
+
+# Streaming split: long texts are split one segment at a time, and chunks flow to the BM25
+# index and the embedding scheduler in windows, so memory stays bounded however long a page is
+SPLIT_SEGMENT_CHARS = int(os.getenv("SMARTSEARCH_SPLIT_SEGMENT_CHARS", "200000"))
+SYNC_WINDOW_CHUNKS = int(os.getenv("SMARTSEARCH_SYNC_WINDOW_CHUNKS", "256"))
+
+# Store partitioning (opt-in): "none" (default) keeps one collection, "domain" puts each source
+# domain in its own shard (a complete store under <store>/shards/<key>), "date" shards by ingest
+# month and "hash" spreads sources over SHARD_COUNT buckets. Searches fan out to the shards on SHARD_SEARCH_WORKERS threads. Changing it on an
+# existing store keeps the old collection searchable until its pages are re-ingested (see README).
+SHARD_BY = os.getenv("SMARTSEARCH_SHARD_BY", "none").lower()
+SHARD_COUNT = int(os.getenv("SMARTSEARCH_SHARD_COUNT", "8"))
+SHARD_DATE_FORMAT = os.getenv("SMARTSEARCH_SHARD_DATE_FORMAT", "%Y-%m")
+SHARD_SEARCH_WORKERS = int(os.getenv("SMARTSEARCH_SHARD_SEARCH_WORKERS", "8"))
+SHARDS_DIR_NAME = "shards"
+
+# Semantic answer cache: exact matches on the normalised question, then near-duplicates by cosine similarity
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("SMARTSEARCH_ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("SMARTSEARCH_ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("SMARTSEARCH_ANSWER_CACHE_SIMILARITY", "0.95"))
+
+# Offline mode: swap the OpenAI chat model and embeddings for the deterministic local fakes
+# in fake_backends.py (for demos, tests and benchmarks without network access or API costs)
+USE_FAKE_BACKENDS = os.getenv("SMARTSEARCH_FAKE_BACKENDS", "").lower() in ("1", "true", "yes")
+FAKE_LLM_LATENCY = float(os.getenv("SMARTSEARCH_FAKE_LLM_LATENCY", "0.5"))
+FAKE_LLM_TOKEN_LATENCY = float(os.getenv("SMARTSEARCH_FAKE_LLM_TOKEN_LATENCY", "0.02"))
+FAKE_EMBED_LATENCY = float(os.getenv("SMARTSEARCH_FAKE_EMBED_LATENCY", "0"))
+
+# Hybrid retrieval: BM25 index (inside the vector store directory) fused with dense search.
+# Modes: "hybrid" (reciprocal rank fusion of both), "lexical" (BM25 only, no embedding call),
+# "vector" (dense only) and "prefilter" (dense scoring restricted to the BM25 candidates)
+LEXICAL_INDEX_NAME = "bm25_index.sqlite3"
+RETRIEVAL_MODE = os.getenv("SMARTSEARCH_RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_K = int(os.getenv("SMARTSEARCH_RETRIEVAL_K", "4"))
+RETRIEVAL_FETCH_K = int(os.getenv("SMARTSEARCH_RETRIEVAL_FETCH_K", "20"))
+RETRIEVAL_PREFILTER_K = int(os.getenv("SMARTSEARCH_RETRIEVAL_PREFILTER_K", "100"))
+RETRIEVAL_RRF_K = int(os.getenv("SMARTSEARCH_RETRIEVAL_RRF_K", "60"))
+RETRIEVAL_VECTOR_WEIGHT = float(os.getenv("SMARTSEARCH_RETRIEVAL_VECTOR_WEIGHT", "1.0"))
+RETRIEVAL_LEXICAL_WEIGHT = float(os.getenv("SMARTSEARCH_RETRIEVAL_LEXICAL_WEIGHT", "1.0"))
+
+# Re-ranking between the retriever and the chain: over-fetch candidates, score them locally
+# (cross-encoder if RERANK_MODEL names a sentence-transformers model, lexical overlap otherwise),
+# drop redundant chunks and pack the best passages into a prompt token budget
+RERANK_ENABLED = os.getenv("SMARTSEARCH_RERANK", "1").lower() in ("1", "true", "yes")
+RERANK_MODEL = os.getenv("SMARTSEARCH_RERANK_MODEL", "")
+RERANK_CANDIDATES = int(os.getenv("SMARTSEARCH_RERANK_CANDIDATES", "12"))
+RERANK_MAX_PASSAGES = int(os.getenv("SMARTSEARCH_RERANK_MAX_PASSAGES", "4"))
+# Room for RERANK_MAX_PASSAGES full chunks by default (about four characters per token)
+RERANK_TOKEN_BUDGET = int(os.getenv("SMARTSEARCH_RERANK_TOKEN_BUDGET", RERANK_MAX_PASSAGES * (
+    CHUNK_SIZE if CHUNK_UNIT == "tokens" else CHUNK_SIZE // 4)))
+RERANK_REDUNDANCY = float(os.getenv("SMARTSEARCH_RERANK_REDUNDANCY", "0.6"))
+RERANK_MIN_SCORE = float(os.getenv("SMARTSEARCH_RERANK_MIN_SCORE", "0"))
+
+# How the QA chain combines the passages: "stuff" sends the packed passages in a single LLM call,
+# "map_reduce" (the from_llm default) calls the LLM once per passage and once more to combine.
+# LangChain's other chain types ("refine", "map_rerank") have no single final-answer call to
+# stream from (streaming.tag_final_answer), so they are refused here rather than on every question.
+QA_CHAIN_TYPES = ("stuff", "map_reduce")
+QA_CHAIN_TYPE = os.getenv("SMARTSEARCH_QA_CHAIN_TYPE", "stuff").lower()
+if QA_CHAIN_TYPE not in QA_CHAIN_TYPES:
+    raise ValueError(f"SMARTSEARCH_QA_CHAIN_TYPE must be one of {', '.join(QA_CHAIN_TYPES)}, not {QA_CHAIN_TYPE!r}")
+
+# Headless question answering (main_python.py ask): questions answered in parallel, and questions
+# retrieved together (one embedding request and one vector search per batch, see batch_query.py)
+ASK_CONCURRENCY = int(os.getenv("SMARTSEARCH_ASK_CONCURRENCY", "8"))
+ASK_BATCH_SIZE = int(os.getenv("SMARTSEARCH_ASK_BATCH_SIZE", "32"))
+
+# Feedback-log evaluation (evaluation.py): answers rated at least EVAL_MIN_RATING provide the
+# ground-truth sources; a configuration within EVAL_TOLERANCE of the best quality may win on speed
+EVAL_MIN_RATING = float(os.getenv("SMARTSEARCH_EVAL_MIN_RATING", "4"))
+EVAL_TOLERANCE = float(os.getenv("SMARTSEARCH_EVAL_TOLERANCE", "0.02"))
+
+# Feedback and response-time log of the apps (metrics_store.py): events are written to SQLite in
+# batches of METRICS_BATCH_SIZE or every METRICS_FLUSH_SECONDS, and the response time chart
+# shows the last METRICS_RECENT_QUERIES questions
+METRICS_DB_PATH = os.getenv("SMARTSEARCH_METRICS_DB_PATH", "metrics.sqlite3")
+METRICS_BATCH_SIZE = int(os.getenv("SMARTSEARCH_METRICS_BATCH_SIZE", "50"))
+METRICS_FLUSH_SECONDS = float(os.getenv("SMARTSEARCH_METRICS_FLUSH_SECONDS", "2"))
+METRICS_RECENT_QUERIES = int(os.getenv("SMARTSEARCH_METRICS_RECENT_QUERIES", "50"))
+
+# Offline tracing: spans for every pipeline stage, kept in memory for the latency panel and
+# optionally exported to a local file as plain JSONL ("jsonl") or OTLP/JSON ("otlp")
+TRACE_EXPORT = os.getenv("SMARTSEARCH_TRACE_EXPORT", "none").lower()
+TRACE_PATH = os.getenv("SMARTSEARCH_TRACE_PATH", "traces.jsonl")
+TRACE_BUFFER_SIZE = int(os.getenv("SMARTSEARCH_TRACE_BUFFER_SIZE", "5000"))
+TRACE_SERVICE_NAME = os.getenv("SMARTSEARCH_TRACE_SERVICE_NAME", "smart-search-bot")
+
+# Pooled HTTP connections shared by the OpenAI chat and embedding clients
+HTTP_MAX_CONNECTIONS = int(os.getenv("SMARTSEARCH_HTTP_MAX_CONNECTIONS", "32"))
+HTTP_TIMEOUT = float(os.getenv("SMARTSEARCH_HTTP_TIMEOUT", "120"))
+
+# Query server (server.py): questions answered at once, requests allowed to wait for a slot
+# (beyond that the server answers 503), and concurrent ingest jobs. With SMARTSEARCH_SERVER_URL
+# set, the Streamlit app and the CLI send their work to the server instead of running it locally.
+SERVER_HOST = os.getenv("SMARTSEARCH_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SMARTSEARCH_SERVER_PORT", "8765"))
+SERVER_MAX_CONCURRENT_ASKS = int(os.getenv("SMARTSEARCH_SERVER_MAX_CONCURRENT_ASKS", "16"))
+SERVER_MAX_QUEUE = int(os.getenv("SMARTSEARCH_SERVER_MAX_QUEUE", "64"))
+SERVER_MAX_CONCURRENT_INGESTS = int(os.getenv("SMARTSEARCH_SERVER_MAX_CONCURRENT_INGESTS", "1"))
+SERVER_URL = os.getenv("SMARTSEARCH_SERVER_URL", "").rstrip("/")
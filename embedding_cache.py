@@ -0,0 +1,150 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+import config
+
+
+# Function to derive the content-addressed cache key of a chunk for a given embedding model
+def cache_key(text, model):
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+# Function to name the model behind an embeddings backend (part of every cache key)
+def model_name(embeddings):
+    return getattr(embeddings, "model", None) or type(embeddings).__name__
+
+
+# Persistent SQLite store of float32 vectors keyed by SHA-256(model, chunk text).
+# Entries are evicted least-recently-used first once `max_entries` is exceeded.
+class EmbeddingCache:
+    def __init__(self, path=config.EMBEDDING_CACHE_PATH, max_entries=config.EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+
+    # Return {key: vector} for the keys present in the cache and mark them as recently used
+    def get_many(self, keys):
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(keys), 500):  # stay below SQLite's bound-parameter limit
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    # Store freshly computed vectors and evict the least recently used entries over the cap
+    def put_many(self, items, model):
+        now = time.time()
+        rows = [(key, model, array("f", vector).tobytes(), now) for key, vector in items]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            if self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    " SELECT key FROM embeddings ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# One cache per database file, shared by every rerun and session of the process
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(path=config.EMBEDDING_CACHE_PATH):
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = EmbeddingCache(path)
+        return _caches[path]
+
+
+# Embeddings wrapper that only sends cache misses to the underlying backend
+class CachedEmbeddings(Embeddings):
+    def __init__(self, backend, cache=None):
+        self.backend = backend
+        self.cache = cache if cache is not None else get_cache()
+        self.model = model_name(backend)
+
+    def embed_documents(self, texts):
+        keys = [cache_key(text, self.model) for text in texts]
+        vectors = self.cache.get_many(keys)
+
+        # Embed each missing text once, even if it appears several times in the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            computed = self.backend.embed_documents(list(missing.values()))
+            fresh = list(zip(missing.keys(), computed))
+            self.cache.put_many(fresh, self.model)
+            vectors.update(fresh)
+        return [vectors[key] for key in keys]
+
+    # Several queries in one backend request (batch_query.py), cached under the same keys as embed_query
+    def embed_queries(self, texts):
+        keys = [cache_key("query:" + text, self.model) for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            fresh = list(zip(missing.keys(), self.backend.embed_documents(list(missing.values()))))
+            self.cache.put_many(fresh, self.model)
+            vectors.update(fresh)
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text):
+        key = cache_key("query:" + text, self.model)
+        vector = self.cache.get_many([key]).get(key)
+        if vector is None:
+            vector = self.backend.embed_query(text)
+            self.cache.put_many([(key, vector)], self.model)
+        return vector
@@ -0,0 +1,256 @@
+import logging
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+from langchain_core.embeddings import Embeddings
+
+import config
+from embedding_cache import CachedEmbeddings, model_name
+from instrumentation import get_tracer
+from tokenization import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# One chunk waiting to be embedded and written to the vector store
+EmbeddingJob = namedtuple("EmbeddingJob", ["id", "text", "metadata"])
+
+
+# Classic token bucket: `rate` units refill per second up to `capacity`
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Non-blocking attempt; returns how long to wait before `amount` units are available (0 = taken)
+    def try_acquire(self, amount):
+        amount = min(amount, self.capacity)  # oversized requests still go through once the bucket is full
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    # Empty the bucket so callers wait for a full refill of `seconds`
+    def drain(self, seconds):
+        with self._lock:
+            self.tokens = min(self.tokens, -seconds * self.rate)
+            self.updated = time.monotonic()
+
+
+# Requests-per-minute and tokens-per-minute budget shared by every embedding call in the process
+class RateLimiter:
+    def __init__(self, requests_per_minute=config.EMBED_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=config.EMBED_TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute / 60.0, max(1, requests_per_minute // 60))
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, max(1, tokens_per_minute // 60))
+
+    def acquire(self, tokens):
+        for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+            delay = bucket.try_acquire(amount)
+            while delay:
+                time.sleep(delay)
+                delay = bucket.try_acquire(amount)
+
+    # Called on HTTP 429: stop every caller for `seconds`
+    def back_off(self, seconds):
+        self.requests.drain(seconds)
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+        return _rate_limiter
+
+
+# Function to detect a rate-limit response from the OpenAI client (or any client exposing status_code)
+def is_rate_limit_error(error):
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+# Function to read the server's Retry-After hint, if the error carries an HTTP response
+def retry_after(error):
+    response = getattr(error, "response", None)
+    value = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+# Embeddings wrapper that draws from the shared rate limiter before each backend request
+# and pauses all callers when the backend answers 429. It sits below the cache, so
+# cache hits never consume rate budget.
+class RateLimitedEmbeddings(Embeddings):
+    def __init__(self, backend, limiter=None):
+        self.backend = backend
+        self.limiter = limiter or get_rate_limiter()
+        self.model = model_name(backend)
+
+    def _call(self, fn, texts):
+        self.limiter.acquire(sum(count_tokens(text) for text in texts))
+        try:
+            return fn()
+        except Exception as e:
+            if is_rate_limit_error(e):
+                self.limiter.back_off(retry_after(e) or config.EMBED_BACKOFF_SECONDS)
+            raise
+
+    def embed_documents(self, texts):
+        return self._call(lambda: self.backend.embed_documents(texts), texts)
+
+    def embed_query(self, text):
+        return self._call(lambda: self.backend.embed_query(text), [text])
+
+
+# Function to compose the standard embedding stack: persistent cache over a rate-limited backend
+def build_embeddings(backend):
+    return CachedEmbeddings(RateLimitedEmbeddings(backend))
+
+
+# Function to pack jobs into batches bounded by a token budget and a maximum number of inputs
+def iter_batches(jobs, max_tokens=config.EMBED_BATCH_TOKENS, max_size=config.EMBED_BATCH_SIZE):
+    batch, batch_tokens = [], 0
+    for job in jobs:
+        tokens = count_tokens(job.text)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_size):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(job)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+# Function to build a sink that upserts embedded batches straight into the vector store:
+# the Chroma collection, or a store with its own bulk upsert (vector_index.MmapVectorStore)
+def vectorstore_sink(vectorstore):
+    upsert = getattr(vectorstore, "upsert_embeddings", None)
+    if upsert is None:
+        upsert = vectorstore._collection.upsert
+
+    def sink(batch, vectors):
+        upsert(
+            ids=[job.id for job in batch],
+            embeddings=vectors,
+            documents=[job.text for job in batch],
+            metadatas=[job.metadata or None for job in batch]
+        )
+    return sink
+
+
+@dataclass
+class SchedulerStats:
+    chunks: int = 0
+    batches: int = 0
+    retries: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def chunks_per_second(self):
+        return self.chunks / self.elapsed if self.elapsed else 0.0
+
+
+# Embeds a stream of jobs in token-budgeted batches with several requests in flight at once.
+# Batches are pulled from the input lazily, so at most `max_in_flight` batches are held in
+# memory, and each finished batch is handed to `sink(batch, vectors)` on the calling thread
+# as soon as it completes. Rate-limited batches are retried with exponential backoff.
+class EmbeddingScheduler:
+    def __init__(self, embeddings, max_in_flight=config.EMBED_MAX_IN_FLIGHT,
+                 batch_tokens=config.EMBED_BATCH_TOKENS, batch_size=config.EMBED_BATCH_SIZE,
+                 max_retries=config.EMBED_MAX_RETRIES):
+        self.embeddings = embeddings
+        self.max_in_flight = max_in_flight
+        self.batch_tokens = batch_tokens
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+
+    # Runs on a pool thread, so the span's parent (the caller's current span) is passed in
+    def _embed_batch(self, batch, parent=None):
+        texts = [job.text for job in batch]
+        with get_tracer().span("embed", parent=parent, chunks=len(texts)) as span:
+            span.set("tokens", sum(count_tokens(text) for text in texts))
+            for attempt in range(self.max_retries + 1):
+                try:
+                    vectors = self.embeddings.embed_documents(texts)
+                    span.set("retries", attempt)
+                    return vectors, attempt
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt == self.max_retries:
+                        raise
+                    delay = retry_after(e) or config.EMBED_BACKOFF_SECONDS * 2 ** attempt
+                    delay *= 0.5 + random.random() / 2  # jitter so parallel batches do not retry in lockstep
+                    logger.warning(f"Embedding batch rate limited, retrying in {delay:.1f}s")
+                    time.sleep(delay)
+
+    def run(self, jobs, sink):
+        stats = SchedulerStats()
+        start = time.perf_counter()
+        batches = iter_batches(jobs, self.batch_tokens, self.batch_size)
+        tracer = get_tracer()
+        parent = tracer.current_span()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as pool:
+            in_flight = {}
+            exhausted = False
+            while True:
+                while not exhausted and len(in_flight) < self.max_in_flight:
+                    batch = next(batches, None)
+                    if batch is None:
+                        exhausted = True
+                    else:
+                        in_flight[pool.submit(self._embed_batch, batch, parent)] = batch
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    vectors, retries = future.result()
+                    with tracer.span("upsert", chunks=len(batch)):
+                        sink(batch, vectors)
+                    stats.chunks += len(batch)
+                    stats.batches += 1
+                    stats.retries += retries
+        stats.elapsed = time.perf_counter() - start
+        return stats
+
+
+# Offline throughput check against the fake embedding backend:
+#   python embedding_scheduler.py --chunks 5000 --latency 0.2 --in-flight 8
+if __name__ == "__main__":
+    import argparse
+
+    from fake_backends import HashEmbeddings
+
+    parser = argparse.ArgumentParser(description="Benchmark the embedding scheduler with a fake backend")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--chunk-words", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.1, help="simulated seconds per embedding request")
+    parser.add_argument("--in-flight", type=int, default=config.EMBED_MAX_IN_FLIGHT)
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth request with a 429")
+    args = parser.parse_args()
+
+    backend = HashEmbeddings(latency=args.latency, rate_limit_every=args.rate_limit_every)
+    embeddings = RateLimitedEmbeddings(backend, RateLimiter(requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9))
+    for in_flight in sorted({1, args.in_flight}):
+        jobs = (
+            EmbeddingJob(str(i), " ".join(f"word{(i * 7 + w) % 997}" for w in range(args.chunk_words)), {})
+            for i in range(args.chunks)
+        )
+        stats = EmbeddingScheduler(embeddings, max_in_flight=in_flight).run(jobs, lambda batch, vectors: None)
+        print(f"in_flight={in_flight}: {stats.chunks} chunks in {stats.batches} batches, "
+              f"{stats.retries} retries, {stats.elapsed:.2f}s, {stats.chunks_per_second:.0f} chunks/s")
@@ -0,0 +1,281 @@
+import argparse
+import csv
+import functools
+import itertools
+import json
+import logging
+import math
+import re
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+import config
+from batch_qa import answer_question, iter_answers
+from instrumentation import percentile
+from reporting import report_header
+
+logger = logging.getLogger(__name__)
+
+# Offline evaluation of retrieval quality and latency, replaying the app's feedback log.
+#   python evaluation.py feedback_logs.csv          # or metrics.sqlite3, the apps' own log
+#   python evaluation.py feedback_logs.csv --chunk-sizes 250,350,500 --chunk-overlaps 0,50 --k 4,6
+# Every logged question is asked again, in parallel, against the current store and against
+# temporary stores rebuilt from the cited pages with each chunking of the grid. The sources the
+# logged answer cited are the ground truth; answers rated below --min-rating are replayed for
+# latency only. Per configuration the report gives the hit rate (questions with a cited source
+# among the retrieved passages), MRR (reciprocal rank of the first such passage) and retrieval
+# latency percentiles, plus answer latency with --answers (one LLM call per question). The
+# recommendation is the fastest configuration within --tolerance of the best hit rate and MRR.
+# Rebuilt stores embed their chunks once; the embedding cache makes repeated runs cheap.
+
+_SOURCE_SEPARATORS = re.compile(r"[,\n]")
+
+
+# Function to read the cited sources of a log entry: the chain's "url1, url2" string (app log)
+# or a list (main_python.py ask output)
+def split_sources(value):
+    if isinstance(value, list):
+        return [source.strip() for source in value if source.strip()]
+    return [source.strip() for source in _SOURCE_SEPARATORS.split(value or "") if source.strip()]
+
+
+# Function to read a feedback log: the app's CSV download (query, answer, sources, rating, ...),
+# JSONL records with "query" or "question", or the app's metrics store itself (.sqlite3).
+# Yields (id, question, relevant sources); entries rated below `min_rating` get no relevant
+# sources, so they only count towards latency.
+def read_feedback_log(path, min_rating=config.EVAL_MIN_RATING):
+    if path.lower().endswith((".sqlite3", ".db")):
+        from metrics_store import MetricsStore
+
+        store = MetricsStore(path)
+        try:
+            yield from _log_items(store.iter_feedback(), min_rating)
+        finally:
+            store.close()
+        return
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            yield from _log_items(csv.DictReader(f), min_rating)
+        else:
+            yield from _log_items((json.loads(line) for line in f if line.strip()), min_rating)
+
+
+# Function to turn log rows (dicts) into evaluation items; rows with an unreadable rating are skipped
+def _log_items(rows, min_rating):
+    for number, row in enumerate(rows, start=1):
+        question = (row.get("query") or row.get("question") or "").strip()
+        if not question:
+            continue
+        rating = row.get("rating")
+        if rating in (None, ""):
+            trusted = True  # unrated entries are trusted
+        else:
+            try:
+                rating = float(rating)
+            except (TypeError, ValueError):
+                rating = math.nan
+            if not math.isfinite(rating):
+                logger.warning("Skipping log entry %s: invalid rating %r", row.get("id") or number, row.get("rating"))
+                continue
+            trusted = rating >= min_rating
+        yield str(row.get("id") or number), question, split_sources(row.get("sources")) if trusted else []
+
+
+# Function to run one question through a retriever and record the sources it ranked, in order
+def retrieve(retriever, item_id, question):
+    start = time.perf_counter()
+    record = {"id": item_id, "question": question}
+    try:
+        documents = retriever.invoke(question)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record
+    record["latency"] = time.perf_counter() - start
+    record["retrieved"] = [document.metadata.get("source", "") for document in documents]
+    return record
+
+
+# Function to score a ranking: reciprocal rank of the first passage from a relevant source (0 when none)
+def reciprocal_rank(retrieved, relevant):
+    for rank, source in enumerate(retrieved, start=1):
+        if source in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+# Function to summarise latencies (seconds) as p50/p95/mean
+def latency_summary(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95), "mean": sum(values) / len(values)}
+
+
+# Function to replay every question against one retriever (and, with `llm`, its full chain),
+# `concurrency` at a time, and compute the configuration's metrics
+def evaluate_retriever(retriever, items, concurrency, llm=None):
+    from pipeline import make_chain
+
+    relevant = {item_id: set(sources) for item_id, _, sources in items}
+    questions = [(item_id, question) for item_id, question, _ in items]
+    records = list(iter_answers(functools.partial(retrieve, retriever), questions, concurrency))
+    ranks = [reciprocal_rank(r["retrieved"], relevant[r["id"]]) for r in records if "retrieved" in r and relevant[r["id"]]]
+    result = {
+        "questions": len(records),
+        "labelled": len(ranks),
+        "errors": sum(1 for record in records if record.get("error")),
+        "hit_rate": sum(1 for rank in ranks if rank) / len(ranks) if ranks else None,
+        "mrr": sum(ranks) / len(ranks) if ranks else None,
+        "retrieval_latency": latency_summary([record["latency"] for record in records if "latency" in record]),
+    }
+    if llm is not None:
+        chain = make_chain(llm, retriever)
+        answers = [record for record in iter_answers(functools.partial(answer_question, chain), questions, concurrency)
+                   if not record.get("error")]
+        result["answer_latency"] = latency_summary([record["timings"]["total"] for record in answers])
+        result["first_token_latency"] = latency_summary(
+            [record["timings"]["first_token"] for record in answers if record["timings"]["first_token"] is not None]
+        )
+        if any("prompt_tokens" in record for record in answers):
+            result["prompt_tokens"] = sum(record.get("prompt_tokens", 0) for record in answers) / len(answers)
+    return result
+
+
+# Function to fetch and parse the pages a rebuilt store is made of
+def load_documents(urls):
+    from ingestion import describe_result, iter_ingest
+
+    documents = []
+    for result in iter_ingest(urls):
+        print(describe_result(result))
+        if result.ok:
+            documents.append(result.document)
+    return documents
+
+
+# Function to evaluate every `k` on one store, tagging each result with its configuration (and `details`)
+def evaluate_store(pipeline, label, chunking, ks, items, args, **details):
+    from pipeline import make_retriever
+
+    results = []
+    for k in ks:
+        result = evaluate_retriever(make_retriever(pipeline.index_sync, k=k), items, args.concurrency,
+                                    pipeline.llm if args.answers else None)
+        result.update(label=label, chunk_size=chunking[0], chunk_overlap=chunking[1], k=k, **details)
+        results.append(result)
+        print(describe(result))
+    return results
+
+
+# Function to evaluate the grid: the current store as it is, then one rebuilt store per chunking
+def run_evaluation(args, items):
+    from pipeline import Pipeline
+
+    ks = [int(value) for value in args.k.split(",")] if args.k else [None]
+    results = []
+    if not args.skip_current:
+        results += evaluate_store(Pipeline(path=args.store), "current store", (None, None), ks, items, args)
+
+    sizes = [int(value) for value in args.chunk_sizes.split(",")] if args.chunk_sizes else []
+    overlaps = [int(value) for value in args.chunk_overlaps.split(",")] if args.chunk_overlaps else []
+    if not sizes and not overlaps:
+        return results
+    grid = [(size, overlap) for size, overlap in itertools.product(sizes or [config.CHUNK_SIZE],
+                                                                   overlaps or [config.CHUNK_OVERLAP])
+            if overlap < size]
+    urls = list(dict.fromkeys(itertools.chain((s for _, _, sources in items for s in sources), args.urls or [])))
+    documents = load_documents(urls)
+    for size, overlap in grid:
+        with tempfile.TemporaryDirectory(prefix="smartsearch-eval-") as path:
+            pipeline = Pipeline(path=path, chunk_size=size, chunk_overlap=overlap)
+            start = time.perf_counter()
+            chunks = sum(pipeline.index_sync.sync_document(document, pipeline.split_documents).added
+                         for document in documents)
+            ingest_seconds = time.perf_counter() - start
+            results += evaluate_store(pipeline, f"chunks {size}/{overlap}", (size, overlap), ks, items, args,
+                                      chunks=chunks, ingest_seconds=ingest_seconds)
+    return results
+
+
+# Function to pick the fastest configuration whose quality is within `tolerance` of the best
+def recommend(results, tolerance):
+    scored = [result for result in results if result["hit_rate"] is not None and result["retrieval_latency"]]
+    if not scored:
+        return None
+    best_hit_rate = max(result["hit_rate"] for result in scored)
+    best_mrr = max(result["mrr"] for result in scored)
+    eligible = [result for result in scored
+                if result["hit_rate"] >= best_hit_rate - tolerance and result["mrr"] >= best_mrr - tolerance]
+    return min(eligible, key=lambda result: (result.get("answer_latency") or result["retrieval_latency"])["p50"])
+
+
+# Function to describe one configuration's result on a single line
+def describe(result):
+    k = result["k"] or (config.RERANK_MAX_PASSAGES if config.RERANK_ENABLED else config.RETRIEVAL_K)
+    quality = (f"hit rate {result['hit_rate']:.0%} MRR {result['mrr']:.3f}" if result["hit_rate"] is not None
+               else "no labelled questions")
+    latency = result["retrieval_latency"]
+    line = f"{result['label']:<16} k={k:<3} {quality} | " + (
+        f"retrieval p50 {latency['p50'] * 1000:7.1f} ms p95 {latency['p95'] * 1000:7.1f} ms" if latency
+        else f"all {result['errors']} retrievals failed"
+    )
+    if result.get("answer_latency"):
+        line += f" | answer p50 {result['answer_latency']['p50']:.2f}s p95 {result['answer_latency']['p95']:.2f}s"
+    if "chunks" in result:
+        line += f" | {result['chunks']} chunks"
+    return line
+
+
+# Function to turn a configuration into the settings that select it
+def settings_for(result):
+    settings = []
+    if result["chunk_size"] is not None:
+        settings += [f"SMARTSEARCH_CHUNK_SIZE={result['chunk_size']}", f"SMARTSEARCH_CHUNK_OVERLAP={result['chunk_overlap']}"]
+    if result["k"] is not None:
+        name = "SMARTSEARCH_RERANK_MAX_PASSAGES" if config.RERANK_ENABLED else "SMARTSEARCH_RETRIEVAL_K"
+        settings.append(f"{name}={result['k']}")
+    return " ".join(settings) or "(current settings)"
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Replay the feedback log to compare retrieval configurations")
+    parser.add_argument("log", help="feedback log: the app's CSV download, its metrics store (.sqlite3), or JSONL")
+    parser.add_argument("--store", default=config.VECTORSTORE_PATH, help="the current store")
+    parser.add_argument("--skip-current", action="store_true", help="only evaluate the rebuilt stores")
+    parser.add_argument("--chunk-sizes", help="comma-separated chunk sizes (in SMARTSEARCH_CHUNK_UNIT) to rebuild the cited pages with")
+    parser.add_argument("--chunk-overlaps", help="comma-separated chunk overlaps to rebuild with")
+    parser.add_argument("--k", help="comma-separated numbers of passages to retrieve")
+    parser.add_argument("--urls", nargs="*", help="extra pages to index in rebuilt stores besides the cited ones")
+    parser.add_argument("--answers", action="store_true", help="also generate answers and measure their latency")
+    parser.add_argument("--min-rating", type=float, default=config.EVAL_MIN_RATING,
+                        help="lowest rating whose cited sources count as ground truth")
+    parser.add_argument("--tolerance", type=float, default=config.EVAL_TOLERANCE,
+                        help="quality loss (hit rate and MRR) accepted for a faster configuration")
+    parser.add_argument("--concurrency", type=int, default=config.ASK_CONCURRENCY)
+    parser.add_argument("--output", default="evaluation_results.json")
+    args = parser.parse_args()
+
+    items = list(read_feedback_log(args.log, args.min_rating))
+    if not items:
+        parser.error(f"No questions found in {args.log}")
+    print(f"Replaying {len(items)} questions ({sum(1 for item in items if item[2])} with trusted cited sources)")
+    results = run_evaluation(args, items)
+    best = recommend(results, args.tolerance)
+    if best is not None:
+        print(f"Recommended: {best['label']}, k={best['k'] or 'default'} -> {settings_for(best)}")
+    report = {
+        **report_header(),
+        "settings": vars(args),
+        "results": results,
+        "recommended": best,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
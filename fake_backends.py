@@ -0,0 +1,203 @@
+import hashlib
+import html.parser
+import math
+import re
+import threading
+import time
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel, generate_from_stream
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from tokenization import count_tokens
+
+# Deterministic local stand-ins for the OpenAI backends (and for unstructured's HTML partitioner,
+# which downloads a spaCy model), used for offline benchmarks, demos and tests
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+_STREAM_PIECE = re.compile(r"\S+\s*|\s+")
+_SUMMARY_PATTERN = re.compile(r"Content: (.*?)\nSource: (.*?)(?:\n|$)", re.DOTALL)
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+# Feature-hashing embedder: each word is hashed into one of `dim` buckets and the vector is
+# L2-normalised, so texts sharing words get similar vectors. `latency` simulates the round
+# trip of one request; `rate_limit_every` answers every Nth request with a 429.
+class HashEmbeddings(Embeddings):
+    def __init__(self, dim=256, latency=0.0, rate_limit_every=0):
+        self.dim = dim
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.model = f"hash-embedding-{dim}"
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _request(self):
+        with self._lock:
+            self.requests += 1
+            request_number = self.requests
+        if self.latency:
+            time.sleep(self.latency)
+        if self.rate_limit_every and request_number % self.rate_limit_every == 0:
+            raise FakeRateLimitError("Rate limit reached (simulated)")
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        for token in _TOKEN_PATTERN.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        self._request()
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        self._request()
+        return self._embed(text)
+
+
+# Function to pick the sentence of a text that shares most words with the question
+def _best_sentence(text, question_words):
+    sentences = [sentence for sentence in re.split(r"(?<=[.!?])\s+|\n+", text) if sentence.strip()]
+    return max(
+        sentences,
+        key=lambda sentence: len(question_words & set(_TOKEN_PATTERN.findall(sentence.lower()))),
+        default=""
+    ).strip()[:300]
+
+
+# Function to answer a RetrievalQAWithSourcesChain prompt extractively. The final-answer prompt
+# gets the best sentence of the most relevant "Content:/Source:" passage followed by its source;
+# a map-step prompt ("Question: ... Relevant text, if any:") gets the best sentence of its passage.
+def extractive_answer(prompt):
+    if "QUESTION:" not in prompt:
+        context, _, question = prompt.partition("\n")[2].rpartition("Question:")
+        return _best_sentence(context, set(_TOKEN_PATTERN.findall(question.partition("\n")[0].lower())))
+
+    prompt = prompt.rsplit("QUESTION:", 1)[-1]  # skip the few-shot examples
+    question, _, summaries = prompt.partition("\n")
+    question_words = set(_TOKEN_PATTERN.findall(question.lower()))
+    best = max(
+        _SUMMARY_PATTERN.findall(summaries),
+        key=lambda passage: len(question_words & set(_TOKEN_PATTERN.findall(passage[0].lower()))),
+        default=None
+    )
+    if best is None:
+        return "I don't know.\nSOURCES:"
+    content, source = best
+    return f"{_best_sentence(content, question_words)}\nSOURCES: {source.strip()}"
+
+
+# Chat model that streams a deterministic answer token by token. `latency` is the delay before
+# the first token and `token_latency` the delay between tokens. With `responses` set it cycles
+# through them; otherwise it answers extractively from the retrieved passages in the prompt.
+class FakeStreamingChatModel(BaseChatModel):
+    responses: list = []
+    latency: float = 0.0
+    token_latency: float = 0.0
+    streaming: bool = True
+    model_name: str = "fake-streaming-chat"
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "fake-streaming-chat"
+
+    def get_num_tokens(self, text):
+        return count_tokens(text)
+
+    def _respond(self, messages):
+        self.calls += 1
+        if self.responses:
+            return self.responses[(self.calls - 1) % len(self.responses)]
+        return extractive_answer(messages[-1].content)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._respond(messages)
+        if self.latency:
+            time.sleep(self.latency)
+        for piece in _STREAM_PIECE.findall(text):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.streaming:
+            return generate_from_stream(self._stream(messages, stop, run_manager, **kwargs))
+        text = self._respond(messages)
+        time.sleep(self.latency + self.token_latency * len(_STREAM_PIECE.findall(text)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+# Network-free stand-in for unstructured's partition_html: headings become Title elements,
+# list items ListItem, tables one Table element (cells joined by spaces) and any other text
+# block NarrativeText. Scripts, styles and the <head> are dropped, like unstructured does.
+class SimpleHTMLPartitioner(html.parser.HTMLParser):
+    _HEADINGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+    _BLOCKS = _HEADINGS | {"p", "div", "li", "table", "tr", "ul", "ol", "section", "article", "header",
+                           "footer", "main", "nav", "aside", "blockquote", "pre", "br", "body"}
+    _SKIPPED = {"script", "style", "head", "title", "noscript"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.elements = []
+        self._text = []
+        self._category = "NarrativeText"
+        self._skipping = 0
+        self._in_table = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIPPED:
+            self._skipping += 1
+        elif tag == "table":
+            self._flush()
+            self._in_table += 1
+            self._category = "Table"
+        elif self._in_table:
+            self._text.append(" ")  # keep table cells apart
+        elif tag in self._BLOCKS:
+            self._flush()
+            self._category = "Title" if tag in self._HEADINGS else "ListItem" if tag == "li" else "NarrativeText"
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIPPED:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag == "table":
+            self._in_table = max(0, self._in_table - 1)
+            if not self._in_table:
+                self._flush()
+        elif tag in self._BLOCKS and not self._in_table:
+            self._flush()
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self._text.append(data)
+
+    def _flush(self):
+        text = " ".join("".join(self._text).split())
+        if text:
+            self.elements.append((self._category, text))
+        self._text = []
+        self._category = "NarrativeText"
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+# Function to split an HTML page into (category, text) elements without unstructured
+def partition_html(html_text):
+    parser = SimpleHTMLPartitioner()
+    parser.feed(html_text)
+    parser.close()
+    return parser.elements
@@ -0,0 +1,152 @@
+import email.utils
+import html
+import http.server
+import random
+import threading
+import time
+from collections import Counter
+
+# Deterministic synthetic article corpus for benchmarks, served over HTTP on localhost.
+# Page i is always the same text, and each page states one fact (a product price) that a
+# matching question can be checked against, so runs are comparable between commits.
+# A page can be revised (FixtureServer.revise), which changes its price fact and nothing else.
+
+_WORDS = (
+    "market shares engine sedan launch dealer growth quarter revenue fuel demand segment "
+    "analyst investor production capacity export variant battery charging network range "
+    "mileage safety rating brand portfolio margin volume retail festive season outlook"
+).split()
+_SYLLABLES = ["ka", "ro", "vi", "ta", "zen", "mo", "lu", "xa", "pri", "dor", "sa", "nex"]
+
+
+# Function to build the product name mentioned on page `index`
+def product_name(index):
+    first = _SYLLABLES[index % len(_SYLLABLES)] + _SYLLABLES[(index // len(_SYLLABLES)) % len(_SYLLABLES)]
+    return f"{first.capitalize()} {index}"
+
+
+# Function to build the price fact stated on page `index` (in its `revision`)
+def product_price(index, revision=0):
+    return f"{5 + (index * 37 + revision * 11) % 900 / 100:.2f}"
+
+
+# Function to generate the paragraphs of page `index`; the price fact sits in a random paragraph
+def page_paragraphs(index, paragraphs=20, words_per_paragraph=110, seed=0, revision=0):
+    rng = random.Random(f"{seed}:{index}")
+    texts = [" ".join(rng.choice(_WORDS) for _ in range(words_per_paragraph)) + "." for _ in range(paragraphs)]
+    fact = f"The {product_name(index)} price starts at Rs {product_price(index, revision)} lakh."
+    position = rng.randrange(paragraphs)
+    texts[position] = f"{texts[position]} {fact}"
+    return texts
+
+
+# Site navigation and footer repeated on every page, as boilerplate for the chunker to leave out
+# (a plain list rather than <nav>, which unstructured already skips)
+_NAVIGATION = "<div class='menu'><ul>" + "".join(f"<li><a href='/{name.lower()}'>{name}</a></li>" for name in (
+    "Home", "Markets", "Auto", "Electric vehicles", "Reviews", "Subscribe")) + "</ul></div>"
+_FOOTER = ("<footer><p>Fixture News is a synthetic publication for benchmarks. Prices are indicative ex-showroom "
+           "figures and may change without notice. Subscribe to our newsletter for the latest launches, reviews "
+           "and market updates.</p><p>Copyright Fixture News. All rights reserved.</p></footer>")
+
+
+# Function to render page `index` as an HTML article
+def page_html(index, paragraphs=20, seed=0, revision=0):
+    body = "".join(f"<p>{html.escape(text)}</p>" for text in page_paragraphs(index, paragraphs, seed=seed, revision=revision))
+    return (f"<html><head><title>Article {index}</title></head><body>{_NAVIGATION}<h1>Article {index}</h1>{body}"
+            f"{_FOOTER}</body></html>")
+
+
+# Function to build `count` (question, expected answer fragment) pairs about pages 0..pages-1
+def questions(pages, count, seed=0):
+    rng = random.Random(f"questions:{seed}")
+    picks = [rng.randrange(pages) for _ in range(count)]
+    return [(f"What is the price of the {product_name(i)}?", product_price(i)) for i in picks]
+
+
+# Serves /page/<index> for every page of the corpus from a background thread. Responses carry
+# an ETag and Last-Modified for the page's current revision and conditional requests get 304;
+# `responses` counts the (status, index) pairs served. Failures can be injected with fail(),
+# and `delay` holds every response back for that many seconds.
+class FixtureServer:
+    def __init__(self, pages, paragraphs=20, seed=0):
+        self.pages = pages
+        self.revisions = Counter()
+        self.modified = {}
+        self.responses = Counter()
+        self.failures = {}  # index -> [status, remaining count]
+        self.delay = 0.0
+        self._started = time.time()
+        corpus = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    index = int(self.path.rsplit("/", 1)[-1])
+                except ValueError:
+                    index = -1
+                if corpus.delay:
+                    time.sleep(corpus.delay)
+                if not 0 <= index < corpus.pages:
+                    corpus.responses[404, index] += 1
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                failure = corpus.failures.get(index)
+                if failure and failure[1] > 0:
+                    failure[1] -= 1
+                    corpus.responses[failure[0], index] += 1
+                    self.send_response(failure[0])
+                    self.end_headers()
+                    return
+                revision = corpus.revisions[index]
+                etag = f'"{index}-{revision}"'
+                last_modified = email.utils.formatdate(corpus.modified.get(index, corpus._started), usegmt=True)
+                if self.headers.get("If-None-Match") == etag:
+                    corpus.responses[304, index] += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                corpus.responses[200, index] += 1
+                body = page_html(index, paragraphs, seed, revision).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+            # A client that gave up (a fetch timeout) is not an error of the server
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionError:
+                    pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    # Publish a new revision of page `index` (a different price)
+    def revise(self, index):
+        self.revisions[index] += 1
+        self.modified[index] = time.time()
+
+    # Answer the next `times` requests for page `index` with an error status
+    def fail(self, index, status=503, times=1):
+        self.failures[index] = [status, times]
+
+    def urls(self):
+        return [f"{self.base_url}/page/{index}" for index in range(self.pages)]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,146 @@
+from collections import Counter
+from typing import Any
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import config
+from instrumentation import get_tracer
+from index_sync import chunk_id
+from sharding import source_filter
+
+
+# Function to run a BM25 query and wrap the hits as Documents carrying their chunk IDs
+def lexical_search(lexical_index, query, k, sources=None):
+    return [
+        Document(id=doc_id, page_content=text, metadata=metadata)
+        for doc_id, text, metadata, _ in lexical_index.search(query, k=k, sources=sources)
+    ]
+
+
+# Function to identify a retrieved chunk across both indexes (Chroma IDs are the sync engine's chunk IDs)
+def document_key(document):
+    return document.id or chunk_id(document.metadata.get("source", ""), document.page_content)
+
+
+# Function to merge ranked result lists with weighted reciprocal rank fusion
+def reciprocal_rank_fusion(ranked_lists, weights, rrf_k=config.RETRIEVAL_RRF_K):
+    scores = Counter()
+    documents = {}
+    for ranked, weight in zip(ranked_lists, weights):
+        for rank, document in enumerate(ranked):
+            key = document_key(document)
+            documents.setdefault(key, document)
+            scores[key] += weight / (rrf_k + rank + 1)
+    return [documents[key] for key, _ in scores.most_common()]
+
+
+# Retriever combining BM25 and dense vector search.
+#   mode="hybrid":    both searches, fused with weighted reciprocal rank fusion
+#   mode="lexical":   BM25 only, no embedding call at all
+#   mode="vector":    dense search only (the previous behaviour)
+#   mode="prefilter": BM25 picks `prefilter_k` candidates and only those are scored against the
+#                     query embedding, so vector work no longer grows with the corpus size
+# With `sources` set, only chunks of those source URLs are retrieved. Queries are embedded with
+# `embeddings` when given (a session's API key over a shared store), else the store's own. The stores may be the
+# fan-out views of a sharded store (sharding.py), which then search only the shards involved.
+# batch_search() retrieves for many queries at once (see batch_query.py).
+class HybridRetriever(BaseRetriever):
+    vectorstore: Any
+    lexical_index: Any
+    k: int = config.RETRIEVAL_K
+    fetch_k: int = config.RETRIEVAL_FETCH_K
+    prefilter_k: int = config.RETRIEVAL_PREFILTER_K
+    vector_weight: float = config.RETRIEVAL_VECTOR_WEIGHT
+    lexical_weight: float = config.RETRIEVAL_LEXICAL_WEIGHT
+    rrf_k: int = config.RETRIEVAL_RRF_K
+    mode: str = config.RETRIEVAL_MODE
+    sources: tuple = ()
+    embeddings: Any = None
+
+    @property
+    def query_embeddings(self):
+        return self.embeddings or self.vectorstore.embeddings
+
+    # Dense search for one query, with the retriever's own embeddings when it has them
+    def _dense_search(self, query, k, sources):
+        if self.embeddings is None:
+            return self.vectorstore.similarity_search(query, k=k, filter=source_filter(sources))
+        from batch_query import batch_similarity_search
+
+        hits = batch_similarity_search(self.vectorstore, [self.embeddings.embed_query(query)], k, source_filter(sources))
+        return [document for document, _ in hits[0]]
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        with get_tracer().span("retrieve", mode=self.mode) as span:
+            documents = self._search(query)
+            span.set("documents", len(documents))
+            return documents
+
+    def _search(self, query):
+        sources = self.sources or None
+        if self.mode == "vector":
+            return self._dense_search(query, self.k, sources)
+        lexical = lexical_search(self.lexical_index, query, self.fetch_k, sources)
+        if self.mode == "lexical":
+            return lexical[:self.k]
+        if self.mode == "prefilter" and lexical:
+            dense = self._rerank_candidates(query, lexical_search(self.lexical_index, query, self.prefilter_k, sources))
+        else:
+            dense = self._dense_search(query, self.fetch_k, sources)
+        fused = reciprocal_rank_fusion([dense, lexical], [self.vector_weight, self.lexical_weight], self.rrf_k)
+        return fused[:self.k]
+
+    # Retrieve for many queries with one embedding request and one vector search for the whole
+    # batch; BM25 search and fusion stay per query. Returns one document list per query.
+    def batch_search(self, queries):
+        from batch_query import batch_similarity_search
+
+        queries = list(queries)
+        sources = self.sources or None
+        with get_tracer().span("retrieve", mode=self.mode, queries=len(queries)) as span:
+            if self.mode == "lexical":
+                results = [lexical_search(self.lexical_index, query, self.k, sources) for query in queries]
+                span.set("documents", sum(len(documents) for documents in results))
+                return results
+            embeddings = self.query_embeddings
+            vectors = (embeddings.embed_queries(queries) if hasattr(embeddings, "embed_queries")
+                       else embeddings.embed_documents(queries))
+            if self.mode == "vector":
+                hits = batch_similarity_search(self.vectorstore, vectors, self.k, source_filter(sources))
+                results = [[document for document, _ in found] for found in hits]
+                span.set("documents", sum(len(documents) for documents in results))
+                return results
+
+            lexical = [lexical_search(self.lexical_index, query, self.fetch_k, sources) for query in queries]
+            dense = {}
+            searched = [i for i in range(len(queries)) if self.mode != "prefilter" or not lexical[i]]
+            if searched:
+                hits = batch_similarity_search(self.vectorstore, [vectors[i] for i in searched], self.fetch_k,
+                                               source_filter(sources))
+                dense.update((i, [document for document, _ in found]) for i, found in zip(searched, hits))
+            for i in range(len(queries)):
+                if i not in dense:
+                    candidates = lexical_search(self.lexical_index, queries[i], self.prefilter_k, sources)
+                    dense[i] = self._rerank_candidates(queries[i], candidates, vectors[i])
+            weights = [self.vector_weight, self.lexical_weight]
+            results = [reciprocal_rank_fusion([dense[i], lexical[i]], weights, self.rrf_k)[:self.k]
+                       for i in range(len(queries))]
+            span.set("documents", sum(len(documents) for documents in results))
+            return results
+
+    # Score only the lexical candidates against the query embedding, using their stored vectors
+    def _rerank_candidates(self, query, candidates, query_vector=None):
+        documents = {document_key(document): document for document in candidates}
+        stored = self.vectorstore.get(ids=list(documents), include=["embeddings"])
+        if not len(stored["ids"]):
+            return []
+        matrix = np.asarray(stored["embeddings"], dtype=np.float32)
+        if query_vector is None:
+            query_vector = self.query_embeddings.embed_query(query)
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+        similarities = matrix @ query_vector / np.where(norms == 0, 1.0, norms)
+        order = np.argsort(-similarities)[:self.fetch_k]
+        return [documents[stored["ids"][i]] for i in order]
@@ -0,0 +1,356 @@
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+try:
+    import fcntl
+except ImportError:  # Windows: manifest updates are only serialised within the process
+    fcntl = None
+
+import config
+from chunking import iter_windows
+from instrumentation import get_tracer
+from lexical_index import BM25Index
+
+
+# Function to compute the SHA-256 hex digest of a piece of text
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Function to build the deterministic vector-store ID of a chunk: the same text from the
+# same source always maps to the same ID, so re-ingesting unchanged chunks is a no-op
+def chunk_id(source, text):
+    return content_hash(f"{source}\0{content_hash(text)}")
+
+
+# Summary of one source's synchronisation
+@dataclass
+class SyncResult:
+    source: str
+    added: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+    skipped: bool = False  # page content identical to the last sync, nothing was split or embedded
+
+
+# Page hash and chunk IDs of every source synced into a store, in SQLite next to its manifest,
+# so syncing one source reads and writes that source's rows only, however large the store is
+class SourceIndex:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, page_hash TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (source TEXT, id TEXT, PRIMARY KEY (source, id)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def page_hash(self, source):
+        with self._lock:
+            row = self._conn.execute("SELECT page_hash FROM sources WHERE source = ?", (source,)).fetchone()
+        return row[0] if row else None
+
+    def sources(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT source FROM sources ORDER BY source")]
+
+    def chunk_ids(self, source):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT id FROM chunks WHERE source = ?", (source,))]
+
+    # Record sources given as {source: {"page_hash": ..., "chunk_ids": [...]}} in one transaction
+    def update(self, entries):
+        with self._lock:
+            for source, entry in entries.items():
+                self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+                self._conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?)", (source, entry["page_hash"]))
+                self._conn.executemany("INSERT OR IGNORE INTO chunks VALUES (?, ?)",
+                                       [(source, cid) for cid in entry["chunk_ids"]])
+            self._conn.commit()
+
+    def remove(self, source):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conn.execute("DELETE FROM sources WHERE source = ?", (source,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM sources")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Keeps a Chroma collection in step with the latest content of each source URL.
+# A JSON manifest next to the store holds a version counter that increases whenever the
+# collection changes; the page hash and chunk IDs of every source live in its SourceIndex
+# (older manifests listing them are migrated when the store is opened). New chunks are
+# embedded through the batching scheduler and written to the collection as batches complete.
+# The BM25 index stored beside the manifest receives the same upserts and deletes.
+# Chunks may arrive lazily: they are pulled in windows only as fast as the scheduler has
+# batches free, so peak memory does not grow with the length of the page.
+# The embedding scheduler (and the LangChain embedding stack behind it) is imported on first
+# use, so the manifest helpers below stay cheap to import for the UI's first render.
+class IndexSync:
+    def __init__(self, vectorstore, manifest_path=None, scheduler=None, lexical_index=None):
+        from embedding_scheduler import EmbeddingScheduler
+
+        self.vectorstore = vectorstore
+        self.scheduler = scheduler or (EmbeddingScheduler(vectorstore.embeddings) if vectorstore.embeddings else None)
+        self._schedulers = {}  # id(embeddings) -> (embeddings, scheduler) for embeddings passed per call
+        self.manifest_path = manifest_path or os.path.join(config.VECTORSTORE_PATH, config.INDEX_MANIFEST_NAME)
+        self.lexical_index = lexical_index or BM25Index(
+            os.path.join(os.path.dirname(self.manifest_path), config.LEXICAL_INDEX_NAME)
+        )
+        self.source_index = SourceIndex(os.path.join(os.path.dirname(self.manifest_path), config.INDEX_SOURCES_NAME))
+        self._lock = threading.Lock()
+        self._open_manifest()
+        if self.source_index.sources() and not len(self.lexical_index):
+            self.rebuild_lexical_index()
+
+    # Load the manifest, moving the sources of an older manifest into the SourceIndex. When the
+    # store was switched to another vector backend (config.VECTOR_BACKEND), which holds none of
+    # the pages yet, the page hashes and the BM25 index are dropped, so the next ingest indexes
+    # every page into the new backend and keyword hits never point at chunks it does not have.
+    def _open_manifest(self):
+        backend = type(self.vectorstore).__name__
+        with self._lock, manifest_lock(self.manifest_path):
+            existed = os.path.exists(self.manifest_path)
+            manifest = load_manifest(self.manifest_path)
+            changed = "sources" in manifest
+            if changed:
+                self.source_index.update(manifest.pop("sources"))
+            if manifest.setdefault("backend", "Chroma" if existed else backend) != backend:  # older stores are Chroma
+                self.source_index.clear()
+                self.lexical_index.clear()
+                manifest["backend"] = backend
+                changed = True
+            if changed:
+                save_manifest(self.manifest_path, manifest)
+            self.manifest = manifest
+
+    # Apply `change(manifest)` to the manifest as it is on disk and save it. Other IndexSync
+    # objects (in this process or another one) may have written it since it was loaded, so it is
+    # re-read under the manifest's lock and every version bump builds on the latest one.
+    def _update_manifest(self, change):
+        with self._lock, manifest_lock(self.manifest_path):
+            manifest = load_manifest(self.manifest_path)
+            change(manifest)
+            save_manifest(self.manifest_path, manifest)
+            self.manifest = manifest
+
+    # Scheduler embedding with `embeddings` (the store's own embeddings when None)
+    def _scheduler(self, embeddings=None):
+        from embedding_scheduler import EmbeddingScheduler
+
+        if embeddings is None:
+            if self.scheduler is None:
+                raise ValueError("This store has no embeddings of its own; pass embeddings to sync_document")
+            return self.scheduler
+        with self._lock:
+            if id(embeddings) not in self._schedulers:
+                self._schedulers[id(embeddings)] = (embeddings, EmbeddingScheduler(embeddings))
+            return self._schedulers[id(embeddings)][1]
+
+    @property
+    def version(self):
+        return self.manifest["version"]
+
+    # Sources currently tracked in this store
+    def sources(self):
+        return self.source_index.sources()
+
+    # Check whether a page's content is identical to what was indexed last time
+    def page_unchanged(self, source, page_content):
+        return self.source_index.page_hash(source) == content_hash(page_content)
+
+    # Split and sync one loaded document, skipping the work entirely if the page has not changed.
+    # `split([document])` may return a list or a lazy iterable of chunks (chunking.iter_split_documents).
+    # New chunks are embedded with `embeddings` (a session's API key), or the store's own embeddings.
+    # `force` re-splits an unchanged page (its boilerplate changed, see chunking.BoilerplateIndex).
+    def sync_document(self, document, split, embeddings=None, force=False):
+        source = document.metadata["source"]
+        if not force and self.page_unchanged(source, document.page_content):
+            return SyncResult(source, skipped=True)
+        return self.sync_source(source, document.page_content, self._timed_split(source, document, split), embeddings)
+
+    # Run the splitter under a "split" span covering only the time spent producing
+    # chunks, which interleaves with embedding when the splitter is lazy
+    def _timed_split(self, source, document, split):
+        elapsed, count = 0.0, 0
+        start = time.perf_counter()
+        for chunk in split([document]):
+            elapsed += time.perf_counter() - start
+            count += 1
+            yield chunk
+            start = time.perf_counter()
+        elapsed += time.perf_counter() - start
+        get_tracer().record("split", elapsed, source=source, chars=len(document.page_content), chunks=count)
+
+    # Sink writing each embedded batch to the collection and the BM25 index
+    def _sink(self):
+        from embedding_scheduler import vectorstore_sink
+
+        upsert = vectorstore_sink(self.vectorstore)
+
+        def sink(batch, vectors):
+            upsert(batch, vectors)
+            self.lexical_index.add((job.id, job.text, job.metadata) for job in batch)
+        return sink
+
+    # Turn a stream of chunks into embedding jobs for the ones not yet in the
+    # collection, one window at a time. `seen` collects every chunk ID of the source and
+    # `counts` the number of new chunks.
+    def _iter_jobs(self, source, chunks, existing, seen, counts):
+        from embedding_scheduler import EmbeddingJob
+
+        for window in iter_windows(chunks):
+            fresh = {}
+            for chunk in window:
+                chunk.metadata["source"] = source
+                cid = chunk_id(source, chunk.page_content)
+                if cid not in seen:  # identical chunks share an ID
+                    seen[cid] = None
+                    fresh[cid] = chunk
+            # Chunks already in the collection but not in the BM25 index (indexed before it existed)
+            kept = [cid for cid in fresh if cid in existing]
+            self.lexical_index.add(
+                (cid, fresh[cid].page_content, fresh[cid].metadata) for cid in self.lexical_index.missing(kept)
+            )
+            for cid, chunk in fresh.items():
+                if cid not in existing:
+                    counts["added"] += 1
+                    yield EmbeddingJob(cid, chunk.page_content, chunk.metadata)
+
+    # Upsert the new chunks of a source and delete the ones that disappeared from it
+    def sync_source(self, source, page_content, chunks, embeddings=None):
+        # The collection is the source of truth, which also cleans up chunks written before IDs were deterministic
+        existing = set(self.vectorstore.get(where={"source": source}, include=[])["ids"])
+        seen, counts = {}, {"added": 0}
+        self._scheduler(embeddings).run(self._iter_jobs(source, chunks, existing, seen, counts), self._sink())
+
+        vanished = [cid for cid in existing if cid not in seen]
+        if vanished:
+            with get_tracer().span("delete", source=source, chunks=len(vanished)):
+                self.vectorstore.delete(ids=vanished)
+                self.lexical_index.delete(vanished)
+
+        added = counts["added"]
+        self.source_index.update({source: {"page_hash": content_hash(page_content), "chunk_ids": list(seen)}})
+        if added or vanished:
+            self._update_manifest(_bump_version)
+        return SyncResult(source, added=added, deleted=len(vanished), unchanged=len(seen) - added)
+
+    # Rebuild the BM25 index from the chunks stored in the collection (stores indexed before it existed)
+    def rebuild_lexical_index(self):
+        stored = self.vectorstore.get(include=["documents", "metadatas"])
+        self.lexical_index.add(zip(stored["ids"], stored["documents"], stored["metadatas"]))
+
+    # Remove every chunk of a source that is no longer tracked
+    def remove_source(self, source):
+        existing = self.vectorstore.get(where={"source": source}, include=[])["ids"]
+        if existing:
+            self.vectorstore.delete(ids=existing)
+            self.lexical_index.delete(existing)
+
+        self.source_index.remove(source)
+        if existing:
+            self._update_manifest(_bump_version)
+        return SyncResult(source, deleted=len(existing))
+
+
+# Function to count one more change of a store in its manifest
+def _bump_version(manifest):
+    manifest["version"] += 1
+
+
+# Function to read the current version of a store from its manifest. It changes on every
+# re-index, and a store rebuilt from scratch gets a new store_id, so versions never repeat.
+# A sharded store (see sharding.py) is versioned by the combination of its shards' versions.
+def store_version(path=config.VECTORSTORE_PATH):
+    versions = []
+    for manifest_path in manifest_paths(path):
+        manifest = load_manifest(manifest_path)
+        versions.append(f"{manifest.get('store_id', 'legacy')}:{manifest['version']}")
+    if not versions:
+        return "unversioned"
+    if len(versions) == 1 and not os.path.isdir(os.path.join(path, config.SHARDS_DIR_NAME)):
+        return versions[0]
+    return f"sharded:{content_hash('|'.join(versions))[:16]}"
+
+
+# Function to list the manifests of a store: its own, and one per shard of a sharded store
+def manifest_paths(path=config.VECTORSTORE_PATH):
+    paths = [os.path.join(path, config.INDEX_MANIFEST_NAME)]
+    shards_path = os.path.join(path, config.SHARDS_DIR_NAME)
+    if os.path.isdir(shards_path):
+        paths += [os.path.join(shards_path, key, config.INDEX_MANIFEST_NAME) for key in sorted(os.listdir(shards_path))]
+    return [manifest_path for manifest_path in paths if os.path.exists(manifest_path)]
+
+
+# Function to list every source indexed in a store (sharded or not), read from the source index
+# beside each manifest (or from a manifest not migrated yet)
+def indexed_sources(path=config.VECTORSTORE_PATH):
+    sources = set()
+    for manifest_path in manifest_paths(path):
+        sources.update(load_manifest(manifest_path).get("sources", ()))
+        sources_path = os.path.join(os.path.dirname(manifest_path), config.INDEX_SOURCES_NAME)
+        if os.path.exists(sources_path):
+            with contextlib.closing(sqlite3.connect(sources_path)) as conn:
+                sources.update(row[0] for row in conn.execute("SELECT source FROM sources"))
+    return sorted(sources)
+
+
+# One lock per manifest file for the threads of this process
+_manifest_locks = {}
+_manifest_locks_lock = threading.Lock()
+
+
+# Function to hold a manifest's lock: a thread lock, plus an exclusive lock on `<manifest>.lock`
+# so other processes (server, CLI, app) serialise their updates too
+@contextlib.contextmanager
+def manifest_lock(path):
+    with _manifest_locks_lock:
+        lock = _manifest_locks.setdefault(os.path.abspath(path), threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(f"{path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Function to read the manifest, starting a fresh one if the store has never been synced
+def load_manifest(path):
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {"store_id": uuid.uuid4().hex, "version": 0}
+
+
+# Function to write the manifest atomically so a crash never leaves it half-written
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,206 @@
+import logging
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from langchain_core.documents import Document
+
+import config
+from instrumentation import get_tracer
+
+logger = logging.getLogger(__name__)
+
+# HTTP status codes that are worth retrying (rate limiting and transient server errors)
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    pass
+
+
+# Raw HTTP response for one URL
+@dataclass
+class FetchResponse:
+    url: str
+    status: int
+    text: str
+    headers: dict
+    attempts: int
+    elapsed: float
+
+
+# Outcome of fetching and parsing one URL, with per-stage timings
+@dataclass
+class IngestResult:
+    url: str
+    document: Document = None
+    elements: list = field(default_factory=list)  # (category, text) pairs from unstructured
+    status: int = None
+    headers: dict = field(default_factory=dict)  # response headers (ETag, Last-Modified for re-crawls)
+    attempts: int = 0
+    fetch_time: float = 0.0
+    parse_time: float = 0.0
+    error: str = None
+
+    @property
+    def ok(self):
+        return self.document is not None
+
+
+# Function to perform a single GET, enforcing the timeout on the whole download
+def _fetch_once(url, timeout, headers):
+    request = urllib.request.Request(url, headers={"User-Agent": config.FETCH_USER_AGENT, **headers})
+    deadline = time.monotonic() + timeout
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        body = bytearray()
+        while True:
+            block = response.read(64 * 1024)
+            if not block:
+                break
+            body.extend(block)
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"download exceeded {timeout}s")
+        charset = response.headers.get_content_charset() or "utf-8"
+        return response.status, body.decode(charset, errors="replace"), dict(response.headers)
+
+
+# Function to download a page, retrying transient failures with exponential backoff.
+# A conditional request (If-None-Match / If-Modified-Since in `headers`) answered with
+# 304 Not Modified returns a response with status 304 and no text.
+def fetch_url(url, timeout=config.FETCH_TIMEOUT, retries=config.FETCH_RETRIES, headers=None, backoff=0.5):
+    start = time.perf_counter()
+    last_error = None
+    for attempt in range(1, retries + 2):
+        try:
+            status, text, response_headers = _fetch_once(url, timeout, headers or {})
+            return FetchResponse(url, status, text, response_headers, attempt, time.perf_counter() - start)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return FetchResponse(url, 304, "", dict(e.headers), attempt, time.perf_counter() - start)
+            last_error = e
+            if e.code not in RETRYABLE_STATUS:
+                break
+        except (urllib.error.URLError, OSError) as e:  # includes socket timeouts
+            last_error = e
+        except (ValueError, LookupError) as e:  # malformed URL or unknown charset: retrying cannot help
+            last_error = e
+            break
+        if attempt <= retries:
+            time.sleep(backoff * 2 ** (attempt - 1))
+    raise FetchError(f"Failed to fetch {url}: {last_error}")
+
+
+# Function to partition HTML into text elements; runs inside the parse process pool
+def parse_html(html):
+    start = time.perf_counter()
+    if config.USE_FAKE_BACKENDS:  # offline runs: unstructured would download a spaCy model
+        from fake_backends import partition_html
+
+        return partition_html(html), time.perf_counter() - start
+    from unstructured.partition.html import partition_html
+
+    elements = [(element.category, str(element)) for element in partition_html(text=html)]
+    return elements, time.perf_counter() - start
+
+
+# Function to build a LangChain document the same way UnstructuredURLLoader does. The element
+# layout (category and length of each element) is kept in the metadata for the structured
+# splitter (chunking.py); it is not copied to the chunks.
+def to_document(url, elements):
+    text = "\n\n".join(text for _, text in elements)
+    return Document(page_content=text, metadata={"source": url, "elements": [(c, len(t)) for c, t in elements]})
+
+
+# Function to fetch and parse URLs concurrently, yielding each result as soon as it is ready.
+# Fetching runs on a bounded thread pool and parsing on a process pool (or inline in the
+# fetch threads when parse_workers is 0), so callers can start splitting and embedding
+# before the slowest page has arrived. Failed URLs are yielded with `error` set.
+def iter_ingest(urls, max_workers=config.FETCH_MAX_WORKERS, parse_workers=config.PARSE_MAX_WORKERS,
+                timeout=config.FETCH_TIMEOUT, retries=config.FETCH_RETRIES):
+    urls = [url for url in dict.fromkeys(urls) if url]  # drop blanks and duplicates, keep order
+    if not urls:
+        return
+
+    tracer = get_tracer()
+    fetch_pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls))))
+    parse_pool = ProcessPoolExecutor(max_workers=parse_workers) if parse_workers > 0 else fetch_pool
+    pending = {}
+    try:
+        for url in urls:
+            pending[fetch_pool.submit(fetch_url, url, timeout, retries)] = ("fetch", IngestResult(url))
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, result = pending.pop(future)
+                if stage == "fetch":
+                    try:
+                        response = future.result()
+                    except Exception as e:  # FetchError, or anything unexpected: only this URL fails
+                        result.error = str(e) if isinstance(e, FetchError) else f"Failed to fetch {result.url}: {e}"
+                        logger.error(result.error)
+                        tracer.record("fetch", 0.0, error=result.error, url=result.url)
+                        yield result
+                        continue
+                    result.status = response.status
+                    result.headers = response.headers
+                    result.attempts = response.attempts
+                    result.fetch_time = response.elapsed
+                    tracer.record("fetch", response.elapsed, url=result.url, status=response.status,
+                                  attempts=response.attempts, chars=len(response.text))
+                    pending[parse_pool.submit(parse_html, response.text)] = ("parse", result)
+                else:
+                    try:
+                        result.elements, result.parse_time = future.result()
+                    except Exception as e:
+                        logger.error(f"Error processing {result.url}, exception: {e}")
+                        result.error = f"Failed to parse {result.url}: {e}"
+                        tracer.record("parse", 0.0, error=result.error, url=result.url)
+                        yield result
+                        continue
+                    result.document = to_document(result.url, result.elements)
+                    tracer.record("parse", result.parse_time, url=result.url, elements=len(result.elements))
+                    yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        fetch_pool.shutdown(wait=False, cancel_futures=True)
+        if parse_pool is not fetch_pool:
+            parse_pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Function to re-index the pages a boilerplate index marked stale (chunking.BoilerplateIndex): a
+# block that became boilerplate, or stopped being it, changes what pages indexed earlier should
+# leave out. Ingest paths call it after each batch, so stores without a re-crawl worker drop
+# duplicated boilerplate too. Re-indexing a page can mark others stale, so it repeats until no
+# new page is stale. Yields (IngestResult, SyncResult or None when the page failed).
+def resync_stale(index_sync, split, boilerplate, embeddings=None):
+    if boilerplate is None:
+        return
+    done = set()
+    while True:
+        urls = [url for url in boilerplate.stale() if url not in done]
+        if not urls:
+            return
+        done.update(urls)
+        for result in iter_ingest(urls):
+            sync_result = None
+            if result.ok:
+                try:
+                    sync_result = index_sync.sync_document(result.document, split, embeddings, force=True)
+                except Exception as e:
+                    logger.exception(f"Re-indexing {result.url} failed")
+                    result.error = f"Failed to index {result.url}: {e}"
+            yield result, sync_result
+
+
+# Function to format the per-URL timings of an ingest result for logs and the debug view
+def describe_result(result):
+    if not result.ok:
+        return f"{result.url}: FAILED ({result.error})"
+    return (
+        f"{result.url}: fetch {result.fetch_time:.2f}s ({result.attempts} attempt(s)), "
+        f"parse {result.parse_time:.2f}s, {len(result.document.page_content)} chars"
+    )
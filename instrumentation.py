@@ -0,0 +1,207 @@
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+
+import config
+
+# Offline tracing for the RAG pipeline. Every stage (fetch, parse, split, embed, upsert, retrieve,
+# rerank, generate) records a span with its duration and counts. Spans nest through context
+# variables, stay in a bounded in-memory buffer for the latency panel and can be exported to a
+# local JSONL file or to OpenTelemetry's OTLP/JSON file format (readable by the collector's
+# otlpjsonfile receiver). No hosted service is involved.
+
+# Pipeline stages in display order
+STAGES = ["ingest", "recrawl", "fetch", "parse", "split", "embed", "upsert", "delete", "query", "retrieve", "rerank",
+          "generate", "refine"]
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_ROOT = object()
+
+
+# One timed operation. Times are epoch seconds; `attributes` holds counts such as tokens or chunks.
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str = None
+    start_time: float = 0.0
+    duration: float = None
+    attributes: dict = field(default_factory=dict)
+    error: str = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+
+# Writes each finished span as one JSON object per line
+class JsonlSpanExporter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, span):
+        line = json.dumps(asdict(span), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+# Function to convert a span attribute to an OTLP AnyValue
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+# Writes each finished span as an OTLP/JSON ExportTraceServiceRequest line
+class OtlpJsonSpanExporter(JsonlSpanExporter):
+    def export(self, span):
+        start_ns = int(span.start_time * 1e9)
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int((span.duration or 0.0) * 1e9)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        request = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": config.TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "smartsearch.instrumentation"}, "spans": [otlp_span]}],
+        }]}
+        with self._lock:
+            self._file.write(json.dumps(request) + "\n")
+            self._file.flush()
+
+
+# Function to read a percentile off sorted values, interpolating linearly like numpy.percentile
+# (kept in pure Python so the tracer loads without numpy)
+def percentile(ordered, q):
+    position = (len(ordered) - 1) * q / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return float(ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower))
+
+
+# Creates spans, keeps the most recent `buffer_size` finished ones and hands them to the exporter
+class Tracer:
+    def __init__(self, exporter=None, buffer_size=config.TRACE_BUFFER_SIZE):
+        self.exporter = exporter
+        self.spans = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+
+    def current_span(self):
+        return _current_span.get()
+
+    # Open a span without making it current (for work spread over callbacks). The parent is the
+    # current span unless given explicitly; pass parent=None to start a new trace.
+    def start_span(self, name, parent=_ROOT, **attributes):
+        if parent is _ROOT:
+            parent = _current_span.get()
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=parent.span_id if parent else None,
+            start_time=time.time(),
+            attributes=attributes,
+        )
+        span._start = time.perf_counter()
+        return span
+
+    def end_span(self, span, error=None):
+        span.duration = time.perf_counter() - span._start
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        self._finish(span)
+
+    def _finish(self, span):
+        with self._lock:
+            self.spans.append(span)
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    # Context manager timing a block; spans opened inside it (on this thread or in a copied context) become children
+    @contextmanager
+    def span(self, name, parent=_ROOT, **attributes):
+        span = self.start_span(name, parent, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, error=e)
+            raise
+        else:
+            self.end_span(span)
+        finally:
+            _current_span.reset(token)
+
+    # Record a stage that was timed elsewhere (e.g. in a worker process) as a finished child of the current span
+    def record(self, name, duration, error=None, **attributes):
+        span = self.start_span(name, **attributes)
+        span.start_time -= duration
+        span.duration = duration
+        span.error = error
+        self._finish(span)
+
+    # p50/p95 latency (seconds) per stage over the buffered spans
+    def stage_stats(self):
+        with self._lock:
+            spans = list(self.spans)
+        durations = defaultdict(list)
+        for span in spans:
+            durations[span.name].append(span.duration)
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        stats = {}
+        for name in sorted(durations, key=lambda stage: (order.get(stage, len(STAGES)), stage)):
+            values = sorted(durations[name])
+            stats[name] = {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "total": sum(values),
+            }
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+# Function to get the process-wide tracer, exporting as configured by SMARTSEARCH_TRACE_EXPORT
+def get_tracer():
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            exporter = None
+            if config.TRACE_EXPORT in ("jsonl", "otlp"):
+                os.makedirs(os.path.dirname(config.TRACE_PATH) or ".", exist_ok=True)
+                exporter_class = OtlpJsonSpanExporter if config.TRACE_EXPORT == "otlp" else JsonlSpanExporter
+                exporter = exporter_class(config.TRACE_PATH)
+            _tracer = Tracer(exporter)
+        return _tracer
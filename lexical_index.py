@@ -0,0 +1,128 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+import config
+
+# Words, plus numbers with decimal points or thousands separators ("7.1", "1,200") kept whole
+_TERM_PATTERN = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*")
+
+
+# Function to split text into lowercase BM25 terms
+def tokenize(text):
+    return _TERM_PATTERN.findall(text.lower())
+
+
+# Persistent BM25 inverted index stored in SQLite next to the vector store.
+# Postings are updated incrementally as chunks are upserted and deleted, so keyword
+# queries are answered locally in milliseconds without any embedding call.
+class BM25Index:
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._stats = None  # (document count, average length), reset on every write
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, length INTEGER, text TEXT, metadata TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT, id TEXT, tf INTEGER, PRIMARY KEY (term, id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS postings_id ON postings (id)")
+        self._conn.commit()
+
+    # Add or replace chunks given as (id, text, metadata) triples
+    def add(self, items):
+        with self._lock:
+            for doc_id, text, metadata in items:
+                terms = Counter(tokenize(text))
+                self._conn.execute("DELETE FROM postings WHERE id = ?", (doc_id,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO docs VALUES (?, ?, ?, ?)",
+                    (doc_id, sum(terms.values()), text, json.dumps(metadata or {}))
+                )
+                self._conn.executemany(
+                    "INSERT INTO postings VALUES (?, ?, ?)", [(term, doc_id, tf) for term, tf in terms.items()]
+                )
+            self._conn.commit()
+            self._stats = None
+
+    # Drop every chunk (the store was switched to another vector backend)
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM docs")
+            self._conn.commit()
+            self._stats = None
+
+    def delete(self, ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM postings WHERE id = ?", [(doc_id,) for doc_id in ids])
+            self._conn.executemany("DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id in ids])
+            self._conn.commit()
+            self._stats = None
+
+    # Return the subset of `ids` that is not indexed yet
+    def missing(self, ids):
+        ids = list(ids)
+        with self._lock:
+            present = set()
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT id FROM docs WHERE id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                present.update(row[0] for row in rows)
+        return [doc_id for doc_id in ids if doc_id not in present]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    # Return the k best (id, text, metadata, score) tuples for a query, optionally restricted to some sources
+    def search(self, query, k=config.RETRIEVAL_K, sources=None):
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            if self._stats is None:
+                count, average = self._conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+                self._stats = (count, average or 1.0)
+            total_docs, average_length = self._stats
+
+            scores = Counter()
+            for term in terms:
+                rows = self._conn.execute(
+                    "SELECT p.id, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.id WHERE p.term = ?", (term,)
+                ).fetchall()
+                if not rows:
+                    continue
+                idf = math.log(1 + (total_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+                for doc_id, tf, length in rows:
+                    norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+            results = []
+            for doc_id, score in scores.most_common():
+                text, metadata = self._conn.execute(
+                    "SELECT text, metadata FROM docs WHERE id = ?", (doc_id,)
+                ).fetchone()
+                metadata = json.loads(metadata)
+                if sources and metadata.get("source") not in sources:
+                    continue
+                results.append((doc_id, text, metadata, score))
+                if len(results) == k:
+                    break
+        return results
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,80 +1,190 @@
-import os
+import argparse
+import functools
+import json
+import sys
 import time
-from langchain.chains import RetrievalQAWithSourcesChain
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import ChatOpenAI
-from langchain_community.document_loaders import UnstructuredURLLoader
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
 from dotenv import load_dotenv
+import config
+from ingestion import describe_result, iter_ingest, resync_stale
+from embedding_cache import get_cache
+from pipeline import Pipeline
+from batch_qa import answer_question, iter_answers, prepare_resume, read_questions
+from instrumentation import get_tracer
+from client import SmartSearchClient
+from recrawl import registry_for
 
-# Load environment variables (e.g., OpenAI API key from .env)
-load_dotenv()
-
-# Initialize ChatOpenAI with GPT-4
-llm = ChatOpenAI(model="gpt-4", temperature=0.6, max_tokens=500)
-
-# Input URLs manually (Replace these with your URLs)
-urls = [
-    "https://www.moneycontrol.com/news/business/tata-motors-mahindra-gain-certificates-for-production-linked-payouts-11281691.html",
-    "https://www.moneycontrol.com/news/business/tata-motors-launches-punch-icng-price-starts-at-rs-7-1-lakh-11098751.html",
-    "https://www.moneycontrol.com/news/business/stocks/buy-tata-motors-target-of-rs-743-kr-choksey-11080811.html"
-]
-
-# Load data from URLs
-loader = UnstructuredURLLoader(urls=urls)
-print("Data Loading...Started...✅✅✅")
-data = loader.load()
-
-# Print loaded data for debugging
-print(f"Loaded data: {data}")
-
-# Split data with chunk overlapping
-text_splitter = RecursiveCharacterTextSplitter(
-    separators=['\n\n', '\n', '.', ','],
-    chunk_size=1500,
-    chunk_overlap=200  # Adding chunk overlap to maintain context across chunks
-)
-print("Text Splitter...Started...✅✅✅")
-docs = text_splitter.split_documents(data)
-
-# Print split documents for debugging
-print(f"Split documents: {docs}")
-
-if not docs:  # Check if docs list is empty
-    print("No documents to create embeddings from. Exiting...")
-else:
-    # Create embeddings and save them to Chroma vector store
-    embeddings = OpenAIEmbeddings()
-    vectorstore_path = "chroma_vectorstore"
-    vectorstore = Chroma.from_documents(docs, embeddings, persist_directory=vectorstore_path)
-    print("Embedding Vector Started Building...✅✅✅")
-    print("Embeddings created and stored in Chroma successfully.")
-    time.sleep(2)
-
-# Simulate a question input (Replace with your question)
-query = "What is the Tiago iCNG price?"
-
-if query:
-    # Load the Chroma vector store from the directory if it exists
-    vectorstore = Chroma(persist_directory=vectorstore_path, embedding_function=OpenAIEmbeddings())
-
-    # Create the retrieval chain
-    chain = RetrievalQAWithSourcesChain.from_llm(
-        llm=llm,
-        retriever=vectorstore.as_retriever(),
-        return_source_documents=True
-    )
-    result = chain({"question": query})
-    
-    # Print the answer
-    print("Answer:")
-    print(result["answer"])
-
-    # Display sources, if available
-    sources = result.get("sources", "")
-    if sources:
-        print("Sources:")
-        sources_list = sources.split("\n")  # Split the sources by newline
-        for source in sources_list:
-            print(source)
+# Command-line entry point:
+#   python main_python.py ingest URL [URL ...] [--urls-file urls.txt]
+#   python main_python.py ask --question "What is the Tiago iCNG price?" [--source URL ...]
+#   python main_python.py ask questions.jsonl --output answers.jsonl [--concurrency 8] [--batch-size 32] [--resume]
+# Both subcommands reuse the persistent vector store: unchanged pages are not re-embedded.
+# Question files are retrieved --batch-size questions at a time (batch_query.py) before the
+# answers are generated in parallel.
+# With --server URL (or SMARTSEARCH_SERVER_URL) they go through a running server.py instead.
+
+
+# Function to print p50/p95 latency per pipeline stage for this run
+def print_stage_stats():
+    print("Stage latency (ms):", file=sys.stderr)
+    for stage, values in get_tracer().stage_stats().items():
+        print(f"  {stage:<9} n={values['count']:<6} p50={values['p50'] * 1000:9.1f} p95={values['p95'] * 1000:9.1f}",
+              file=sys.stderr)
+
+
+# Function to fetch, split and index URLs into the store, printing one line per page
+def ingest(args):
+    urls = list(args.urls)
+    if args.urls_file:
+        with open(args.urls_file, encoding="utf-8") as f:
+            urls.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    if not urls:
+        print("No URLs given.", file=sys.stderr)
+        return 1
+
+    if args.server:
+        return ingest_remote(args.server, urls)
+
+    pipeline = Pipeline(path=args.store, chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    # Load data from URLs (fetched concurrently, parsed in worker processes) and index each page as it arrives
+    print("Data Loading...Started...✅✅✅")
+    indexed = 0
+    registry = registry_for(args.store)  # ingested pages are re-checked by recrawl.py
+    with get_tracer().span("ingest", urls=len(urls)):
+        for result in iter_ingest(dict.fromkeys(urls)):
+            print(describe_result(result))
+            if result.ok:
+                registry.track(result.url, result.headers)
+                sync_result = pipeline.index_sync.sync_document(result.document, pipeline.split_documents)
+                print(f"Indexed: {sync_result}")
+                indexed += 1
+        # Pages indexed earlier whose boilerplate changed with this batch
+        boilerplate = getattr(pipeline.text_splitter, "boilerplate", None)
+        for result, sync_result in resync_stale(pipeline.index_sync, pipeline.split_documents, boilerplate):
+            print(f"Re-indexed (boilerplate changed): {sync_result}" if sync_result else describe_result(result))
+    print_stage_stats()
+
+    if not indexed:  # Check if any page was loaded
+        print("No documents to create embeddings from.")
+        return 1
+    print("Embeddings created and stored in the vector store successfully.")
+    print(f"Embedding cache: {get_cache().stats()}")
+    if hasattr(pipeline.text_splitter, "totals"):
+        from chunking import describe_totals
+
+        print(describe_totals(pipeline.text_splitter.totals))
+    return 0
+
+
+# Function to index URLs through a query server, printing one line per page
+def ingest_remote(server_url, urls):
+    results = SmartSearchClient(server_url).ingest(dict.fromkeys(urls))
+    for result in results:
+        print(f"{result['url']}: {result['error']}" if not result["ok"] else
+              f"{result['url']}: added={result['added']} deleted={result['deleted']} unchanged={result['unchanged']}")
+    if not any(result["ok"] for result in results):
+        print("No documents to create embeddings from.")
+        return 1
+    return 0
+
+
+# Function to answer a single question on the terminal, or a question file into a JSONL output
+def ask(args):
+    sources = args.source or ()
+    pipeline = None
+    if args.server:
+        answer = functools.partial(SmartSearchClient(args.server).ask, sources=sources)
+    else:
+        pipeline = Pipeline(path=args.store)
+        answer = functools.partial(answer_question, pipeline.chain_for(sources))
+
+    if args.question:
+        record = answer("1", args.question)
+        if record.get("error"):
+            print(record["error"], file=sys.stderr)
+            return 1
+        # Print the answer
+        print("Answer:")
+        print(record["answer"])
+        # Display sources, if available
+        if record["sources"]:
+            print("Sources:")
+            for source in record["sources"]:
+                print(source)
+        return 0
+
+    if not args.questions_file or not args.output:
+        print("Give --question, or a questions file and --output.", file=sys.stderr)
+        return 1
+
+    done = prepare_resume(args.output) if args.resume else set()
+    items = ((item_id, question) for item_id, question in read_questions(args.questions_file) if item_id not in done)
+    answered = failed = 0
+    start = time.perf_counter()
+    if pipeline is not None and args.batch_size > 1:
+        from batch_query import iter_batch_answers
+
+        records = iter_batch_answers(pipeline.llm, pipeline.chain_for(sources).retriever, items, args.batch_size,
+                                     args.concurrency)
+    else:
+        records = iter_answers(answer, items, args.concurrency)
+    # Each record is flushed as soon as it is written, so an interrupted run loses at most the questions in flight
+    with open(args.output, "a" if args.resume else "w", encoding="utf-8") as out:
+        for record in records:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if record.get("error"):
+                failed += 1
+                print(f"[{record['id']}] failed: {record['error']}", file=sys.stderr)
+            else:
+                answered += 1
+            if (answered + failed) % 50 == 0:
+                print(f"{answered + failed} questions done ({time.perf_counter() - start:.1f}s)", file=sys.stderr)
+
+    if not args.server:
+        print_stage_stats()
+    skipped = f", {len(done)} already answered" if done else ""
+    print(f"Answered {answered} questions, {failed} failed{skipped} in {time.perf_counter() - start:.1f}s.",
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+# Function to build the argument parser for the subcommands
+def build_parser():
+    parser = argparse.ArgumentParser(description="Smart Search Bot: index web pages and answer questions about them.")
+    parser.add_argument("--store", default=config.VECTORSTORE_PATH, help="vector store directory")
+    parser.add_argument("--server", default=config.SERVER_URL, help="URL of a running server.py to use instead of --store")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subcommands.add_parser("ingest", help="fetch URLs and (re-)index changed pages")
+    ingest_parser.add_argument("urls", nargs="*", help="URLs to index")
+    ingest_parser.add_argument("--urls-file", help="file with one URL per line")
+    ingest_parser.add_argument("--chunk-size", type=int, default=config.CHUNK_SIZE)
+    ingest_parser.add_argument("--chunk-overlap", type=int, default=config.CHUNK_OVERLAP)  # maintains context across chunks
+    ingest_parser.set_defaults(handler=ingest)
+
+    ask_parser = subcommands.add_parser("ask", help="answer questions from the indexed pages")
+    ask_parser.add_argument("questions_file", nargs="?", help="JSONL or CSV file of questions")
+    ask_parser.add_argument("--question", help="answer a single question and print it")
+    ask_parser.add_argument("--output", help="JSONL file the answers are streamed to")
+    ask_parser.add_argument("--source", action="append",
+                            help="answer only from this source URL (repeatable; default: all sources)")
+    ask_parser.add_argument("--concurrency", type=int, default=config.ASK_CONCURRENCY,
+                            help="questions answered in parallel")
+    ask_parser.add_argument("--batch-size", type=int, default=config.ASK_BATCH_SIZE,
+                            help="questions retrieved together (1: one retrieval per question)")
+    ask_parser.add_argument("--resume", action="store_true",
+                            help="append to --output, skipping questions it already answers")
+    ask_parser.set_defaults(handler=ask)
+    return parser
+
+
+# The parse stage uses a process pool, so the script body must only run when executed directly
+def main(argv=None):
+    # Load environment variables (e.g., OpenAI API key from .env)
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+import atexit
+import csv
+import io
+import math
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import config
+
+# Durable feedback and timing log for the apps, replacing per-session lists that grew with every
+# question. Events are appended to SQLite by a background writer in batches (every
+# METRICS_BATCH_SIZE events or METRICS_FLUSH_SECONDS). Each batch also updates running
+# aggregates (answers per rating, latency histograms with log-spaced buckets), so charts read a
+# few dozen pre-bucketed rows however long the log gets. Aggregates are kept per session and
+# for all sessions together (ALL_SESSIONS). Reads include events still waiting to be written.
+# The feedback CSV is exported by streaming rows from SQLite, not by building a DataFrame, and
+# evaluation.py can replay the store directly.
+
+ALL_SESSIONS = "*"
+METRICS = ("response", "first_token")
+FEEDBACK_COLUMNS = ["timestamp", "session", "query", "answer", "sources", "rating", "comments", "response_time"]
+
+_BUCKET_BASE = 0.05  # upper edge of the first latency bucket, in seconds
+_BUCKET_GROWTH = 1.5  # each bucket is 1.5x wider than the previous one
+_BUCKETS = 24  # the last bucket (from about 560 s) is open-ended
+
+
+# Function to find the histogram bucket of a latency in seconds
+def latency_bucket(seconds):
+    if seconds <= _BUCKET_BASE:
+        return 0
+    return min(_BUCKETS - 1, math.ceil(math.log(seconds / _BUCKET_BASE, _BUCKET_GROWTH)))
+
+
+# Function to give the upper edge (seconds) of a histogram bucket
+def bucket_edge(bucket):
+    return _BUCKET_BASE * _BUCKET_GROWTH ** bucket
+
+
+class MetricsStore:
+    def __init__(self, path=config.METRICS_DB_PATH, batch_size=config.METRICS_BATCH_SIZE,
+                 flush_seconds=config.METRICS_FLUSH_SECONDS):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._pending = []  # (table, row) tuples not yet written
+        self._lock = threading.Lock()  # guards _pending
+        self._write_lock = threading.Lock()  # one writer (or reader) on the connection at a time
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS feedback (id INTEGER PRIMARY KEY, timestamp REAL, session TEXT, query TEXT,"
+            " answer TEXT, sources TEXT, rating INTEGER, comments TEXT, response_time REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS timings (id INTEGER PRIMARY KEY, timestamp REAL, session TEXT,"
+            " response_time REAL, first_token REAL, cache_hit TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS feedback_session ON feedback (session, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS timings_session ON timings (session, id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rating_counts (session TEXT, rating INTEGER, count INTEGER,"
+            " PRIMARY KEY (session, rating))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS latency_buckets (session TEXT, metric TEXT, bucket INTEGER, count INTEGER,"
+            " total REAL, PRIMARY KEY (session, metric, bucket))"
+        )
+        self._conn.commit()
+        self._closed = False
+        self._wake = threading.Event()
+        self._writer = threading.Thread(target=self._run_writer, name="metrics-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def record_feedback(self, session, query, answer, sources, rating, comments, response_time):
+        self._append("feedback", (time.time(), session, query, answer, sources, int(rating), comments, response_time))
+
+    # One answered question: total response time, time to the first token and how the answer
+    # cache served it ("exact", "semantic" or None)
+    def record_timing(self, session, response_time, first_token=None, cache_hit=None):
+        self._append("timings", (time.time(), session, response_time, first_token, cache_hit))
+
+    def _append(self, table, row):
+        with self._lock:
+            self._pending.append((table, row))
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def _run_writer(self):
+        while not self._closed:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    # Write every pending event and fold it into the aggregates, in one transaction. The batch
+    # leaves _pending and reaches the database under the write lock, so readers holding that lock
+    # see each event exactly once.
+    def flush(self):
+        with self._write_lock:
+            if self._conn is None:  # closed
+                return
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return
+            feedback = [row for table, row in batch if table == "feedback"]
+            timings = [row for table, row in batch if table == "timings"]
+            ratings, latencies = _aggregate(batch)
+            self._conn.executemany(
+                "INSERT INTO feedback (timestamp, session, query, answer, sources, rating, comments, response_time)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", feedback
+            )
+            self._conn.executemany(
+                "INSERT INTO timings (timestamp, session, response_time, first_token, cache_hit) VALUES (?, ?, ?, ?, ?)",
+                timings
+            )
+            self._conn.executemany(
+                "INSERT INTO rating_counts VALUES (?, ?, ?) ON CONFLICT (session, rating)"
+                " DO UPDATE SET count = count + excluded.count",
+                [(session, rating, count) for (session, rating), count in ratings.items()]
+            )
+            self._conn.executemany(
+                "INSERT INTO latency_buckets VALUES (?, ?, ?, ?, ?) ON CONFLICT (session, metric, bucket)"
+                " DO UPDATE SET count = count + excluded.count, total = total + excluded.total",
+                [(session, metric, bucket, count, total) for (session, metric, bucket), (count, total) in latencies.items()]
+            )
+            self._conn.commit()
+
+    def _query(self, sql, parameters=()):
+        with self._write_lock:
+            return self._conn.execute(sql, parameters).fetchall()
+
+    # Rows of a query plus the events not yet written, read together so a flush cannot run in between
+    def _read(self, sql, parameters=()):
+        with self._write_lock:
+            rows = self._conn.execute(sql, parameters).fetchall()
+            with self._lock:
+                return rows, list(self._pending)
+
+    # Number of answers per rating (1-5)
+    def rating_counts(self, session=ALL_SESSIONS):
+        rows, pending = self._read("SELECT rating, count FROM rating_counts WHERE session = ?", (session,))
+        counts = Counter(dict(rows))
+        ratings, _ = _aggregate(pending)
+        counts.update({rating: count for (key, rating), count in ratings.items() if key == session})
+        return dict(sorted(counts.items()))
+
+    # Latency histogram of a metric ("response" or "first_token"): {bucket: (count, total seconds)}
+    def latency_histogram(self, metric="response", session=ALL_SESSIONS):
+        rows, pending = self._read(
+            "SELECT bucket, count, total FROM latency_buckets WHERE session = ? AND metric = ?", (session, metric)
+        )
+        histogram = {bucket: (count, total) for bucket, count, total in rows}
+        _, latencies = _aggregate(pending)
+        for (key, name, bucket), (count, total) in latencies.items():
+            if key == session and name == metric:
+                old_count, old_total = histogram.get(bucket, (0, 0.0))
+                histogram[bucket] = (old_count + count, old_total + total)
+        return dict(sorted(histogram.items()))
+
+    # Count, mean and approximate p50/p95 (bucket upper edges) of a metric, from its histogram
+    def latency_summary(self, metric="response", session=ALL_SESSIONS):
+        histogram = self.latency_histogram(metric, session)
+        count = sum(bucket_count for bucket_count, _ in histogram.values())
+        if not count:
+            return {"count": 0, "mean": None, "p50": None, "p95": None}
+        summary = {"count": count, "mean": sum(total for _, total in histogram.values()) / count}
+        for name, share in (("p50", 0.5), ("p95", 0.95)):
+            seen = 0
+            for bucket, (bucket_count, _) in histogram.items():
+                seen += bucket_count
+                if seen >= share * count:
+                    summary[name] = bucket_edge(bucket)
+                    break
+        return summary
+
+    # The last `limit` timings as (response_time, first_token), oldest first
+    def recent_timings(self, session=ALL_SESSIONS, limit=config.METRICS_RECENT_QUERIES):
+        if session == ALL_SESSIONS:
+            rows, batch = self._read("SELECT response_time, first_token FROM timings ORDER BY id DESC LIMIT ?", (limit,))
+        else:
+            rows, batch = self._read(
+                "SELECT response_time, first_token FROM timings WHERE session = ? ORDER BY id DESC LIMIT ?", (session, limit)
+            )
+        pending = [(row[2], row[3]) for table, row in batch if table == "timings" and session in (ALL_SESSIONS, row[1])]
+        return (rows[::-1] + pending)[-limit:]
+
+    def feedback_count(self, session=ALL_SESSIONS):
+        return sum(self.rating_counts(session).values())
+
+    # Feedback entries as dicts, oldest first, read a page at a time (the lock is not held in between)
+    def iter_feedback(self, session=ALL_SESSIONS, page_size=500):
+        self.flush()
+        sql = f"SELECT id, {', '.join(FEEDBACK_COLUMNS)} FROM feedback WHERE id > ?"
+        if session != ALL_SESSIONS:
+            sql += " AND session = ?"
+        last_id = 0
+        while True:
+            parameters = (last_id,) if session == ALL_SESSIONS else (last_id, session)
+            rows = self._query(sql + " ORDER BY id LIMIT ?", parameters + (page_size,))
+            for row in rows:
+                yield dict(zip(FEEDBACK_COLUMNS, row[1:]))
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1][0]
+
+    # Stream the feedback log as CSV into a text file object
+    def write_feedback_csv(self, file, session=ALL_SESSIONS):
+        writer = csv.DictWriter(file, fieldnames=FEEDBACK_COLUMNS)
+        writer.writeheader()
+        writer.writerows(self.iter_feedback(session))
+
+    # The feedback CSV as a rewound binary file, spilling to disk beyond a few MB (for download buttons)
+    def export_feedback_csv(self, session=ALL_SESSIONS):
+        output = tempfile.SpooledTemporaryFile(max_size=8 * 2 ** 20)
+        text = io.TextIOWrapper(output, encoding="utf-8", newline="", write_through=True)
+        self.write_feedback_csv(text, session)
+        text.detach()  # keep `output` open when the wrapper is collected
+        output.seek(0)
+        return output
+
+    # Stop the writer, then write whatever is still pending and close the connection
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        if self._writer is not threading.current_thread():
+            self._writer.join()
+        self.flush()
+        with self._write_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# Function to fold events into aggregate deltas: {(session, rating): count} and
+# {(session, metric, bucket): (count, total seconds)}, each for the event's session and ALL_SESSIONS
+def _aggregate(batch):
+    ratings = Counter()
+    latencies = {}
+    for table, row in batch:
+        session = row[1]
+        if table == "feedback":
+            for key in (session, ALL_SESSIONS):
+                ratings[key, row[5]] += 1
+            continue
+        for metric, value in zip(METRICS, row[2:4]):
+            if value is None:
+                continue
+            for key in (session, ALL_SESSIONS):
+                count, total = latencies.get((key, metric, latency_bucket(value)), (0, 0.0))
+                latencies[key, metric, latency_bucket(value)] = (count + 1, total + value)
+    return ratings, latencies
+
+
+# One store per database file, shared by every rerun and session of the process
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_metrics_store(path=config.METRICS_DB_PATH):
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = MetricsStore(path)
+        return _stores[path]
@@ -0,0 +1,192 @@
+import functools
+import os
+
+import config
+
+# Builders for the question-answering pipeline, free of any Streamlit dependency.
+# resources.py caches them across Streamlit reruns; the command-line tools use Pipeline.
+# Heavy libraries are imported inside the builders, so they load only when first needed.
+
+
+# Function to get the process-wide pooled HTTP client shared by the OpenAI chat and embedding
+# clients, so concurrent requests reuse keep-alive connections instead of opening new ones
+@functools.lru_cache(maxsize=None)
+def shared_http_client():
+    import httpx
+
+    limits = httpx.Limits(max_connections=config.HTTP_MAX_CONNECTIONS,
+                          max_keepalive_connections=config.HTTP_MAX_CONNECTIONS)
+    return httpx.Client(limits=limits, timeout=httpx.Timeout(config.HTTP_TIMEOUT, connect=10.0))
+
+
+# Function to build the chat model used to answer questions (api_key=None reads OPENAI_API_KEY)
+def make_llm(api_key=None, model="gpt-4", temperature=0.6, max_tokens=500):
+    if config.USE_FAKE_BACKENDS:
+        from fake_backends import FakeStreamingChatModel
+
+        return FakeStreamingChatModel(latency=config.FAKE_LLM_LATENCY, token_latency=config.FAKE_LLM_TOKEN_LATENCY)
+
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(model=model, temperature=temperature, max_tokens=max_tokens, api_key=api_key, streaming=True,
+                      http_client=shared_http_client())
+
+
+# Function to build the embedding stack (persistent cache over the rate-limited OpenAI client)
+def make_embeddings(api_key=None):
+    from embedding_scheduler import build_embeddings
+
+    if config.USE_FAKE_BACKENDS:
+        from fake_backends import HashEmbeddings
+
+        return build_embeddings(HashEmbeddings(latency=config.FAKE_EMBED_LATENCY))
+
+    from langchain_openai import OpenAIEmbeddings
+
+    return build_embeddings(OpenAIEmbeddings(api_key=api_key, http_client=shared_http_client()))
+
+
+# Function to build the text splitter for a chunking configuration, in `unit` (config.CHUNK_UNIT).
+# Token splitters of a store (`path`) leave out the boilerplate recorded next to it.
+def make_text_splitter(chunk_size, chunk_overlap, path=None, unit=config.CHUNK_UNIT):
+    if unit == "tokens":
+        from chunking import BoilerplateIndex, StructuredTokenSplitter
+
+        boilerplate = None
+        if path is not None and config.BOILERPLATE_MIN_PAGES:
+            boilerplate = BoilerplateIndex(os.path.join(path, config.BOILERPLATE_DB_NAME))
+        return StructuredTokenSplitter(chunk_size, chunk_overlap, boilerplate)
+
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
+        separators=["\n\n", "\n", ".", ","],
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+
+
+# Function to open the persistent vector store: Chroma, or the memory-mapped NumPy index
+# when config.VECTOR_BACKEND is "mmap"
+def make_vectorstore(embeddings, path=config.VECTORSTORE_PATH):
+    if config.VECTOR_BACKEND == "mmap":
+        from vector_index import MmapVectorStore
+
+        return MmapVectorStore(persist_directory=path, embedding_function=embeddings)
+
+    from langchain_chroma import Chroma
+
+    return Chroma(persist_directory=path, embedding_function=embeddings)
+
+
+# Function to build the incremental sync engine bound to a store
+def make_index_sync(vectorstore, path=config.VECTORSTORE_PATH):
+    from index_sync import IndexSync
+
+    return IndexSync(vectorstore, os.path.join(path, config.INDEX_MANIFEST_NAME))
+
+
+# Function to build the sharded store (one complete store per shard, see sharding.py)
+def make_sharded_index(embeddings, path=config.VECTORSTORE_PATH):
+    from sharding import ShardedIndex
+
+    return ShardedIndex(path, lambda shard_path: make_index_sync(make_vectorstore(embeddings, shard_path), shard_path),
+                        embeddings)
+
+
+# Function to build the hybrid (BM25 + vector) retriever; it shares the sync engine's BM25 index.
+# With re-ranking enabled it over-fetches candidates and a local re-ranker packs the best into the prompt budget.
+# `sources` restricts retrieval to those source URLs (all sources when empty), and `k` overrides
+# the number of passages returned (RETRIEVAL_K, or RERANK_MAX_PASSAGES when re-ranking).
+# `embeddings` embeds the queries when the store was opened without embeddings of its own.
+def make_retriever(index_sync, sources=(), k=None, embeddings=None):
+    from hybrid_retrieval import HybridRetriever
+
+    sources = tuple(sorted(sources))
+    if not config.RERANK_ENABLED:
+        return HybridRetriever(vectorstore=index_sync.vectorstore, lexical_index=index_sync.lexical_index,
+                               sources=sources, k=k or config.RETRIEVAL_K, embeddings=embeddings)
+
+    from reranking import RerankingRetriever
+
+    return RerankingRetriever(retriever=HybridRetriever(
+        vectorstore=index_sync.vectorstore, lexical_index=index_sync.lexical_index,
+        k=max(config.RERANK_CANDIDATES, k or 0), sources=sources, embeddings=embeddings
+    ), max_passages=k or config.RERANK_MAX_PASSAGES)
+
+
+# Function to build the retrieval chain with source document support, tagged for answer streaming
+def make_chain(llm, retriever):
+    from langchain.chains import RetrievalQAWithSourcesChain
+
+    from streaming import tag_final_answer
+
+    return tag_final_answer(RetrievalQAWithSourcesChain.from_chain_type(
+        llm=llm,
+        chain_type=config.QA_CHAIN_TYPE,
+        retriever=retriever,
+        return_source_documents=True
+    ))
+
+
+# The whole pipeline for one store, built lazily on first use (for scripts and services)
+class Pipeline:
+    def __init__(self, api_key=None, path=config.VECTORSTORE_PATH, chunk_size=config.CHUNK_SIZE,
+                 chunk_overlap=config.CHUNK_OVERLAP):
+        self.api_key = api_key
+        self.path = path
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._scoped_chains = {}
+
+    @functools.cached_property
+    def llm(self):
+        return make_llm(self.api_key)
+
+    @functools.cached_property
+    def embeddings(self):
+        return make_embeddings(self.api_key)
+
+    @functools.cached_property
+    def text_splitter(self):
+        return make_text_splitter(self.chunk_size, self.chunk_overlap, self.path)
+
+    # Split documents lazily into chunks (for IndexSync.sync_document)
+    def split_documents(self, documents):
+        from chunking import iter_split_documents
+
+        return iter_split_documents(documents, self.text_splitter)
+
+    @functools.cached_property
+    def vectorstore(self):
+        return make_vectorstore(self.embeddings, self.path)
+
+    @functools.cached_property
+    def index_sync(self):
+        if config.SHARD_BY != "none":
+            return make_sharded_index(self.embeddings, self.path)
+        return make_index_sync(self.vectorstore, self.path)
+
+    @functools.cached_property
+    def retriever(self):
+        return make_retriever(self.index_sync)
+
+    @functools.cached_property
+    def chain(self):
+        return make_chain(self.llm, self.retriever)
+
+    # One-call refinement of a rated answer over its retrieved passages (see refinement.py)
+    @functools.cached_property
+    def refine_chain(self):
+        from refinement import make_refine_chain
+
+        return make_refine_chain(self.llm)
+
+    # Retrieval chain answering only from the given sources (the full chain when none are given)
+    def chain_for(self, sources=()):
+        sources = tuple(sorted(sources))
+        if not sources:
+            return self.chain
+        if sources not in self._scoped_chains:
+            self._scoped_chains[sources] = make_chain(self.llm, make_retriever(self.index_sync, sources))
+        return self._scoped_chains[sources]
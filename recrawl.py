@@ -0,0 +1,350 @@
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+import config
+from index_sync import content_hash
+from ingestion import FetchError, fetch_url, parse_html, to_document
+from instrumentation import get_tracer
+
+logger = logging.getLogger(__name__)
+
+# Background re-crawl of the indexed pages:
+#   python recrawl.py track URL [URL ...]        # pages are tracked automatically when ingested
+#   python recrawl.py list
+#   python recrawl.py run [--once]               # standalone worker (when no app or server is running)
+#   python recrawl.py demo [--pages 5]           # against a local server whose pages change
+# A registry next to the vector store (RECRAWL_REGISTRY_NAME) remembers every tracked URL with
+# its ETag, Last-Modified, body hash and next check time. The worker wakes every
+# RECRAWL_POLL_SECONDS and re-checks the pages due (each every RECRAWL_INTERVAL_SECONDS) with
+# conditional GETs: a 304 or an identical body skips parsing, an identical parsed page skips
+# embedding (IndexSync), and only changed pages go through the incremental indexing path.
+# The app and the query server run the worker in their own process, so every question is
+# answered from the index it keeps fresh and nobody waits for a re-crawl.
+
+
+# Function to read a response header regardless of its case
+def _header(headers, name):
+    return next((value for key, value in (headers or {}).items() if key.lower() == name.lower()), None)
+
+
+# Persistent registry of tracked URLs and their HTTP validators
+class CrawlRegistry:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, body_hash TEXT,"
+            " next_check REAL, last_checked REAL, last_changed REAL, status INTEGER, error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_next_check ON pages (next_check)")
+        self._conn.commit()
+
+    # Track a URL (or refresh its validators after an ingest), first re-checked `delay` seconds from now
+    def track(self, url, headers=None, delay=config.RECRAWL_INTERVAL_SECONDS):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pages (url, etag, last_modified, next_check, last_checked, last_changed)"
+                " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET etag = excluded.etag,"
+                " last_modified = excluded.last_modified, body_hash = NULL, next_check = excluded.next_check,"
+                " last_checked = excluded.last_checked, error = NULL",
+                (url, _header(headers, "ETag"), _header(headers, "Last-Modified"), now + delay, now, now)
+            )
+            self._conn.commit()
+
+    def untrack(self, url):
+        with self._lock:
+            self._conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+            self._conn.commit()
+
+    # URLs whose next check is due, the most overdue first
+    def due(self, now=None):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url FROM pages WHERE next_check <= ? ORDER BY next_check", (now or time.time(),)
+            ).fetchall()
+        return [url for url, in rows]
+
+    def get(self, url):
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM pages WHERE url = ?", (url,))
+            row = cursor.fetchone()
+            return dict(zip([column[0] for column in cursor.description], row)) if row else None
+
+    def entries(self):
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM pages ORDER BY url")
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    # Store the outcome of a check and schedule the next one
+    def update(self, url, interval, **fields):
+        now = time.time()
+        fields.update(last_checked=now, next_check=now + interval)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE pages SET {assignments} WHERE url = ?", (*fields.values(), url))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Function to open the registry of a vector store directory
+def registry_for(path=config.VECTORSTORE_PATH):
+    os.makedirs(path, exist_ok=True)
+    return CrawlRegistry(os.path.join(path, config.RECRAWL_REGISTRY_NAME))
+
+
+# Outcome of re-checking one URL: "not_modified" (304), "unchanged" (same body or same parsed
+# page), "updated" (re-indexed, see `sync`) or "failed"
+@dataclass
+class CrawlResult:
+    url: str
+    outcome: str = None
+    status: int = None
+    fetch_time: float = 0.0
+    parse_time: float = 0.0
+    sync: object = None
+    error: str = None
+    document: object = None
+    headers: dict = None
+    body_hash: str = None
+
+
+# Re-checks tracked pages on a schedule and re-indexes the ones that changed.
+# Fetching and parsing run on `max_workers` threads; indexing runs on the worker's own thread,
+# one page at a time, through `index_sync.sync_document(document, split, embeddings)`.
+# `embeddings` may be replaced while the worker runs (the app passes the latest session's).
+# With the splitter's `boilerplate` index, pages whose boilerplate changed are fetched again
+# unconditionally and re-indexed even though their content did not change.
+class RecrawlWorker:
+    def __init__(self, index_sync, split, registry, interval=config.RECRAWL_INTERVAL_SECONDS,
+                 poll_seconds=config.RECRAWL_POLL_SECONDS, max_workers=config.FETCH_MAX_WORKERS, embeddings=None,
+                 boilerplate=None):
+        self.index_sync = index_sync
+        self.split = split
+        self.embeddings = embeddings
+        self.boilerplate = boilerplate
+        self.registry = registry
+        self.interval = interval
+        self.poll_seconds = poll_seconds
+        self.max_workers = max_workers
+        self.last_run = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Fetch one tracked page conditionally and parse it if its body changed (thread-safe, no indexing)
+    def check(self, url, force=False):
+        result = CrawlResult(url)
+        entry = {} if force else self.registry.get(url) or {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        tracer = get_tracer()
+        try:
+            response = fetch_url(url, headers=headers)
+        except FetchError as e:
+            result.outcome, result.error = "failed", str(e)
+            tracer.record("fetch", 0.0, error=result.error, url=url)
+            return result
+        result.status, result.fetch_time, result.headers = response.status, response.elapsed, response.headers
+        tracer.record("fetch", response.elapsed, url=url, status=response.status, chars=len(response.text))
+        if response.status == 304:
+            result.outcome = "not_modified"
+            return result
+        result.body_hash = content_hash(response.text)
+        if result.body_hash == entry.get("body_hash"):
+            result.outcome = "unchanged"
+            return result
+        try:
+            elements, result.parse_time = parse_html(response.text)
+        except Exception as e:
+            result.outcome, result.error = "failed", f"Failed to parse {url}: {e}"
+            tracer.record("parse", 0.0, error=result.error, url=url)
+            return result
+        tracer.record("parse", result.parse_time, url=url, elements=len(elements))
+        result.document = to_document(url, elements)
+        return result
+
+    # Re-check the given URLs (default: the ones due) and re-index the changed pages
+    # (plus the pages the boilerplate index marked stale)
+    def run_once(self, urls=None):
+        stale = set(self.boilerplate.stale()) if self.boilerplate is not None else set()
+        urls = list(dict.fromkeys((self.registry.due() if urls is None else list(urls)) + sorted(stale)))
+        results = []
+        if not urls:
+            return results
+        with get_tracer().span("recrawl", urls=len(urls)) as span:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(urls)))) as pool:
+                futures = {pool.submit(self.check, url, url in stale): url for url in urls}
+                for future in as_completed(futures):
+                    results.append(self._apply(future.result(), futures[future] in stale))
+            span.set("updated", sum(1 for result in results if result.outcome == "updated"))
+        self.last_run = time.time()
+        return results
+
+    # Index a checked page if it changed (or is forced) and record the check in the registry
+    def _apply(self, result, force=False):
+        if result.document is not None:
+            try:
+                result.sync = self.index_sync.sync_document(result.document, self.split, self.embeddings, force)
+                result.outcome = "unchanged" if result.sync.skipped else "updated"
+            except Exception as e:
+                logger.exception(f"Re-indexing {result.url} failed")
+                result.outcome, result.error = "failed", f"Failed to index {result.url}: {e}"
+            result.document = None  # not kept once indexed
+        if result.outcome == "failed":
+            self.registry.update(result.url, self.interval, error=result.error)
+            return result
+        fields = {"status": result.status, "error": None}
+        if result.outcome != "not_modified":
+            fields.update(etag=_header(result.headers, "ETag"), last_modified=_header(result.headers, "Last-Modified"),
+                          body_hash=result.body_hash)
+        if result.outcome == "updated":
+            fields["last_changed"] = time.time()
+        self.registry.update(result.url, self.interval, **fields)
+        return result
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                for result in self.run_once():
+                    if result.outcome in ("updated", "failed"):
+                        logger.info(describe_crawl(result))
+            except Exception:
+                logger.exception("Re-crawl failed")
+            self._stop.wait(self.poll_seconds)
+
+    # Run the schedule on a daemon thread
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="recrawl", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+# Function to format the outcome of one re-check for logs
+def describe_crawl(result):
+    if result.outcome == "failed":
+        return f"{result.url}: FAILED ({result.error})"
+    line = f"{result.url}: {result.outcome} (HTTP {result.status}, fetch {result.fetch_time:.2f}s"
+    if result.parse_time:
+        line += f", parse {result.parse_time:.2f}s"
+    if result.sync is not None and not result.sync.skipped:
+        line += f", {result.sync.added} chunks added, {result.sync.deleted} deleted"
+    return line + ")"
+
+
+# Function to start the worker of a pipeline's store (the query server and the CLI)
+def start_worker(pipeline, interval=config.RECRAWL_INTERVAL_SECONDS):
+    return RecrawlWorker(pipeline.index_sync, pipeline.split_documents, registry_for(pipeline.path), interval,
+                         boilerplate=getattr(pipeline.text_splitter, "boilerplate", None)).start()
+
+
+# Function to index a local corpus, revise one page and show what two re-crawls do
+def demo(args):
+    import tempfile
+
+    from fixture_corpus import FixtureServer, product_name, product_price
+    from ingestion import iter_ingest
+    from pipeline import Pipeline
+
+    with FixtureServer(args.pages) as server, tempfile.TemporaryDirectory(prefix="smartsearch-recrawl-") as path:
+        pipeline = Pipeline(path=path)
+        registry = registry_for(path)
+        for result in iter_ingest(server.urls()):
+            if result.ok:
+                pipeline.index_sync.sync_document(result.document, pipeline.split_documents)
+                registry.track(result.url, result.headers)
+        worker = RecrawlWorker(pipeline.index_sync, pipeline.split_documents, registry,
+                               boilerplate=getattr(pipeline.text_splitter, "boilerplate", None))
+        for label in ("nothing changed", "page 0 revised"):
+            if label == "page 0 revised":
+                server.revise(0)
+            print(f"Re-crawl ({label}):")
+            for result in sorted(worker.run_once(server.urls()), key=lambda result: result.url):
+                print(f"  {describe_crawl(result)}")
+        question = f"What is the price of the {product_name(0)}?"
+        answer = pipeline.chain.invoke({"question": question})["answer"].strip()
+        fresh = product_price(0, revision=1) in answer
+        print(f"{question} -> {answer} ({'new' if fresh else 'NOT the new'} price {product_price(0, revision=1)})")
+        print(f"Full downloads: {sum(n for (status, _), n in server.responses.items() if status == 200)}, "
+              f"304 responses: {sum(n for (status, _), n in server.responses.items() if status == 304)}")
+        registry.close()
+        return 0 if fresh else 1
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Re-check indexed pages and re-index the ones that changed")
+    parser.add_argument("--store", default=config.VECTORSTORE_PATH, help="vector store directory")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    track_parser = subcommands.add_parser("track", help="track URLs (first checked after one interval)")
+    track_parser.add_argument("urls", nargs="+")
+    untrack_parser = subcommands.add_parser("untrack", help="stop tracking URLs")
+    untrack_parser.add_argument("urls", nargs="+")
+    subcommands.add_parser("list", help="show the tracked URLs")
+    run_parser = subcommands.add_parser("run", help="run the worker")
+    run_parser.add_argument("--once", action="store_true", help="check every tracked URL once and exit")
+    run_parser.add_argument("--interval", type=float, default=config.RECRAWL_INTERVAL_SECONDS,
+                            help="seconds between checks of a page")
+    demo_parser = subcommands.add_parser("demo", help="re-crawl a local corpus whose pages change")
+    demo_parser.add_argument("--pages", type=int, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "demo":
+        return demo(args)
+    registry = registry_for(args.store)
+    if args.command == "track":
+        for url in args.urls:
+            registry.track(url)
+    elif args.command == "untrack":
+        for url in args.urls:
+            registry.untrack(url)
+    elif args.command == "list":
+        for entry in registry.entries():
+            checked = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_checked"]))
+            print(f"{entry['url']}  checked {checked}  status {entry['status'] or '-'}  {entry['error'] or ''}")
+    else:
+        from pipeline import Pipeline
+
+        pipeline = Pipeline(path=args.store)
+        worker = RecrawlWorker(pipeline.index_sync, pipeline.split_documents, registry, args.interval,
+                               boilerplate=getattr(pipeline.text_splitter, "boilerplate", None))
+        if args.once:
+            for result in worker.run_once([entry["url"] for entry in registry.entries()]):
+                print(describe_crawl(result))
+            return 0
+        worker.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            worker.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
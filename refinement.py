@@ -0,0 +1,52 @@
+# Feedback refinement: when an answer is rated below 4, the apps ask for a better one in a single
+# follow-up LLM call over what the first answer was written from (the original question, the
+# retrieved passages kept in the chain result, and the first answer) plus the user's rating and
+# comment. Nothing is embedded or retrieved again, and the question is still the one the user
+# asked rather than a synthetic "Refine this answer..." query.
+
+REFINE_PROMPT = """You answered a question from the passages below. The user rated the answer {rating}/5 and commented: {comment}
+Write an improved answer that addresses the feedback. Use only the passages; if they do not contain what the user asked for, say so. Do not list the sources.
+
+{passages}
+
+Previous answer: {answer}
+
+Question: {question}"""
+
+NO_COMMENT = "No additional comments provided."
+
+
+# Function to format passages the way the QA chain's prompt does (LangChain documents, or the
+# query server's {"source", "content"} dicts)
+def format_passages(passages):
+    return "\n\n".join(
+        f"Content: {passage['content']}\nSource: {passage['source']}" if isinstance(passage, dict)
+        else f"Content: {passage.page_content}\nSource: {passage.metadata.get('source', 'Unknown')}"
+        for passage in passages
+    )
+
+
+# Function to build the refinement prompt's inputs from a chain result ("answer", "source_documents")
+def refinement_inputs(question, result, rating, comment):
+    return {
+        "question": question,
+        "answer": result["answer"].strip(),
+        "passages": format_passages(result.get("source_documents") or []),
+        "rating": rating,
+        "comment": comment or NO_COMMENT,
+    }
+
+
+# Function to build the refinement chain: prompt -> LLM -> {"answer": ...}, the shape AnswerStream expects
+def make_refine_chain(llm):
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import PromptTemplate
+
+    return PromptTemplate.from_template(REFINE_PROMPT) | llm | StrOutputParser() | (lambda answer: {"answer": answer})
+
+
+# Function to start streaming a refined answer (traced as a "refine" span)
+def refine_stream(refine_chain, question, result, rating, comment):
+    from streaming import AnswerStream
+
+    return AnswerStream(refine_chain, refinement_inputs(question, result, rating, comment), span_name="refine")
@@ -0,0 +1,20 @@
+import os
+import subprocess
+import time
+
+# Helpers shared by the measurement scripts (benchmark.py, evaluation.py, startup_profile.py)
+# that write JSON result files meant to be compared across commits.
+
+
+# Function to read the current commit, so result files say what they measured
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Function to give the fields every result file starts with: the commit measured and when
+def report_header():
+    return {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")}
@@ -0,0 +1,206 @@
+import functools
+import logging
+import math
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any
+
+from langchain_core.callbacks import dispatch_custom_event
+from langchain_core.retrievers import BaseRetriever
+from pydantic import Field
+
+import config
+from instrumentation import get_tracer
+from lexical_index import tokenize
+from tokenization import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Name of the callback event carrying the RerankReport of a query (see AnswerStream.rerank_report)
+RERANK_EVENT = "rerank"
+
+# Shortest shared prefix/suffix (characters) treated as splitter overlap between two chunks
+_MIN_OVERLAP_CHARS = 40
+_SHINGLE_SIZE = 5
+
+
+# Scores passages by how many query terms they contain, weighting rare terms (within the
+# candidate set) higher and saturating repeated terms like BM25. Runs in microseconds on CPU.
+class LexicalOverlapScorer:
+    name = "lexical-overlap"
+
+    def score(self, query, texts):
+        query_terms = set(tokenize(query))
+        term_counts = [Counter(tokenize(text)) for text in texts]
+        document_frequency = Counter(term for counts in term_counts for term in query_terms & counts.keys())
+        scores = []
+        for counts in term_counts:
+            score = 0.0
+            for term in query_terms & counts.keys():
+                idf = math.log(1 + (len(texts) + 1) / (document_frequency[term] + 0.5))
+                score += idf * counts[term] * 2.2 / (counts[term] + 1.2)
+            scores.append(score)
+        return scores
+
+
+# Scores (query, passage) pairs with a local sentence-transformers cross-encoder on the CPU
+class CrossEncoderScorer:
+    def __init__(self, model_name):
+        from sentence_transformers import CrossEncoder
+
+        self.name = model_name
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, query, texts):
+        return [float(score) for score in self.model.predict([(query, text) for text in texts])]
+
+
+# Function to load the configured scorer once; falls back to lexical overlap when no model is
+# configured or sentence-transformers / the model weights are unavailable
+@functools.lru_cache(maxsize=None)
+def get_scorer(model_name=config.RERANK_MODEL):
+    if model_name:
+        try:
+            return CrossEncoderScorer(model_name)
+        except Exception as e:
+            logger.warning(f"Cross-encoder {model_name} unavailable ({e}); re-ranking by lexical overlap")
+    return LexicalOverlapScorer()
+
+
+# Outcome of re-ranking one query: the prompt tokens of the passages the chain used to receive
+# (the first `baseline_k` candidates) against the tokens of the packed passages
+@dataclass
+class RerankReport:
+    candidates: int
+    selected: int
+    dropped_redundant: int
+    baseline_tokens: int
+    packed_tokens: int
+    rerank_time: float
+
+    @property
+    def tokens_saved(self):
+        return self.baseline_tokens - self.packed_tokens
+
+
+# Running totals of RerankReports, shared by every query going through one retriever
+class RerankStats:
+    def __init__(self):
+        self.queries = 0
+        self.baseline_tokens = 0
+        self.packed_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, report):
+        with self._lock:
+            self.queries += 1
+            self.baseline_tokens += report.baseline_tokens
+            self.packed_tokens += report.packed_tokens
+
+    def summary(self):
+        with self._lock:
+            saved = self.baseline_tokens - self.packed_tokens
+            return {
+                "queries": self.queries,
+                "tokens_saved": saved,
+                "tokens_saved_per_query": saved / self.queries if self.queries else 0.0,
+                "reduction": saved / self.baseline_tokens if self.baseline_tokens else 0.0,
+            }
+
+
+# Function to build the set of word n-grams of a text, used to detect near-duplicate passages
+def _shingles(text):
+    words = tokenize(text)
+    return {tuple(words[i:i + _SHINGLE_SIZE]) for i in range(max(len(words) - _SHINGLE_SIZE + 1, 1))}
+
+
+# Function to cut the characters a chunk shares with a neighbouring chunk of the same page
+# (the splitter's chunk_overlap), so the shared text is only sent to the LLM once
+def _trim_overlap(text, neighbour):
+    # The chunk starts with the end of the neighbour
+    position = neighbour.find(text[:_MIN_OVERLAP_CHARS])
+    while position != -1:
+        if text.startswith(neighbour[position:]):
+            return text[len(neighbour) - position:].lstrip()
+        position = neighbour.find(text[:_MIN_OVERLAP_CHARS], position + 1)
+    # The chunk ends with the start of the neighbour
+    position = text.find(neighbour[:_MIN_OVERLAP_CHARS])
+    while position != -1:
+        if neighbour.startswith(text[position:]):
+            return text[:position].rstrip()
+        position = text.find(neighbour[:_MIN_OVERLAP_CHARS], position + 1)
+    return text
+
+
+# Retriever that over-fetches candidates from `retriever`, orders them with a local scorer and
+# ignores those scoring `min_score` or less. It drops passages that mostly repeat an already
+# selected one, trims splitter overlap between neighbouring chunks and packs the best passages
+# into `token_budget` prompt tokens.
+# Every query reports a RerankReport through the "rerank" callback event and the shared stats.
+class RerankingRetriever(BaseRetriever):
+    retriever: Any
+    scorer: Any = Field(default_factory=get_scorer)
+    token_budget: int = config.RERANK_TOKEN_BUDGET
+    max_passages: int = config.RERANK_MAX_PASSAGES
+    redundancy: float = config.RERANK_REDUNDANCY
+    min_score: float = config.RERANK_MIN_SCORE
+    baseline_k: int = config.RETRIEVAL_K
+    stats: Any = Field(default_factory=RerankStats)
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        candidates = self.retriever.invoke(query, config={"callbacks": run_manager.get_child() if run_manager else None})
+        return self.select(query, candidates, run_manager)
+
+    # Re-rank, de-duplicate and pack already retrieved candidates (batch_query.py retrieves them for many queries at once)
+    def select(self, query, candidates, run_manager=None):
+        start = time.perf_counter()
+        scores = self.scorer.score(query, [document.page_content for document in candidates]) if candidates else []
+        ranked = sorted(zip(scores, range(len(candidates))), key=lambda pair: (-pair[0], pair[1]))
+
+        selected = []
+        seen_shingles = set()
+        dropped = 0
+        used_tokens = 0
+        for score, index in ranked:
+            if len(selected) == self.max_passages:
+                break
+            if selected and score <= self.min_score:
+                break  # the rest do not match the query; the best passage is always kept
+            document = candidates[index]
+            shingles = _shingles(document.page_content)
+            if len(shingles & seen_shingles) >= self.redundancy * len(shingles):
+                dropped += 1
+                continue
+            text = document.page_content
+            for other in selected:
+                if other.metadata.get("source") == document.metadata.get("source"):
+                    text = _trim_overlap(text, other.page_content)
+            tokens = count_tokens(text)
+            if selected and used_tokens + tokens > self.token_budget:
+                continue  # a shorter passage further down may still fit
+            seen_shingles |= shingles
+            used_tokens += tokens
+            selected.append(document.model_copy(update={
+                "page_content": text,
+                "metadata": {**document.metadata, "rerank_score": score},
+            }))
+
+        report = RerankReport(
+            candidates=len(candidates),
+            selected=len(selected),
+            dropped_redundant=dropped,
+            baseline_tokens=sum(count_tokens(document.page_content) for document in candidates[:self.baseline_k]),
+            packed_tokens=used_tokens,
+            rerank_time=time.perf_counter() - start,
+        )
+        self.stats.record(report)
+        get_tracer().record(
+            "rerank", report.rerank_time, candidates=report.candidates, selected=report.selected,
+            packed_tokens=report.packed_tokens, tokens_saved=report.tokens_saved
+        )
+        logger.info(f"Re-ranking: {report}")
+        if run_manager:
+            dispatch_custom_event(RERANK_EVENT, report, config={"callbacks": run_manager.get_child()})
+        return selected
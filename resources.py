@@ -0,0 +1,114 @@
+import streamlit as st
+
+import config
+import pipeline
+
+# Long-lived objects shared across Streamlit reruns and sessions.
+# Streamlit re-executes the app script on every interaction; these cached factories build the
+# LLM client, embedding stack, vector store and retrieval chain (see pipeline.py) once per API
+# key and store path. Objects that own a store (vector store, sync engine, re-crawl worker) are
+# built once per path only, so every session writes through the same manifest; sessions pass
+# their own embeddings to them per call. Heavy libraries are only loaded the first time an object is needed, and
+# the apps ask for an object only on the path that uses it (ingest, question), so the first
+# render of a fresh process loads none of them.
+
+
+# Function to get the chat model used to answer questions
+@st.cache_resource(show_spinner=False)
+def get_llm(api_key, model="gpt-4", temperature=0.6, max_tokens=500):
+    return pipeline.make_llm(api_key, model=model, temperature=temperature, max_tokens=max_tokens)
+
+
+# Function to get the embedding stack (persistent cache over the rate-limited OpenAI client)
+@st.cache_resource(show_spinner=False)
+def get_embeddings(api_key):
+    return pipeline.make_embeddings(api_key)
+
+
+# Function to get the text splitter of a store for a chunking configuration
+@st.cache_resource(show_spinner=False)
+def get_text_splitter(chunk_size, chunk_overlap, path=config.VECTORSTORE_PATH):
+    return pipeline.make_text_splitter(chunk_size, chunk_overlap, path)
+
+
+# Function to get the persistent vector store (Chroma, or the memory-mapped index), opened
+# without embeddings: writes carry their vectors and queries are embedded by the retriever
+@st.cache_resource(show_spinner=False)
+def get_vectorstore(path=config.VECTORSTORE_PATH):
+    return pipeline.make_vectorstore(None, path)
+
+
+# Function to get the incremental sync engine bound to the store (or to its shards); pass a
+# session's embeddings to its sync_document
+@st.cache_resource(show_spinner=False)
+def get_index_sync(path=config.VECTORSTORE_PATH):
+    if config.SHARD_BY != "none":
+        return pipeline.make_sharded_index(None, path)
+    return pipeline.make_index_sync(get_vectorstore(path), path)
+
+
+# Function to get the hybrid, re-ranking retriever over the store, optionally scoped to some sources
+@st.cache_resource(show_spinner=False)
+def get_retriever(api_key, path=config.VECTORSTORE_PATH, sources=()):
+    return pipeline.make_retriever(get_index_sync(path), sources, embeddings=get_embeddings(api_key))
+
+
+# Function to get the retrieval chain with source document support, tagged for answer streaming
+@st.cache_resource(show_spinner=False)
+def get_chain(api_key, path=config.VECTORSTORE_PATH, sources=()):
+    return pipeline.make_chain(get_llm(api_key), get_retriever(api_key, path, tuple(sorted(sources))))
+
+
+# Function to get the refinement chain (one LLM call over an answer's retrieved passages)
+@st.cache_resource(show_spinner=False)
+def get_refine_chain(api_key):
+    from refinement import make_refine_chain
+
+    return make_refine_chain(get_llm(api_key))
+
+
+# Function to split documents into chunks for the app's chunking settings (for IndexSync.sync_document)
+def split_documents(documents):
+    from chunking import iter_split_documents
+
+    return iter_split_documents(documents, get_text_splitter(config.CHUNK_SIZE, config.CHUNK_OVERLAP))
+
+
+# Function to get the background re-crawl worker of a store, one per store whatever the API key
+# (see recrawl.py). It re-indexes changed pages through the same sync engine the chain reads
+# from, and is stopped when the store's objects are invalidated.
+@st.cache_resource(show_spinner=False, on_release=lambda worker: worker.stop(timeout=0))
+def get_store_recrawl_worker(path=config.VECTORSTORE_PATH):
+    from recrawl import RecrawlWorker, registry_for
+
+    splitter = get_text_splitter(config.CHUNK_SIZE, config.CHUNK_OVERLAP, path)
+    return RecrawlWorker(get_index_sync(path), split_documents, registry_for(path),
+                         boilerplate=getattr(splitter, "boilerplate", None))
+
+
+# Function to get a store's re-crawl worker, started on first use; changed pages are embedded
+# with the API key of the latest session that asked for it
+def get_recrawl_worker(api_key, path=config.VECTORSTORE_PATH):
+    worker = get_store_recrawl_worker(path)
+    worker.embeddings = get_embeddings(api_key)
+    return worker.start()
+
+
+# Function to drop every cached object bound to a store after it has been rebuilt,
+# so the next rerun reconnects and builds a fresh chain
+def invalidate_store():
+    get_store_recrawl_worker.clear()
+    get_text_splitter.clear()  # its boilerplate index lives in the store directory
+    get_chain.clear()
+    get_retriever.clear()
+    get_index_sync.clear()
+    get_vectorstore.clear()
+    get_answer_cache.clear()  # dropped rather than emptied, so an unused cache is never built
+
+
+# Function to get the answer cache shared by every session of the app
+@st.cache_resource(show_spinner=False)
+def get_answer_cache():
+    from answer_cache import AnswerCache
+
+    return AnswerCache()
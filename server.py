@@ -0,0 +1,337 @@
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+import config
+from answer_cache import AnswerCache
+from batch_qa import answer_question
+from index_sync import indexed_sources, store_version
+from ingestion import iter_ingest, resync_stale
+from instrumentation import get_tracer
+from pipeline import Pipeline
+from recrawl import start_worker
+from refinement import refine_stream
+
+logger = logging.getLogger(__name__)
+
+# Multi-user query server:
+#   python server.py [--host 127.0.0.1] [--port 8765] [--store chroma_vectorstore]
+# One pipeline (vector store, BM25 index, pooled OpenAI clients) and one answer cache are shared
+# by every request. Chains run on a thread pool with at most SERVER_MAX_CONCURRENT_ASKS questions
+# at once; up to SERVER_MAX_QUEUE more wait for a slot in arrival order, and anything beyond
+# that is refused with 503 + Retry-After instead of piling up.
+#
+#   POST /ask     {"question": "...", "stream": false, "sources": []}
+#                                                       -> answer record (see batch_qa.answer_question);
+#                 a non-empty "sources" list answers only from those sources
+#                 with "stream": true the reply is NDJSON: {"event": "sources" | "token" | "done" | "error", ...};
+#                 the "sources" event also carries the retrieved passages ({"source", "content"})
+#   POST /refine  {"question": "...", "answer": "...", "passages": [...], "rating": 2, "comment": "..."}
+#                                                       -> NDJSON events ("token", "done", "error") of a refined
+#                 answer: one LLM call over the given passages, no retrieval (see refinement.py)
+#   POST /ingest  {"urls": [...]}                       -> {"results": [per-URL sync results]}
+#   GET  /sources                                       -> {"sources": [indexed source URLs]}
+#   GET  /health                                        -> load and queue figures, last re-crawl time
+#   GET  /stats                                         -> stage latencies and answer cache hit rates
+
+
+class QueueFull(Exception):
+    pass
+
+
+# Bounded admission: `limit` holders at a time, at most `max_waiting` callers queued behind them
+class AdmissionControl:
+    def __init__(self, limit, max_waiting):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self.active = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __aenter__(self):
+        if self.waiting >= self.max_waiting and self._semaphore.locked():
+            raise QueueFull()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.active -= 1
+        self._semaphore.release()
+
+
+class SmartSearchServer:
+    def __init__(self, pipeline, max_concurrent_asks=config.SERVER_MAX_CONCURRENT_ASKS,
+                 max_queue=config.SERVER_MAX_QUEUE, max_concurrent_ingests=config.SERVER_MAX_CONCURRENT_INGESTS):
+        self.pipeline = pipeline
+        self.answer_cache = AnswerCache()
+        self.max_concurrent_asks = max_concurrent_asks
+        self.max_queue = max_queue
+        self.max_concurrent_ingests = max_concurrent_ingests
+        self.asks = None  # admission controls are bound to the running event loop in on_startup
+        self.ingests = None
+        self.recrawl = None  # background re-crawl of the ingested pages (recrawl.py)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_asks + max_concurrent_ingests,
+                                           thread_name_prefix="smartsearch")
+
+    def build_app(self):
+        app = web.Application()
+        app.add_routes([
+            web.post("/ask", self.ask),
+            web.post("/refine", self.refine),
+            web.post("/ingest", self.ingest),
+            web.get("/sources", self.sources),
+            web.get("/health", self.health),
+            web.get("/stats", self.stats),
+        ])
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+    async def on_startup(self, app):
+        self.asks = AdmissionControl(self.max_concurrent_asks, self.max_queue)
+        self.ingests = AdmissionControl(self.max_concurrent_ingests, self.max_queue)
+        # Build the shared pipeline before the first request instead of inside it
+        await asyncio.get_running_loop().run_in_executor(self.executor, lambda: self.pipeline.chain)
+        if config.RECRAWL_INTERVAL_SECONDS:
+            self.recrawl = start_worker(self.pipeline)
+
+    async def on_cleanup(self, app):
+        if self.recrawl is not None:
+            self.recrawl.stop(timeout=5)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    # Function to run blocking pipeline work on the server's thread pool
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(fn, *args))
+
+    # Cached record for a question, or None; the lookup may embed the question, so it runs off the loop
+    def _cached_record(self, question, version, sources):
+        result, hit = self.answer_cache.lookup(question, version, embed=self.pipeline.embeddings.embed_query,
+                                               sources=sources)
+        if result is None:
+            return None
+        return {**result, "question": question, "cache": hit}
+
+    # Cache a copy of a finished record; a failed cache write is logged and the answer still returned
+    def _remember(self, question, version, sources, record):
+        if record.get("error"):
+            return
+        try:
+            self.answer_cache.put(question, version, dict(record),
+                                  embedding=self.pipeline.embeddings.embed_query(question), sources=sources)
+        except Exception:
+            logger.exception(f"Could not cache the answer to {question!r}")
+
+    # Answer a question with the chain for `sources` and cache the record with its retrieved
+    # passages, so a later streamed hit can offer them for refinement whichever path filled the cache
+    def _answer(self, question, version, sources, item_id, on_passages=None, on_token=None):
+        passages = []
+
+        def on_sources(documents):
+            passages.extend({"source": doc.metadata.get("source", ""), "content": doc.page_content} for doc in documents)
+            if on_passages is not None:
+                on_passages(passages)
+
+        record = answer_question(self.pipeline.chain_for(sources), item_id, question, on_sources=on_sources,
+                                 on_token=on_token)
+        self._remember(question, version, sources, {**record, "passages": passages})
+        return record
+
+    async def ask(self, request):
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text="Request body must be JSON")
+        question = str(body.get("question", "")).strip()
+        if not question:
+            raise web.HTTPBadRequest(text="Missing 'question'")
+        item_id = str(body.get("id") or uuid.uuid4().hex)
+        sources = tuple(sorted(str(source) for source in body.get("sources") or []))
+
+        try:
+            async with self.asks:
+                version = store_version(self.pipeline.path)
+                if body.get("stream"):
+                    return await self._ask_streaming(request, item_id, question, version, sources)
+                record = await self._run(self._cached_record, question, version, sources)
+                if record is None:
+                    record = await self._run(self._answer, question, version, sources, item_id)
+                # A fresh dict: passages are cached for refinement, not part of the answer record
+                record = {key: value for key, value in record.items() if key != "passages"}
+                return web.json_response({**record, "id": item_id})
+        except QueueFull:
+            raise web.HTTPServiceUnavailable(text="Server busy, retry shortly", headers={"Retry-After": "1"})
+
+    # Stream the answer as NDJSON events while the chain runs on the thread pool. The retrieved
+    # passages go out with the "sources" event (and into the answer cache) so a client can refine
+    # the answer later without another retrieval.
+    async def _ask_streaming(self, request, item_id, question, version, sources):
+        def work(emit):
+            record = self._cached_record(question, version, sources)
+            if record is not None:
+                emit({"event": "sources", "sources": record.get("retrieved", []), "passages": record.get("passages", [])})
+                emit({"event": "token", "text": record.get("answer", "")})
+                record = {key: value for key, value in record.items() if key != "passages"}
+            else:
+                record = self._answer(
+                    question, version, sources, item_id,
+                    on_passages=lambda passages: emit({
+                        "event": "sources", "sources": list(dict.fromkeys(passage["source"] for passage in passages)),
+                        "passages": passages,
+                    }),
+                    on_token=lambda text: emit({"event": "token", "text": text}),
+                )
+            record = {**record, "id": item_id}
+            emit({"event": "error", "error": record["error"]} if record.get("error") else {"event": "done", "record": record})
+
+        return await self._stream_events(request, work)
+
+    # Run `work(emit)` on the thread pool, writing every event it emits as an NDJSON line until it
+    # returns. An exception escaping `work` becomes an "error" event, so the stream always ends.
+    async def _stream_events(self, request, work):
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def emit(event):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        def run():
+            try:
+                work(emit)
+            except Exception as e:
+                logger.exception("Streaming request failed")
+                emit({"event": "error", "error": f"{type(e).__name__}: {e}"})
+            finally:
+                emit(None)  # end of stream
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        task = loop.run_in_executor(self.executor, run)
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            await response.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+        await task
+        await response.write_eof()
+        return response
+
+    async def refine(self, request):
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text="Request body must be JSON")
+        question = str(body.get("question", "")).strip()
+        answer = str(body.get("answer", "")).strip()
+        if not question or not answer:
+            raise web.HTTPBadRequest(text="Missing 'question' or 'answer'")
+        result = {"answer": answer, "source_documents": [
+            {"source": str(passage.get("source", "")), "content": str(passage.get("content", ""))}
+            for passage in body.get("passages") or []
+        ]}
+
+        def work(emit):
+            stream = refine_stream(self.pipeline.refine_chain, question, result, body.get("rating"), body.get("comment"))
+            try:
+                for text in stream:
+                    emit({"event": "token", "text": text})
+            except Exception as e:
+                emit({"event": "error", "error": f"{type(e).__name__}: {e}"})
+                return
+            emit({"event": "done", "record": {
+                "question": question, "answer": stream.result["answer"].strip(), "sources": [],
+                "timings": {"first_token": stream.time_to_first_token, "total": stream.total_time},
+            }})
+
+        try:
+            async with self.asks:
+                return await self._stream_events(request, work)
+        except QueueFull:
+            raise web.HTTPServiceUnavailable(text="Server busy, retry shortly", headers={"Retry-After": "1"})
+
+    def _ingest(self, urls):
+        results = []
+        with get_tracer().span("ingest", urls=len(urls)):
+            for ingested in iter_ingest(urls):
+                entry = {"url": ingested.url, "ok": ingested.ok, "error": ingested.error,
+                         "fetch_time": ingested.fetch_time, "parse_time": ingested.parse_time}
+                if ingested.ok:
+                    if self.recrawl is not None:
+                        self.recrawl.registry.track(ingested.url, ingested.headers)
+                    sync_result = self.pipeline.index_sync.sync_document(
+                        ingested.document, self.pipeline.split_documents
+                    )
+                    entry.update(asdict(sync_result))
+                results.append(entry)
+            # Pages indexed earlier whose boilerplate changed with this batch
+            boilerplate = getattr(self.pipeline.text_splitter, "boilerplate", None)
+            for ingested, sync_result in resync_stale(self.pipeline.index_sync, self.pipeline.split_documents, boilerplate):
+                if sync_result is None:
+                    logger.error(f"Could not re-index {ingested.url}: {ingested.error}")
+        return results
+
+    async def ingest(self, request):
+        try:
+            body = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(text="Request body must be JSON")
+        urls = [str(url).strip() for url in body.get("urls", []) if str(url).strip()]
+        if not urls:
+            raise web.HTTPBadRequest(text="Missing 'urls'")
+        try:
+            async with self.ingests:
+                return web.json_response({"results": await self._run(self._ingest, urls)})
+        except QueueFull:
+            raise web.HTTPServiceUnavailable(text="Ingest queue full, retry shortly", headers={"Retry-After": "5"})
+
+    async def sources(self, request):
+        return web.json_response({"sources": indexed_sources(self.pipeline.path)})
+
+    async def health(self, request):
+        return web.json_response({
+            "status": "ok",
+            "store_version": store_version(self.pipeline.path),
+            "asks_active": self.asks.active,
+            "asks_waiting": self.asks.waiting,
+            "ingests_active": self.ingests.active,
+            "ingests_waiting": self.ingests.waiting,
+            "recrawl_last_run": self.recrawl.last_run if self.recrawl is not None else None,
+        })
+
+    async def stats(self, request):
+        return web.json_response({
+            "stages": get_tracer().stage_stats(),
+            "answer_cache": self.answer_cache.stats(),
+        })
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Smart Search Bot query server")
+    parser.add_argument("--host", default=config.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=config.SERVER_PORT)
+    parser.add_argument("--store", default=config.VECTORSTORE_PATH, help="vector store directory")
+    parser.add_argument("--chunk-size", type=int, default=config.CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=config.CHUNK_OVERLAP)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    pipeline = Pipeline(path=args.store, chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    web.run_app(SmartSearchServer(pipeline).build_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
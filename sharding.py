@@ -0,0 +1,189 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import config
+from index_sync import SyncResult, content_hash
+from instrumentation import get_tracer
+
+# Partitioned store: instead of one collection holding every chunk, each shard is a complete
+# store of its own (Chroma collection, manifest and BM25 index) under <store>/shards/<key>,
+# so a shard can be rebuilt or dropped without touching the others. Every source lives in
+# exactly one shard. Searches fan out to the shards in parallel and the hits are merged into
+# one global top-k; a search scoped to some sources only visits the shards holding them.
+# A single store written before sharding was enabled is kept as a read-only "legacy" shard
+# until its sources are re-ingested into their own shards.
+
+LEGACY_SHARD = ""
+_UNSAFE_KEY_CHARS = re.compile(r"[^a-z0-9.-]+")
+
+
+# Function to compute the shard a source belongs to under a partitioning strategy:
+# "domain" (host of the URL), "date" (ingest date, SHARD_DATE_FORMAT) or "hash" (SHARD_COUNT buckets)
+def shard_key(source, strategy=config.SHARD_BY, shard_count=config.SHARD_COUNT, now=None):
+    if strategy == "domain":
+        host = (urlsplit(source).hostname or "local").lower()
+        return _UNSAFE_KEY_CHARS.sub("_", host.removeprefix("www."))
+    if strategy == "date":
+        return time.strftime(config.SHARD_DATE_FORMAT, time.localtime(now))
+    if strategy == "hash":
+        return f"h{int(content_hash(source)[:8], 16) % shard_count:03d}"
+    raise ValueError(f"Unknown shard strategy: {strategy}")
+
+
+# Function to build the Chroma filter restricting a search to some sources (None for all)
+def source_filter(sources):
+    return {"source": {"$in": list(sources)}} if sources else None
+
+
+# The shards of one store, opened lazily. `open_shard(path)` builds the IndexSync of a shard
+# directory (see pipeline.make_sharded_index); all shards share the same `embeddings`.
+# Exposes the IndexSync interface used by the ingest paths, plus fan-out `vectorstore` and
+# `lexical_index` views for the retrievers.
+class ShardedIndex:
+    def __init__(self, path, open_shard, embeddings, strategy=config.SHARD_BY, max_workers=config.SHARD_SEARCH_WORKERS):
+        self.path = path
+        self.open_shard = open_shard
+        self.embeddings = embeddings
+        self.strategy = strategy
+        self.shards_path = os.path.join(path, config.SHARDS_DIR_NAME)
+        self._shards = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-search")
+        if os.path.exists(os.path.join(path, config.INDEX_MANIFEST_NAME)):
+            self._shards[LEGACY_SHARD] = open_shard(path)
+        if os.path.isdir(self.shards_path):
+            for key in sorted(os.listdir(self.shards_path)):
+                self._shards[key] = open_shard(os.path.join(self.shards_path, key))
+        self.vectorstore = ShardedVectorStore(self)
+        self.lexical_index = ShardedLexicalIndex(self)
+
+    @property
+    def version(self):
+        return sum(shard.version for shard in self.shards().values())
+
+    def shards(self):
+        with self._lock:
+            return dict(self._shards)
+
+    # The shard with the given key, created on first use
+    def shard(self, key):
+        with self._lock:
+            if key not in self._shards:
+                self._shards[key] = self.open_shard(os.path.join(self.shards_path, key))
+            return self._shards[key]
+
+    # Map of every indexed source to the key of the shard holding it
+    def sources(self):
+        return {source: key for key, shard in self.shards().items() for source in shard.sources()}
+
+    # Shards worth searching for a scope of sources (every shard when unscoped)
+    def shards_for(self, sources=None):
+        shards = self.shards()
+        if not sources:
+            return shards
+        located = self.sources()
+        keys = {located[source] for source in sources if source in located}
+        return {key: shard for key, shard in shards.items() if key in keys}
+
+    # Run `search(shard)` on several shards in parallel, recording the fan-out on the current span
+    def fan_out(self, search, shards):
+        span = get_tracer().current_span()
+        if span is not None:
+            span.set("shards", len(shards))
+        return list(self._pool.map(search, shards.values()))
+
+    def page_unchanged(self, source, page_content):
+        key = self.sources().get(source)
+        return key is not None and self.shards()[key].page_unchanged(source, page_content)
+
+    # Sync a document into its shard and drop copies of the source left in other shards (the legacy
+    # store, or another hash bucket). Date shards keep a source in the shard of its first ingest.
+    def sync_document(self, document, split, embeddings=None, force=False):
+        source = document.metadata["source"]
+        current = self.sources().get(source)
+        if self.strategy == "date" and current not in (None, LEGACY_SHARD):
+            key = current
+        else:
+            key = shard_key(source, self.strategy)
+        result = self.shard(key).sync_document(document, split, embeddings, force)
+        if current is not None and current != key:
+            self.shards()[current].remove_source(source)
+        return result
+
+    def remove_source(self, source):
+        key = self.sources().get(source)
+        return self.shards()[key].remove_source(source) if key is not None else SyncResult(source)
+
+
+# Read-only view searching every relevant shard's Chroma collection in parallel. The query is
+# embedded once, and hits are merged by distance, which is comparable across shards because
+# they share one embedding model.
+class ShardedVectorStore:
+    def __init__(self, index):
+        self.index = index
+
+    @property
+    def embeddings(self):
+        return self.index.embeddings
+
+    def similarity_search(self, query, k=config.RETRIEVAL_K, filter=None):
+        sources = (filter or {}).get("source", {}).get("$in")
+        shards = self.index.shards_for(sources)
+        if not shards:
+            return []
+        vector = self.embeddings.embed_query(query)
+        hits = [
+            hit
+            for shard_hits in self.index.fan_out(
+                lambda shard: shard.vectorstore.similarity_search_by_vector_with_relevance_scores(vector, k=k, filter=filter),
+                shards,
+            )
+            for hit in shard_hits
+        ]
+        return [document for document, _ in sorted(hits, key=lambda hit: hit[1])[:k]]
+
+    # Search many query vectors at once in every relevant shard, merging each query's hits by distance
+    def batch_similarity_search(self, vectors, k=config.RETRIEVAL_K, filter=None):
+        from batch_query import batch_similarity_search
+
+        shards = self.index.shards_for((filter or {}).get("source", {}).get("$in"))
+        if not shards:
+            return [[] for _ in vectors]
+        per_shard = self.index.fan_out(lambda shard: batch_similarity_search(shard.vectorstore, vectors, k, filter), shards)
+        return [
+            sorted((hit for shard_hits in per_shard for hit in shard_hits[i]), key=lambda hit: hit[1])[:k]
+            for i in range(len(vectors))
+        ]
+
+    # Stored records for chunk IDs, collected from every shard
+    def get(self, ids, include=()):
+        stored = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+        results = self.index.fan_out(lambda shard: shard.vectorstore.get(ids=ids, include=list(include)), self.index.shards())
+        for result in results:
+            stored["ids"].extend(result["ids"])
+            for field in include:
+                stored[field].extend(result[field])
+        return stored
+
+
+# Read-only view merging the BM25 hits of the relevant shards by score. Term statistics are
+# per shard, so scores are only approximately comparable across shards of very different size.
+class ShardedLexicalIndex:
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return sum(len(shard.lexical_index) for shard in self.index.shards().values())
+
+    def search(self, query, k=config.RETRIEVAL_K, sources=None):
+        shards = self.index.shards_for(sources)
+        hits = [
+            hit
+            for shard_hits in self.index.fan_out(lambda shard: shard.lexical_index.search(query, k, sources), shards)
+            for hit in shard_hits
+        ]
+        return sorted(hits, key=lambda hit: -hit[3])[:k]
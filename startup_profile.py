@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from reporting import report_header
+
+# Cold-start profile of the Streamlit apps: how long a fresh process takes to render the first
+# page, and which imports that time goes to.
+#   python startup_profile.py                                   # app.py, 5 cold starts
+#   python startup_profile.py --script test.py --runs 10 --output startup_results.json
+#   python startup_profile.py --compare startup_results.json
+# Every run is a new interpreter that renders the script once with Streamlit's AppTest, with an
+# API key entered and nothing ingested or asked, which is what a newly scaled-out container
+# does for its first visitor. One extra run under `python -X importtime` gives the per-package
+# import report. HEAVY_MODULES lists libraries that should only load on the paths that use
+# them; any of them loaded by the first render is reported.
+
+HEAVY_MODULES = [
+    "pandas", "matplotlib", "numpy", "langchain", "langchain_openai", "langchain_chroma", "chromadb",
+    "langsmith", "unstructured", "tiktoken", "openai",
+]
+
+
+# Function to render a script once in this process and return the measurements (worker side)
+def first_render(script, timeout):
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(script, default_timeout=timeout)
+    app.session_state["user_api_key"] = os.environ.get("OPENAI_API_KEY", "sk-startup-profile")
+    app.run()
+    return {
+        "seconds": time.perf_counter() - start,
+        "exceptions": [str(exception.value) for exception in app.exception],
+        "heavy_modules": sorted(name for name in HEAVY_MODULES if name in sys.modules),
+        "modules": len(sys.modules),
+    }
+
+
+# Function to run one cold start in a fresh interpreter; returns (measurements, stderr). A render
+# that raised is not a startup time (it usually stopped early), so it fails the profile.
+def run_cold_start(args, importtime=False):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + [
+        os.path.abspath(__file__), "--worker", "--script", args.script, "--timeout", str(args.timeout),
+    ]
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY") or "sk-startup-profile"}
+    start = time.perf_counter()
+    completed = subprocess.run(command, env=env, capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"Cold start of {args.script} failed:\n{completed.stderr[-4000:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    if result["exceptions"]:
+        raise RuntimeError(f"First render of {args.script} raised: {'; '.join(result['exceptions'])}")
+    result["process_seconds"] = wall  # including interpreter start-up
+    return result, completed.stderr
+
+
+# Function to total `-X importtime` output per top-level package: cumulative milliseconds of
+# the imports nobody else triggered, so each library is counted once, under its own name
+def import_profile(stderr):
+    totals = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("  "):  # nested import, already inside its importer's cumulative time
+            continue
+        totals[name.strip().split(".")[0]] += int(cumulative) / 1000
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+# Function to print this run's headline numbers next to a previous report
+def compare(report, baseline):
+    for metric in ("median_seconds", "median_process_seconds"):
+        old_value, new_value = baseline[metric], report[metric]
+        change = (new_value - old_value) / old_value if old_value else 0.0
+        flag = "" if abs(change) < 0.05 else (" better" if change < 0 else " WORSE")
+        print(f"  {metric:<24} {old_value:8.3f} -> {new_value:8.3f} ({change:+.1%}){flag}")
+    loaded = set(report["heavy_modules"]) - set(baseline["heavy_modules"])
+    if loaded:
+        print(f"  newly loaded at startup: {', '.join(sorted(loaded))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start of the Streamlit app")
+    parser.add_argument("--script", default="app.py", help="Streamlit script to render")
+    parser.add_argument("--runs", type=int, default=5, help="cold starts to time")
+    parser.add_argument("--top", type=int, default=15, help="packages shown in the import report")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds allowed for the first render")
+    parser.add_argument("--output", help="JSON file the results are written to")
+    parser.add_argument("--compare", help="previous result file to compare against")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(first_render(args.script, args.timeout)))
+        return
+
+    baseline = None
+    if args.compare:  # read first: it may be the file about to be overwritten
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    _, stderr = run_cold_start(args, importtime=True)
+    imports = import_profile(stderr)
+    print(f"Import time by package, first render of {args.script} (ms):")
+    for package, milliseconds in list(imports.items())[:args.top]:
+        print(f"  {package:<28} {milliseconds:9.1f}")
+
+    runs = [run_cold_start(args)[0] for _ in range(args.runs)]
+    report = {
+        **report_header(),
+        "script": args.script,
+        "median_seconds": statistics.median(run["seconds"] for run in runs),
+        "median_process_seconds": statistics.median(run["process_seconds"] for run in runs),
+        "runs": [{key: run[key] for key in ("seconds", "process_seconds", "modules")} for run in runs],
+        "heavy_modules": runs[-1]["heavy_modules"],
+        "imports_ms": imports,
+    }
+    print(f"First render: median {report['median_seconds']:.2f}s in-process, "
+          f"{report['median_process_seconds']:.2f}s including interpreter start ({args.runs} cold starts)")
+    print(f"Heavy modules loaded: {', '.join(report['heavy_modules']) or 'none'}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if baseline is not None:
+        compare(report, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import contextvars
+import queue
+import re
+import threading
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from instrumentation import get_tracer
+from reranking import RERANK_EVENT
+from tokenization import count_tokens
+
+# RetrievalQAWithSourcesChain splits the completion on this marker into "answer" and "sources"
+SOURCES_MARKER = re.compile(r"SOURCES?:", re.IGNORECASE)
+_MARKER_LENGTH = len("SOURCES:")
+_DONE = object()
+
+# Tag marking the LLM chain that writes the user-facing answer
+FINAL_ANSWER_TAG = "final_answer"
+
+
+# LangChain callback handler turning every LLM call into a "generate" span with prompt and
+# completion token counts and the time to the first streamed token
+class TracingCallbackHandler(BaseCallbackHandler):
+    def __init__(self, tracer=None):
+        self.tracer = tracer or get_tracer()
+        self.runs = {}
+
+    def _start(self, run_id, prompt_text):
+        self.runs[run_id] = self.tracer.start_span("generate", prompt_tokens=count_tokens(prompt_text))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "\n".join(prompts))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "\n".join(str(message.content) for batch in messages for message in batch))
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        span = self.runs.get(run_id)
+        if span is not None and "first_token" not in span.attributes:
+            span.set("first_token", time.perf_counter() - span._start)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span = self.runs.pop(run_id, None)
+        if span is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage.get("prompt_tokens"):
+            span.set("prompt_tokens", usage["prompt_tokens"])
+        text = "".join(generation.text for generations in response.generations for generation in generations)
+        span.set("completion_tokens", usage.get("completion_tokens") or count_tokens(text))
+        self.tracer.end_span(span)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        span = self.runs.pop(run_id, None)
+        if span is not None:
+            self.tracer.end_span(span, error=error)
+
+
+# Function to tag the LLM chain that writes the final answer of a RetrievalQAWithSourcesChain.
+# from_llm builds a map_reduce chain whose map step also calls the LLM once per retrieved chunk;
+# only the tokens of the final (combine) call should be shown to the user.
+def tag_final_answer(chain):
+    combine_chain = chain.combine_documents_chain
+    reduce_chain = getattr(combine_chain, "reduce_documents_chain", None)
+    if reduce_chain is not None:
+        combine_chain = reduce_chain.combine_documents_chain
+    llm_chain = combine_chain.llm_chain
+    llm_chain.tags = [*(llm_chain.tags or []), FINAL_ANSWER_TAG]
+    return chain
+
+
+# Forwards streamed tokens and retrieved documents from the chain's worker thread to the stream
+class _StreamCallbackHandler(BaseCallbackHandler):
+    def __init__(self, events, final_answer_only):
+        self.events = events
+        self.final_answer_only = final_answer_only
+        self.answer_runs = set()
+        self.retriever_runs = set()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, tags=None, **kwargs):
+        if tags and FINAL_ANSWER_TAG in tags:
+            self.answer_runs.add(run_id)
+
+    def on_llm_new_token(self, token, *, parent_run_id=None, **kwargs):
+        if not self.final_answer_only or parent_run_id in self.answer_runs:
+            self.events.put(("token", token))
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self.retriever_runs.add(run_id)
+
+    # Only the outermost retriever's documents reach the prompt (a re-ranker wraps the hybrid retriever)
+    def on_retriever_end(self, documents, *, parent_run_id=None, **kwargs):
+        if parent_run_id not in self.retriever_runs:
+            self.events.put(("sources", documents))
+
+    def on_custom_event(self, name, data, **kwargs):
+        if name == RERANK_EVENT:
+            self.events.put(("rerank", data))
+
+
+# Runs a chain (or any runnable taking `config={"callbacks": ...}`) on a background thread and
+# yields the answer text token by token as the LLM produces it. The trailing "SOURCES: ..."
+# part of the completion is not yielded; the parsed `result` is available once iteration ends.
+# `on_sources(documents)` is called on the iterating thread as soon as retrieval finishes.
+# With `final_answer_only`, only tokens from the chain tagged by tag_final_answer() are yielded.
+# When the retriever re-ranks, its RerankReport (prompt tokens saved) is kept in `rerank_report`.
+# The LLM must stream (ChatOpenAI(streaming=True) or the fake chat model) for tokens to arrive
+# incrementally; otherwise the whole answer is yielded at once when generation ends.
+# The run is traced as a `span_name` ("query") span, a child of the caller's current span.
+class AnswerStream:
+    def __init__(self, runnable, inputs, on_sources=None, final_answer_only=False, span_name="query"):
+        self.on_sources = on_sources
+        self.span_name = span_name
+        self.final_answer_only = final_answer_only
+        self.result = None
+        self.error = None
+        self.source_documents = []
+        self.rerank_report = None
+        self.time_to_first_token = None
+        self.retrieval_time = None
+        self.total_time = None
+        self._events = queue.Queue()
+        self._start = time.perf_counter()
+        context = contextvars.copy_context()  # carries the caller's tracing span into the worker thread
+        self._thread = threading.Thread(target=context.run, args=(self._run, runnable, inputs), daemon=True)
+        self._thread.start()
+
+    def _run(self, runnable, inputs):
+        callbacks = [_StreamCallbackHandler(self._events, self.final_answer_only), TracingCallbackHandler()]
+        try:
+            with get_tracer().span(self.span_name):
+                self.result = runnable.invoke(inputs, config={"callbacks": callbacks})
+        except Exception as e:
+            self.error = e
+        finally:
+            self._events.put((_DONE, None))
+
+    def _mark_first_token(self):
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self._start
+
+    def __iter__(self):
+        pending = ""
+        streamed = False
+        marker_seen = False
+        while True:
+            kind, payload = self._events.get()
+            if kind is _DONE:
+                break
+            if kind == "sources":
+                self.retrieval_time = time.perf_counter() - self._start
+                self.source_documents = payload
+                if self.on_sources:
+                    self.on_sources(payload)
+                continue
+            if kind == "rerank":
+                self.rerank_report = payload
+                continue
+
+            streamed = True
+            if marker_seen:
+                continue
+            pending += payload
+            match = SOURCES_MARKER.search(pending)
+            if match:
+                marker_seen = True
+                pending = pending[:match.start()].rstrip()
+                if pending:
+                    self._mark_first_token()
+                    yield pending
+                pending = ""
+            elif len(pending) > _MARKER_LENGTH:
+                # Hold back a few characters in case they are the start of the marker
+                visible, pending = pending[:-_MARKER_LENGTH], pending[-_MARKER_LENGTH:]
+                self._mark_first_token()
+                yield visible
+
+        self.total_time = time.perf_counter() - self._start
+        if self.error is not None:
+            raise self.error
+        if not streamed:
+            # The LLM did not stream: emit the parsed answer in one piece
+            pending = self.result.get("answer", "")
+        if pending.strip():
+            self._mark_first_token()
+            yield pending
+        if self.time_to_first_token is None:
+            self.time_to_first_token = self.total_time
+
+    # Consume the stream without rendering it, returning the final result
+    def wait(self):
+        for _ in self:
+            pass
+        return self.result
@@ -1,16 +1,25 @@
 import os
 import streamlit as st
 import time
-import hashlib
-from langchain.chains import RetrievalQAWithSourcesChain
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import UnstructuredURLLoader
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
-from langchain_openai import ChatOpenAI
+import uuid
 from dotenv import load_dotenv
-import pandas as pd
-import matplotlib.pyplot as plt
+import config
+from metrics_store import get_metrics_store
+from resources import (
+    get_chain, get_embeddings, get_index_sync, get_recrawl_worker, get_refine_chain, get_text_splitter,
+    invalidate_store
+)
+
+# Ingestion, the chain and the charting libraries are imported on first use, and feedback and
+# response times go to the durable metrics store (see app.py)
+
+
+# Function to load the charting library, the first time there is something to plot
+def plotting():
+    import matplotlib.pyplot as plt
+
+    return plt
+
 
 # Load environment variables (e.g., OpenAI API key)
 load_dotenv()
@@ -31,12 +40,11 @@ if "last_query" not in st.session_state:
     st.session_state.last_query = ""
 if "rating" not in st.session_state:
     st.session_state.rating = 3  # Default slider value
-if "feedback_history" not in st.session_state:
-    st.session_state.feedback_history = []  # To track ratings over time
-if "query_times" not in st.session_state:
-    st.session_state.query_times = []  # To track query response times
-if "url_content_hashes" not in st.session_state:
-    st.session_state.url_content_hashes = {}  # To store URL and content hash
+if "answered" not in st.session_state:
+    st.session_state.answered = {"question": None}  # The last question answered and its timing
+if "metrics_session" not in st.session_state:
+    st.session_state.metrics_session = uuid.uuid4().hex  # Tags this session's feedback and timings
+metrics_store = get_metrics_store()
 
 # Optional debugging checkbox
 debug_mode = st.sidebar.checkbox("Enable Debugging")
@@ -49,88 +57,82 @@ for i in range(3):
 
 # Button to initiate processing
 process_url_clicked = st.sidebar.button("Process URLs")
-vectorstore_path = "chroma_vectorstore"
+vectorstore_path = config.VECTORSTORE_PATH
 main_placeholder = st.empty()
 
-# Initialize the language model (ChatGPT-4)
-llm = ChatOpenAI(model="gpt-4", temperature=0.6, max_tokens=500)
+api_key = os.getenv("OPENAI_API_KEY")
 
-# Function to compute hash of content
-def compute_hash(content):
-    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+# A store deleted from disk must not be served from cached connections
+if not os.path.exists(vectorstore_path):
+    invalidate_store()
 
-# Function to load data from URLs
+# Function to load data from URLs, yielding each document (with 'source' metadata) as soon as it is ready.
+# Loaded pages are tracked by the background re-crawl worker (recrawl.py), which re-checks them
+# with conditional GETs and re-indexes only the ones that changed.
 def load_data(urls):
-    loader = UnstructuredURLLoader(urls=urls)
-    main_placeholder.text("Data Loading... Started...")
-    data = loader.load()
-    # Add 'source' metadata to each document
-    for doc, url in zip(data, urls):
-        doc.metadata['source'] = url
-    if debug_mode:
-        st.write(f"Loaded data with metadata: {data}")  # For debugging purposes
-    return data
+    from ingestion import describe_result, iter_ingest
 
-# Function to split text into chunks
+    worker = get_recrawl_worker(api_key, vectorstore_path) if config.RECRAWL_INTERVAL_SECONDS else None
+    main_placeholder.text("Data Loading... Started...")
+    for result in iter_ingest(urls):
+        main_placeholder.text(f"Data Loading... {describe_result(result)}")
+        if debug_mode:
+            st.write(describe_result(result))  # Per-URL fetch and parse timings
+        if result.ok:
+            if worker is not None:
+                worker.registry.track(result.url, result.headers)
+            if debug_mode:
+                st.write(f"Loaded data with metadata: {result.document}")  # For debugging purposes
+            yield result.document
+
+# Function to split text into chunks, yielded one at a time as the embedding stage asks for them
 def split_data(data):
-    text_splitter = RecursiveCharacterTextSplitter(
-        separators=["\n\n", "\n", ".", ","],
-        chunk_size=1500,
-        chunk_overlap=200,
-    )
+    from chunking import iter_split_documents
+
+    text_splitter = get_text_splitter(config.CHUNK_SIZE, config.CHUNK_OVERLAP)
     main_placeholder.text("Splitting Text... Started...")
-    docs = []
-    for doc in data:
-        chunks = text_splitter.split_documents([doc])
-        for chunk in chunks:
-            chunk.metadata["source"] = doc.metadata["source"]  # Propagate source metadata
-        docs.extend(chunks)
+    for chunk in iter_split_documents(data, text_splitter):  # Chunks carry their document's source metadata
+        if debug_mode:
+            st.write(f"Document preview: {chunk.page_content[:100]}...")
+            st.write(f"Metadata: {chunk.metadata}")
+        yield chunk
+
+# Function to create embeddings and store them in the vector store.
+# Chunks get deterministic IDs, so only new chunks are embedded and stale ones are deleted;
+# page hashes live in the store's manifest and survive restarts.
+def create_embeddings(doc, index_sync):
+    result = index_sync.sync_document(doc, split_data, get_embeddings(api_key))
     if debug_mode:
-        for doc in docs:
-            st.write(f"Document preview: {doc.page_content[:100]}...")
-            st.write(f"Metadata: {doc.metadata}")
-    return docs
-
-# Function to create embeddings and store them in Chroma
-def create_embeddings(docs):
-    embeddings = OpenAIEmbeddings()
-    vectorstore = Chroma(
-        persist_directory=vectorstore_path,  # Ensure persistence is enabled
-        embedding_function=embeddings
-    )
-    vectorstore.add_texts(
-        texts=[doc.page_content for doc in docs],
-        metadatas=[doc.metadata for doc in docs]
-    )
-    st.write("Embeddings created and stored in Chroma successfully.")
-    return vectorstore
-
-# Process URLs and create embeddings when button is clicked
+        st.write(f"Sync result: {result}")
+    return result
+
+# Process URLs and create embeddings when button is clicked.
+# Pages are checked, split and embedded one by one as they finish loading.
 vectorstore = None
 if process_url_clicked and urls:
-    updated_docs = []  # List of documents with updated content
-    data = load_data(urls)
-
-    if data:
-        for doc, url in zip(data, urls):
-            if url:  # Ensure the URL is valid
-                content_hash = compute_hash(doc.page_content)
-                previous_hash = st.session_state.url_content_hashes.get(url)
-
-                # Process only if content hash has changed or URL is new
-                if previous_hash != content_hash:
-                    updated_docs.append(doc)
-                    st.session_state.url_content_hashes[url] = content_hash  # Update stored hash
-
-        if updated_docs:
-            docs = split_data(updated_docs)
-            if docs:
-                vectorstore = create_embeddings(docs)
-                time.sleep(2)
-            else:
-                st.write("No new or updated documents to process.")
-        else:
-            st.write("No new or updated content found in the provided URLs.")
+    index_sync = get_index_sync(vectorstore_path)
+    vectorstore = index_sync.vectorstore
+    sync_results = [create_embeddings(doc, index_sync) for doc in load_data(urls)]
+    # Pages indexed earlier whose boilerplate changed with this batch are re-indexed too
+    from ingestion import resync_stale
+
+    boilerplate = getattr(get_text_splitter(config.CHUNK_SIZE, config.CHUNK_OVERLAP), "boilerplate", None)
+    for _, sync_result in resync_stale(index_sync, split_data, boilerplate, get_embeddings(api_key)):
+        if debug_mode:
+            st.write(f"Re-indexed for boilerplate changes: {sync_result}")
+    updated_results = [result for result in sync_results if not result.skipped]
+
+    if any(result.added or result.deleted for result in updated_results):
+        st.write("Embeddings created and stored in the vector store successfully.")
+        if debug_mode:
+            from embedding_cache import get_cache
+
+            st.write(f"Embedding cache: {get_cache().stats()}")  # Hits/misses since startup
+        time.sleep(2)
+    elif updated_results:
+        st.write("No new or updated documents to process.")
+    elif sync_results:
+        st.write("No new or updated content found in the provided URLs.")
     else:
         st.write("Failed to load data from the URLs.")
 
@@ -143,24 +145,22 @@ if query and query != st.session_state.last_query:
 
 if query and not st.session_state.satisfied:
     if vectorstore is not None or os.path.exists(vectorstore_path):
-        if vectorstore is None:
-            vectorstore = Chroma(
-                persist_directory=vectorstore_path,
-                embedding_function=OpenAIEmbeddings()
-            )
+        # Retrieval chain with source document support (and the ChatGPT-4 model behind it),
+        # built on the first question and reused across reruns
+        chain = get_chain(api_key, vectorstore_path)
+        if config.RECRAWL_INTERVAL_SECONDS:
+            get_recrawl_worker(api_key, vectorstore_path)  # keeps the index fresh in the background
         
-        # Initialize retrieval chain with source document support
-        chain = RetrievalQAWithSourcesChain.from_llm(
-            llm=llm, 
-            retriever=vectorstore.as_retriever(), 
-            return_source_documents=True
-        )
-        
-        # Measure query response time
-        start_time = time.time()
-        result = chain.invoke({"question": query})
-        response_time = time.time() - start_time
-        st.session_state.query_times.append(response_time)
+        # Measure query response time. The answer is kept in the session, so the reruns of the
+        # feedback form show it again without asking or timing it a second time.
+        if st.session_state.answered["question"] == query:
+            result, response_time = st.session_state.answered["result"], st.session_state.answered["response_time"]
+        else:
+            start_time = time.time()
+            result = chain.invoke({"question": query})
+            response_time = time.time() - start_time
+            metrics_store.record_timing(st.session_state.metrics_session, response_time)
+            st.session_state.answered = {"question": query, "result": result, "response_time": response_time}
         
         # Display the answer
         st.header("Answer")
@@ -196,43 +196,45 @@ if query and not st.session_state.satisfied:
             feedback_comment = st.text_area("Additional Comments (optional):")
             submitted = st.form_submit_button("Submit Feedback")
         if submitted:
-            # Save feedback to session state
-            st.session_state.feedback_history.append({
-                "query": query,
-                "rating": temp_rating,
-                "comments": feedback_comment
-            })
+            # Save feedback to the metrics store
+            metrics_store.record_feedback(
+                st.session_state.metrics_session, query, result["answer"], ", ".join(unique_sources) if sources else "",
+                temp_rating, feedback_comment, response_time
+            )
 
             if temp_rating >= 4:
                 st.success(f"Thank you for your feedback! Rating: {temp_rating}/5")
                 st.session_state.satisfied = True  # Allow next query
+                st.session_state.answered = {"question": None}
             else:
                 st.warning("Refining the response based on feedback...")
-                refined_query = f"Refine the answer: Rating {temp_rating}/5. {feedback_comment or 'No comments'}"
-                refined_result = chain.invoke({"question": refined_query})
+                # One streamed LLM call over the passages already retrieved for the question
+                from refinement import refine_stream
+
                 st.write("Refined Answer:")
-                st.write(refined_result["answer"])
+                st.write_stream(refine_stream(get_refine_chain(api_key), query, result, temp_rating, feedback_comment))
 
 # Feedback visualization
-if st.session_state.feedback_history:
-    feedback_df = pd.DataFrame(st.session_state.feedback_history)
-    if "rating" in feedback_df.columns:
-        feedback_summary = feedback_df["rating"].value_counts().sort_index()
-        fig, ax = plt.subplots()
-        feedback_summary.plot.bar(ax=ax, color=["red", "orange", "yellow", "green", "blue"], edgecolor="black")
-        ax.set_title("Number of Queries by Feedback Rating")
-        ax.set_xlabel("Rating")
-        ax.set_ylabel("Count")
-        st.pyplot(fig)
-
-# Query response time visualization
-if st.session_state.query_times:
-    response_df = pd.DataFrame({
-        "Query #": range(1, len(st.session_state.query_times) + 1),
-        "Response Time (s)": st.session_state.query_times
-    })
+rating_counts = metrics_store.rating_counts(st.session_state.metrics_session)
+if rating_counts:
+    plt = plotting()
+    colors = {1: "red", 2: "orange", 3: "yellow", 4: "green", 5: "blue"}
+    fig, ax = plt.subplots()
+    ax.bar([str(rating) for rating in rating_counts], list(rating_counts.values()),
+           color=[colors.get(rating, "gray") for rating in rating_counts], edgecolor="black")
+    ax.set_title("Number of Queries by Feedback Rating")
+    ax.set_xlabel("Rating")
+    ax.set_ylabel("Count")
+    st.pyplot(fig)
+
+# Query response time visualization (the most recent questions)
+query_count = metrics_store.latency_summary("response", st.session_state.metrics_session)["count"]
+if query_count:
+    plt = plotting()
+    recent = metrics_store.recent_timings(st.session_state.metrics_session)
     fig, ax = plt.subplots()
-    ax.plot(response_df["Query #"], response_df["Response Time (s)"], marker="o", color="purple")
+    ax.plot(range(query_count - len(recent) + 1, query_count + 1), [total for total, _ in recent],
+            marker="o", color="purple")
     ax.set_title("Query Response Time")
     ax.set_xlabel("Query #")
     ax.set_ylabel("Response Time (s)")
@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+
+# The tests run offline against the fake backends (fake_backends.py) and a local fixture server
+# (fixture_corpus.py). The environment is set before config is first imported, and every
+# database the code writes by default lives in a temporary directory.
+_workdir = tempfile.mkdtemp(prefix="smartsearch-tests-")
+os.environ.update({
+    "SMARTSEARCH_FAKE_BACKENDS": "1",
+    "SMARTSEARCH_FAKE_LLM_LATENCY": "0",
+    "SMARTSEARCH_FAKE_LLM_TOKEN_LATENCY": "0",
+    "SMARTSEARCH_VECTORSTORE_PATH": os.path.join(_workdir, "store"),
+    "SMARTSEARCH_EMBEDDING_CACHE_PATH": os.path.join(_workdir, "embedding_cache.sqlite3"),
+    "SMARTSEARCH_METRICS_DB_PATH": os.path.join(_workdir, "metrics.sqlite3"),
+    "SMARTSEARCH_TRACE_EXPORT": "none",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,24 @@
+import json
+
+from batch_qa import prepare_resume
+
+
+def test_resume_keeps_one_answer_per_id_and_drops_failures(tmp_path):
+    output = tmp_path / "answers.jsonl"
+    lines = [
+        json.dumps({"id": "1", "answer": "first"}),
+        json.dumps({"id": "2", "error": "TimeoutError: "}),
+        json.dumps({"answer": "no id"}),
+        json.dumps({"id": "2", "answer": "retried"}),
+        json.dumps({"id": "3", "error": "RateLimitError: "}),
+        '{"id": "4", "ans',  # cut short by the interruption
+    ]
+    output.write_text("\n".join(lines), encoding="utf-8")
+    assert prepare_resume(str(output)) == {"1", "2"}
+    records = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert records == [{"id": "1", "answer": "first"}, {"id": "2", "answer": "retried"}]
+
+
+def test_resume_without_an_output_file(tmp_path):
+    assert prepare_resume(str(tmp_path / "missing.jsonl")) == set()
+    assert not (tmp_path / "missing.jsonl").exists()
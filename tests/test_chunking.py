@@ -0,0 +1,111 @@
+import pytest
+from langchain_core.documents import Document
+
+from chunking import ELEMENTS_KEY, BoilerplateIndex, StructuredTokenSplitter
+from fixture_corpus import FixtureServer
+from ingestion import iter_ingest, resync_stale
+from pipeline import Pipeline
+from tokenization import count_tokens
+
+FOOTER = "Fixture News is a synthetic publication"
+
+
+@pytest.fixture
+def server():
+    with FixtureServer(3, paragraphs=3) as server:
+        yield server
+
+
+# Function to ingest URLs into a pipeline's store the way main_python.py ingest does
+def ingest(pipeline, urls):
+    for result in iter_ingest(urls, parse_workers=0):
+        pipeline.index_sync.sync_document(result.document, pipeline.split_documents)
+
+
+# Function to read the chunk texts a page has in the store
+def page_chunks(pipeline, url):
+    return pipeline.index_sync.vectorstore.get(where={"source": url})["documents"]
+
+
+def test_pages_indexed_before_a_block_became_boilerplate_are_resynced(server, tmp_path):
+    pipeline = Pipeline(path=str(tmp_path / "store"))
+    boilerplate = pipeline.text_splitter.boilerplate
+    first, second, third = server.urls()
+    ingest(pipeline, [first])
+    ingest(pipeline, [second])
+    assert any(FOOTER in chunk for chunk in page_chunks(pipeline, second))  # on two pages: not boilerplate yet
+
+    ingest(pipeline, [third])  # the footer is now on three pages
+    assert not any(FOOTER in chunk for chunk in page_chunks(pipeline, third))
+    assert boilerplate.stale() == [second]
+
+    resynced = list(resync_stale(pipeline.index_sync, pipeline.split_documents, boilerplate))
+    assert [result.url for result, sync_result in resynced if sync_result is not None] == [second]
+    assert boilerplate.stale() == []
+    assert not any(FOOTER in chunk for chunk in page_chunks(pipeline, second))
+    assert any(FOOTER in chunk for chunk in page_chunks(pipeline, first))  # kept on the first page
+
+
+# Function to build a document whose unstructured elements are (category, text) blocks
+def structured(source, *blocks):
+    text = "\n\n".join(text for _, text in blocks)
+    return Document(page_content=text, metadata={"source": source, ELEMENTS_KEY: [(c, len(t)) for c, t in blocks]})
+
+
+def sentence(number, words=12):
+    return " ".join(f"word{number}x{i}" for i in range(words)) + "."
+
+
+def test_boilerplate_stays_on_the_first_page_only():
+    boilerplate = BoilerplateIndex(":memory:", min_pages=2)
+    page = [("Title", "Menu"), ("Text", "Cookie notice."), ("Text", "Own text {}.")]
+    kept, dropped = boilerplate.filter("http://site/a", [(c, t.format("a")) for c, t in page])
+    assert dropped == []
+    kept, dropped = boilerplate.filter("http://site/b", [(c, t.format("b")) for c, t in page])
+    assert kept == [("Title", "Menu"), ("Text", "Own text b.")]  # headings are never left out
+    assert dropped == [("Text", "Cookie notice.")]
+    _, dropped = boilerplate.filter("http://other/a", [("Text", "cookie   NOTICE.")])
+    assert dropped == []  # counted per site
+    assert boilerplate.filter("http://site/b", [("Text", "Cookie notice.")])[1] == [("Text", "Cookie notice.")]
+    assert boilerplate.stale() == []
+
+
+def test_pages_whose_left_out_blocks_change_are_marked_stale():
+    boilerplate = BoilerplateIndex(":memory:", min_pages=3)
+    for page in "abc":
+        boilerplate.filter(f"http://site/{page}", [("Text", "Shared footer."), ("Text", f"Text of {page}.")])
+    assert boilerplate.stale() == ["http://site/b"]  # indexed with the footer, which is now boilerplate
+    _, dropped = boilerplate.filter("http://site/b", [("Text", "Shared footer."), ("Text", "Text of b.")])
+    assert dropped == [("Text", "Shared footer.")]
+    assert boilerplate.stale() == []
+
+    boilerplate.filter("http://site/a", [("Text", "New footer."), ("Text", "Text of a.")])
+    assert boilerplate.stale() == ["http://site/b", "http://site/c"]  # two pages left: both keep the footer again
+    kept, dropped = boilerplate.filter("http://site/c", [("Text", "Shared footer."), ("Text", "Text of c.")])
+    assert (len(kept), dropped) == (2, [])
+    assert boilerplate.stale() == ["http://site/b"]
+
+
+def test_chunks_stay_within_the_token_budget_and_repeat_their_heading():
+    splitter = StructuredTokenSplitter(chunk_size=60, chunk_overlap=0)
+    document = structured("http://site/a", ("Title", "Results"), *[("Text", sentence(i)) for i in range(10)],
+                          ("Title", "Empty section"), ("Title", "Outlook"), ("Text", sentence(99)))
+    chunks = splitter.split_documents([document])
+    assert all(count_tokens(chunk.page_content) <= 60 for chunk in chunks)
+    assert all(ELEMENTS_KEY not in chunk.metadata and chunk.metadata["source"] == "http://site/a" for chunk in chunks)
+    results, outlook = chunks[:-1], chunks[-1]
+    assert len(results) > 1 and all(chunk.page_content.startswith("Results\n\n") for chunk in results)
+    assert outlook.page_content == f"Empty section\n\nOutlook\n\n{sentence(99)}"
+    body = "\n\n".join(chunk.page_content.removeprefix("Results\n\n") for chunk in results)
+    assert body == "\n\n".join(sentence(i) for i in range(10))  # every block once, in order, without overlap
+    assert splitter.totals["documents"] == 1 and splitter.totals["chunks"] == len(chunks)
+
+
+def test_overlap_repeats_the_last_blocks_and_long_blocks_are_cut():
+    splitter = StructuredTokenSplitter(chunk_size=60, chunk_overlap=30)
+    document = structured("http://site/a", *[("Text", sentence(i)) for i in range(6)], ("Text", sentence(7, words=200)))
+    chunks = [chunk.page_content.split("\n\n") for chunk in splitter.split_documents([document])]
+    assert chunks[1][0] == chunks[0][-1]  # the last block of a full chunk starts the next one
+    pieces = [blocks for blocks in chunks if blocks[-1].startswith("word7x")]
+    assert len(pieces) > 3 and all(len(blocks) == 1 for blocks in pieces)  # the long block is cut on its own
+    assert pieces[0][0].startswith("word7x0 ") and pieces[-1][0].endswith("word7x199.")
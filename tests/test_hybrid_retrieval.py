@@ -0,0 +1,108 @@
+import pytest
+from langchain_core.documents import Document
+
+from hybrid_retrieval import HybridRetriever, document_key, reciprocal_rank_fusion
+from lexical_index import BM25Index, tokenize
+
+CHUNKS = [
+    ("a", "The earthquake measured 7.1 on the Richter scale.", {"source": "http://fixture/page/0"}),
+    ("b", "Rescue teams reached 1,200 residents after the earthquake.", {"source": "http://fixture/page/1"}),
+    ("c", "The central bank kept interest rates unchanged.", {"source": "http://fixture/page/2"}),
+    ("d", "Interest in the football final reached a record.", {"source": "http://fixture/page/2"}),
+]
+
+
+@pytest.fixture
+def lexical_index(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.sqlite3"))
+    index.add(CHUNKS)
+    yield index
+    index.close()
+
+
+def ids(hits):
+    return [hit[0] for hit in hits]
+
+
+def doc(doc_id, source="http://fixture/page/0"):
+    return Document(id=doc_id, page_content=f"text of {doc_id}", metadata={"source": source})
+
+
+# Dense side of the retriever: returns a fixed ranking whatever the query
+class StaticVectorStore:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def similarity_search(self, query, k, filter=None):
+        return self.documents[:k]
+
+
+def test_numbers_are_kept_whole():
+    assert tokenize("Magnitude 7.1, 1,200 people; 3 p.m.") == ["magnitude", "7.1", "1,200", "people", "3", "p", "m"]
+
+
+def test_search_ranks_matching_chunks(lexical_index):
+    assert ids(lexical_index.search("earthquake 7.1")) == ["a", "b"]
+    assert ids(lexical_index.search("1,200")) == ["b"]
+    assert ids(lexical_index.search("interest rates")) == ["c", "d"]
+    assert lexical_index.search("volcano") == []
+    assert lexical_index.search("!!!") == []
+    doc_id, text, metadata, score = lexical_index.search("bank", k=1)[0]
+    assert (doc_id, text, metadata) == CHUNKS[2] and score > 0
+
+
+def test_source_filter(lexical_index):
+    assert ids(lexical_index.search("earthquake", sources=["http://fixture/page/1"])) == ["b"]
+    assert ids(lexical_index.search("reached", k=1, sources=["http://fixture/page/2"])) == ["d"]
+
+
+def test_add_replaces_and_delete_removes(lexical_index):
+    lexical_index.add([("a", "A volcano erupted overnight.", {"source": "http://fixture/page/0"})])
+    assert len(lexical_index) == 4
+    assert ids(lexical_index.search("earthquake")) == ["b"]
+    assert ids(lexical_index.search("volcano")) == ["a"]
+    lexical_index.delete(["a", "b"])
+    assert len(lexical_index) == 2
+    assert lexical_index.search("volcano earthquake") == []
+    assert lexical_index.missing(["a", "c", "e"]) == ["a", "e"]
+
+
+def test_clear_and_reopen(lexical_index, tmp_path):
+    assert len(BM25Index(lexical_index.path)) == 4  # persisted
+    lexical_index.clear()
+    assert len(lexical_index) == 0
+    assert lexical_index.search("earthquake") == []
+    assert lexical_index.missing(["a"]) == ["a"]
+
+
+def test_rrf_weights_and_dedupes_documents():
+    dense = [doc("x"), doc("y"), doc("z")]
+    lexical = [doc("z"), doc("w")]
+    fused = reciprocal_rank_fusion([dense, lexical], [1.0, 1.0], rrf_k=60)
+    assert [document.id for document in fused] == ["z", "x", "y", "w"]  # z is in both lists; ties keep list order
+    fused = reciprocal_rank_fusion([dense, lexical], [1.0, 0.0], rrf_k=60)
+    assert [document.id for document in fused][:3] == ["x", "y", "z"]
+
+
+def test_documents_without_ids_are_keyed_by_source_and_text():
+    first = Document(page_content="Same text.", metadata={"source": "http://fixture/page/0"})
+    again = Document(page_content="Same text.", metadata={"source": "http://fixture/page/0"})
+    other = Document(page_content="Same text.", metadata={"source": "http://fixture/page/1"})
+    assert document_key(first) == document_key(again) != document_key(other)
+    assert len(reciprocal_rank_fusion([[first, other], [again]], [1.0, 1.0])) == 2
+
+
+def test_lexical_mode_needs_no_vector_store(lexical_index):
+    retriever = HybridRetriever(vectorstore=None, lexical_index=lexical_index, mode="lexical", k=1)
+    assert [document.id for document in retriever.invoke("earthquake")] == ["a"]
+    retriever = HybridRetriever(vectorstore=None, lexical_index=lexical_index, mode="lexical",
+                                sources=("http://fixture/page/1",))
+    assert [document.id for document in retriever.invoke("earthquake")] == ["b"]
+
+
+def test_hybrid_mode_fuses_both_rankings(lexical_index):
+    dense = StaticVectorStore([doc("c", "http://fixture/page/2"), doc("b", "http://fixture/page/1")])
+    retriever = HybridRetriever(vectorstore=dense, lexical_index=lexical_index, mode="hybrid", k=3,
+                                vector_weight=1.0, lexical_weight=1.0)
+    # b is ranked by both searches, c by the dense one only, a by the lexical one only
+    assert [document.id for document in retriever.invoke("earthquake")] == ["b", "c", "a"]
@@ -0,0 +1,129 @@
+import json
+import os
+
+import pytest
+from langchain_core.documents import Document
+
+import config
+from index_sync import chunk_id, content_hash, indexed_sources, store_version
+from pipeline import Pipeline
+
+SOURCE = "http://fixture/page/0"
+
+
+# Function to split a page into one chunk per paragraph (keeps the expected chunks obvious)
+def split_paragraphs(documents):
+    return [Document(page_content=text, metadata=dict(document.metadata))
+            for document in documents for text in document.page_content.split("\n\n")]
+
+
+def page(*paragraphs, source=SOURCE):
+    return Document(page_content="\n\n".join(paragraphs), metadata={"source": source})
+
+
+@pytest.fixture
+def store(tmp_path):
+    return str(tmp_path / "store")
+
+
+def test_chunk_ids_live_in_sqlite_not_in_the_manifest(store):
+    index_sync = Pipeline(path=store).index_sync
+    index_sync.sync_document(page("Alpha paragraph.", "Beta paragraph."), split_paragraphs)
+    with open(index_sync.manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert "sources" not in manifest
+    assert manifest["version"] == 1
+    assert sorted(index_sync.source_index.chunk_ids(SOURCE)) == sorted(
+        chunk_id(SOURCE, text) for text in ("Alpha paragraph.", "Beta paragraph."))
+    assert indexed_sources(store) == [SOURCE]
+
+
+def test_older_manifests_are_migrated(store):
+    index_sync = Pipeline(path=store).index_sync
+    index_sync.sync_document(page("Alpha paragraph."), split_paragraphs)
+    index_sync.source_index.clear()
+    with open(index_sync.manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["sources"] = {SOURCE: {"page_hash": content_hash("Alpha paragraph."), "chunk_ids": ["x"]}}
+    with open(index_sync.manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    assert indexed_sources(store) == [SOURCE]
+
+    reopened = Pipeline(path=store).index_sync
+    assert reopened.sources() == [SOURCE]
+    assert reopened.page_unchanged(SOURCE, "Alpha paragraph.")
+    with open(reopened.manifest_path, encoding="utf-8") as f:
+        assert "sources" not in json.load(f)
+
+
+def test_switching_backends_resets_sources_and_the_keyword_index(store, monkeypatch):
+    index_sync = Pipeline(path=store).index_sync
+    index_sync.sync_document(page("Alpha paragraph.", "Beta paragraph."), split_paragraphs)
+    assert len(index_sync.lexical_index) == 2
+
+    monkeypatch.setattr(config, "VECTOR_BACKEND", "mmap")
+    switched = Pipeline(path=store).index_sync
+    assert switched.sources() == []
+    assert len(switched.lexical_index) == 0
+    assert switched.lexical_index.search("alpha") == []
+    result = switched.sync_document(page("Alpha paragraph.", "Beta paragraph."), split_paragraphs)
+    assert (result.added, result.skipped) == (2, False)
+    assert {hit[0] for hit in switched.lexical_index.search("alpha")} == {chunk_id(SOURCE, "Alpha paragraph.")}
+    assert os.path.exists(os.path.join(store, config.INDEX_SOURCES_NAME))
+
+
+def stored_ids(index_sync, source=SOURCE):
+    return set(index_sync.vectorstore.get(where={"source": source}, include=[])["ids"])
+
+
+def test_identical_chunks_share_one_id(store):
+    index_sync = Pipeline(path=store).index_sync
+    result = index_sync.sync_document(page("Same paragraph.", "Other paragraph.", "Same paragraph."), split_paragraphs)
+    assert (result.added, result.unchanged) == (2, 0)
+    assert stored_ids(index_sync) == {chunk_id(SOURCE, "Same paragraph."), chunk_id(SOURCE, "Other paragraph.")}
+    # The same text on another page is a different chunk
+    assert chunk_id(SOURCE, "Same paragraph.") != chunk_id("http://fixture/page/1", "Same paragraph.")
+
+
+def test_unchanged_page_is_skipped_and_keeps_the_version(store):
+    index_sync = Pipeline(path=store).index_sync
+    index_sync.sync_document(page("Alpha paragraph."), split_paragraphs)
+    version = store_version(store)
+
+    def fail(documents):
+        raise AssertionError("an unchanged page was split again")
+
+    assert index_sync.sync_document(page("Alpha paragraph."), fail).skipped
+    forced = index_sync.sync_document(page("Alpha paragraph."), split_paragraphs, force=True)
+    assert (forced.skipped, forced.added, forced.unchanged) == (False, 0, 1)
+    assert index_sync.version == 1
+    assert store_version(store) == version
+
+
+def test_changed_page_adds_new_chunks_and_deletes_vanished_ones(store):
+    index_sync = Pipeline(path=store).index_sync
+    index_sync.sync_document(page("Alpha paragraph.", "Beta paragraph."), split_paragraphs)
+    version = store_version(store)
+    result = index_sync.sync_document(page("Alpha paragraph.", "Gamma paragraph."), split_paragraphs)
+    assert (result.added, result.deleted, result.unchanged) == (1, 1, 1)
+    assert stored_ids(index_sync) == {chunk_id(SOURCE, "Alpha paragraph."), chunk_id(SOURCE, "Gamma paragraph.")}
+    assert index_sync.lexical_index.search("beta") == []
+    assert index_sync.version == 2
+    assert store_version(store) != version
+
+
+def test_remove_source_deletes_its_chunks_only(store):
+    other = "http://fixture/page/1"
+    index_sync = Pipeline(path=store).index_sync
+    index_sync.sync_document(page("Alpha paragraph.", "Beta paragraph."), split_paragraphs)
+    index_sync.sync_document(page("Alpha paragraph.", source=other), split_paragraphs)
+    assert index_sync.version == 2
+
+    assert index_sync.remove_source(SOURCE).deleted == 2
+    assert stored_ids(index_sync) == set()
+    assert stored_ids(index_sync, other) == {chunk_id(other, "Alpha paragraph.")}
+    assert index_sync.sources() == [other]
+    assert {hit[0] for hit in index_sync.lexical_index.search("alpha")} == {chunk_id(other, "Alpha paragraph.")}
+    assert index_sync.version == 3
+    assert index_sync.remove_source(SOURCE).deleted == 0
+    assert index_sync.version == 3
@@ -0,0 +1,75 @@
+import pytest
+
+from fixture_corpus import FixtureServer, product_price
+from ingestion import FetchError, fetch_url, iter_ingest, parse_html
+
+
+@pytest.fixture
+def server():
+    with FixtureServer(2, paragraphs=3) as server:
+        yield server
+
+
+def test_fetch_returns_page_and_validators(server):
+    response = fetch_url(server.urls()[0], retries=0)
+    assert response.status == 200
+    assert response.attempts == 1
+    assert product_price(0) in response.text
+    assert response.headers["ETag"] == '"0-0"'
+
+
+def test_fetch_retries_transient_errors(server):
+    server.fail(0, 503, times=2)
+    response = fetch_url(server.urls()[0], retries=2, backoff=0)
+    assert response.status == 200
+    assert response.attempts == 3
+    assert server.responses[503, 0] == 2
+
+
+def test_fetch_gives_up_after_retries(server):
+    server.fail(0, 503, times=5)
+    with pytest.raises(FetchError, match="503"):
+        fetch_url(server.urls()[0], retries=1, backoff=0)
+    assert server.responses[503, 0] == 2
+
+
+def test_fetch_does_not_retry_client_errors(server):
+    with pytest.raises(FetchError, match="404"):
+        fetch_url(f"{server.base_url}/page/99", retries=3, backoff=0)
+    assert server.responses[404, 99] == 1
+
+
+def test_fetch_times_out(server):
+    server.delay = 0.5
+    with pytest.raises(FetchError, match="timed out"):
+        fetch_url(server.urls()[0], timeout=0.1, retries=0)
+
+
+def test_conditional_fetch_returns_304(server):
+    response = fetch_url(server.urls()[0], retries=0, headers={"If-None-Match": '"0-0"'})
+    assert response.status == 304
+    assert response.text == ""
+    server.revise(0)
+    assert fetch_url(server.urls()[0], retries=0, headers={"If-None-Match": '"0-0"'}).status == 200
+
+
+def test_iter_ingest_reports_failed_urls(server):
+    urls = server.urls() + [f"{server.base_url}/page/99"]
+    results = {result.url: result for result in iter_ingest(urls, parse_workers=0, retries=0)}
+    assert all(results[url].ok for url in server.urls())
+    assert results[urls[-1]].document is None
+    assert "404" in results[urls[-1]].error
+    assert results[urls[0]].document.metadata["source"] == urls[0]
+
+
+def test_malformed_url_fails_alone(server):
+    with pytest.raises(FetchError, match="unknown url type"):
+        fetch_url("www.example.com/x", retries=3, backoff=0)
+    results = {result.url: result for result in iter_ingest(["www.example.com/x"] + server.urls(), parse_workers=0)}
+    assert "unknown url type" in results["www.example.com/x"].error
+    assert all(results[url].ok for url in server.urls())
+
+
+def test_parse_html_categories():
+    elements, _ = parse_html("<h1>Title</h1><p>Some text.</p><ul><li>Item</li></ul><table><tr><td>a</td><td>b</td></tr></table>")
+    assert elements == [("Title", "Title"), ("NarrativeText", "Some text."), ("ListItem", "Item"), ("Table", "a b")]
@@ -0,0 +1,57 @@
+import pytest
+
+from fixture_corpus import FixtureServer, product_name, product_price
+from ingestion import iter_ingest
+from pipeline import Pipeline
+from recrawl import RecrawlWorker, registry_for
+
+
+@pytest.fixture
+def server():
+    with FixtureServer(2, paragraphs=3) as server:
+        yield server
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    return Pipeline(path=str(tmp_path / "store"))
+
+
+# A store holding the fixture pages, tracked in its re-crawl registry like main_python.py ingest does
+@pytest.fixture
+def worker(server, pipeline):
+    registry = registry_for(pipeline.path)
+    for result in iter_ingest(server.urls(), parse_workers=0):
+        registry.track(result.url, result.headers)
+        pipeline.index_sync.sync_document(result.document, pipeline.split_documents)
+    yield RecrawlWorker(pipeline.index_sync, pipeline.split_documents, registry, interval=0, max_workers=2)
+    registry.close()
+
+
+def test_unchanged_pages_are_answered_with_304(server, worker):
+    version = worker.index_sync.version
+    results = worker.run_once(server.urls())
+    assert {result.outcome for result in results} == {"not_modified"}
+    assert all(server.responses[304, index] == 1 for index in range(2))
+    assert all(server.responses[200, index] == 1 for index in range(2))  # the ingest only
+    assert worker.index_sync.version == version
+    assert worker.registry.get(server.urls()[0])["status"] == 304
+
+
+def test_changed_pages_are_reindexed(server, pipeline, worker):
+    server.revise(0)
+    results = {result.url: result for result in worker.run_once(server.urls())}
+    assert results[server.urls()[0]].outcome == "updated"
+    assert results[server.urls()[1]].outcome == "not_modified"
+    assert worker.registry.get(server.urls()[0])["etag"] == '"0-1"'
+    documents = pipeline.retriever.invoke(f"What is the price of the {product_name(0)}?")
+    text = " ".join(document.page_content for document in documents)
+    assert product_price(0, 1) in text
+    assert product_price(0, 0) not in text
+
+
+def test_failed_checks_are_recorded(server, worker):
+    server.fail(1, 404)
+    results = {result.url: result for result in worker.run_once(server.urls())}
+    assert results[server.urls()[1]].outcome == "failed"
+    assert "404" in worker.registry.get(server.urls()[1])["error"]
@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from langchain_core.runnables import RunnableLambda
+
+import config
+from fixture_corpus import FixtureServer, product_name, product_price
+from ingestion import iter_ingest
+from pipeline import Pipeline
+from server import SmartSearchServer
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "RECRAWL_INTERVAL_SECONDS", 0)  # no background re-crawl
+    pipeline = Pipeline(path=str(tmp_path / "store"))
+    with FixtureServer(2, paragraphs=3) as server:
+        for result in iter_ingest(server.urls(), parse_workers=0):
+            pipeline.index_sync.sync_document(result.document, pipeline.split_documents)
+    return pipeline
+
+
+# Function to POST JSON bodies, in order, to one fresh server and return each status with its
+# NDJSON events. The timeout turns a stream that never ends into a test failure instead of a hang.
+def post_events(pipeline, requests, timeout=30):
+    async def post():
+        async with TestClient(TestServer(SmartSearchServer(pipeline, max_concurrent_asks=2).build_app())) as client:
+            replies = []
+            for path, body in requests:
+                response = await client.post(path, json=body)
+                replies.append((response.status, [json.loads(line) for line in (await response.text()).splitlines()]))
+            return replies
+
+    return asyncio.run(asyncio.wait_for(post(), timeout))
+
+
+def test_streamed_answer(pipeline):
+    question = f"What is the price of the {product_name(0)}?"
+    [(status, events)] = post_events(pipeline, [("/ask", {"question": question, "stream": True})])
+    assert status == 200
+    assert events[0]["event"] == "sources"
+    assert events[0]["passages"]
+    assert {event["event"] for event in events[1:-1]} == {"token"}
+    assert events[-1]["event"] == "done"
+    answer = "".join(event["text"] for event in events[1:-1])
+    assert product_price(0) in answer
+    assert events[-1]["record"]["answer"].strip() == answer.strip()
+
+
+# The semantic cache lookup embeds the question outside answer_question, so its error escapes
+# the streaming worker
+def test_lookup_failure_ends_the_stream_with_an_error(pipeline, monkeypatch):
+    embed_query = pipeline.embeddings.embed_query
+
+    def flaky(text):
+        if "unavailable" in text:
+            raise ConnectionError("embedding service unavailable")
+        return embed_query(text)
+
+    monkeypatch.setattr(pipeline.embeddings, "embed_query", flaky)
+    (cached, _), (status, events) = post_events(pipeline, [
+        ("/ask", {"question": f"What is the price of the {product_name(1)}?"}),  # gives the cache an entry
+        ("/ask", {"question": "Is the embedding service unavailable?", "stream": True}),
+    ])
+    assert cached == 200
+    assert status == 200
+    assert events == [{"event": "error", "error": "ConnectionError: embedding service unavailable"}]
+
+
+def test_chain_failure_ends_the_stream_with_an_error(pipeline, monkeypatch):
+    def failing(inputs):
+        raise RuntimeError("model overloaded")
+
+    monkeypatch.setattr(pipeline, "chain_for", lambda sources=(): RunnableLambda(failing))
+    [(status, events)] = post_events(pipeline, [("/ask", {"question": "Anything?", "stream": True})])
+    assert status == 200
+    assert events[-1]["event"] == "error"
+    assert "model overloaded" in events[-1]["error"]
+    assert all(event["event"] != "done" for event in events)
+
+
+def test_streamed_cache_hit_carries_passages_cached_by_a_plain_ask(pipeline):
+    question = f"What is the price of the {product_name(0)}?"
+    (status, [record]), (_, events) = post_events(pipeline, [
+        ("/ask", {"question": question}),
+        ("/ask", {"question": question, "stream": True}),
+    ])
+    assert status == 200
+    assert "passages" not in record
+    assert events[-1]["record"]["cache"] == "exact"
+    assert events[0]["event"] == "sources"
+    assert any(product_price(0) in passage["content"] for passage in events[0]["passages"])
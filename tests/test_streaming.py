@@ -0,0 +1,73 @@
+import pytest
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from fake_backends import FakeStreamingChatModel
+from pipeline import make_chain
+from streaming import AnswerStream
+
+DOCUMENTS = [
+    Document(page_content="The Kaka 0 price starts at Rs 5.00 lakh.", metadata={"source": "http://fixture/page/0"}),
+    Document(page_content="Dealers expect strong festive demand.", metadata={"source": "http://fixture/page/1"}),
+]
+ANSWER = "The Kaka 0 price starts at Rs 5.00 lakh, according to the launch report."
+
+
+class StaticRetriever(BaseRetriever):
+    documents: list = []
+    error: str = None
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        if self.error:
+            raise RuntimeError(self.error)
+        return self.documents
+
+
+def ask(llm, retriever, on_sources=None):
+    return AnswerStream(make_chain(llm, retriever), {"question": "What is the price of the Kaka 0?"},
+                        on_sources=on_sources, final_answer_only=True)
+
+
+def test_tokens_stream_before_the_answer_completes():
+    llm = FakeStreamingChatModel(responses=[f"{ANSWER}\nSOURCES: http://fixture/page/0"])
+    stream = ask(llm, StaticRetriever(documents=DOCUMENTS))
+    pieces = list(stream)
+    assert len(pieces) > 1
+    assert "".join(pieces).strip() == ANSWER
+    assert "SOURCES" not in "".join(pieces)
+    assert stream.result["sources"] == "http://fixture/page/0"
+    assert 0 < stream.time_to_first_token <= stream.total_time
+
+
+def test_sources_arrive_before_the_first_token():
+    events = []
+    llm = FakeStreamingChatModel(responses=[f"{ANSWER}\nSOURCES: http://fixture/page/0"])
+    stream = ask(llm, StaticRetriever(documents=DOCUMENTS), on_sources=lambda documents: events.append(documents))
+    for piece in stream:
+        events.append(piece)
+    assert events[0] == DOCUMENTS
+    assert stream.source_documents == DOCUMENTS
+    assert stream.retrieval_time <= stream.time_to_first_token
+
+
+def test_non_streaming_model_yields_the_answer_once():
+    llm = FakeStreamingChatModel(responses=[f"{ANSWER}\nSOURCES: http://fixture/page/0"], streaming=False)
+    assert [piece.strip() for piece in ask(llm, StaticRetriever(documents=DOCUMENTS))] == [ANSWER]
+
+
+def test_errors_end_the_stream_and_are_raised():
+    stream = ask(FakeStreamingChatModel(), StaticRetriever(error="index unavailable"))
+    with pytest.raises(RuntimeError, match="index unavailable"):
+        list(stream)
+    assert isinstance(stream.error, RuntimeError)
+    assert stream.result is None
+
+
+def test_map_reduce_streams_only_the_final_answer(monkeypatch):
+    import config
+
+    monkeypatch.setattr(config, "QA_CHAIN_TYPE", "map_reduce")
+    llm = FakeStreamingChatModel(responses=["Mapped passage.", f"{ANSWER}\nSOURCES: http://fixture/page/0"])
+    pieces = list(ask(llm, StaticRetriever(documents=DOCUMENTS[:1])))  # one map call, then the combine call
+    assert "".join(pieces).strip() == ANSWER
+    assert llm.calls == 2
@@ -0,0 +1,144 @@
+import numpy as np
+import pytest
+
+from vector_index import VectorIndex, dequantize, normalize_rows, quantize
+
+DIMENSION = 32
+
+
+# Function to build `count` unit vectors around `clusters` random centres (a corpus with structure for IVF)
+def clustered_vectors(count, clusters=8, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, DIMENSION))
+    return normalize_rows(centres[rng.integers(clusters, size=count)] + 0.3 * rng.normal(size=(count, DIMENSION)))
+
+
+# Function to fill an index with one segment per `segment_rows` vectors; ids are "c<row>"
+def fill(index, vectors, segment_rows=100):
+    for start in range(0, len(vectors), segment_rows):
+        rows = range(start, min(len(vectors), start + segment_rows))
+        index.upsert([f"c{row}" for row in rows], vectors[list(rows)], [f"chunk {row}" for row in rows],
+                     [{"source": f"http://fixture/page/{row % 5}"} for row in rows])
+
+
+# Function to give the exact cosine top-k ids for each query
+def exact_top_k(vectors, queries, k, alive=None):
+    scores = normalize_rows(queries) @ vectors.T
+    if alive is not None:
+        scores[:, ~alive] = -np.inf
+    return [[f"c{row}" for row in np.argsort(-row_scores)[:k]] for row_scores in scores]
+
+
+def hit_ids(hits):
+    return [[document.id for document, _ in found] for found in hits]
+
+
+@pytest.fixture
+def make_index(tmp_path):
+    def make(**options):
+        options = {"compact_segments": 1000, "ivf_min_rows": 10 ** 9, **options}  # no background compaction
+        return VectorIndex(str(tmp_path / "index"), **options)
+    return make
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_quantization_keeps_cosine_similarities(dtype):
+    vectors = clustered_vectors(200)
+    codes, scales = quantize(vectors, dtype)
+    assert codes.dtype == np.dtype(dtype)
+    restored = dequantize(codes, scales)
+    assert np.abs(restored @ vectors.T - vectors @ vectors.T).max() < (0.002 if dtype == "float16" else 0.05)
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_exact_search_matches_brute_force_across_segments(make_index, dtype):
+    vectors = clustered_vectors(500)
+    index = make_index(dtype=dtype)
+    fill(index, vectors)
+    assert len(index.segments) == 5
+    queries = clustered_vectors(20, seed=1)
+    expected, found = exact_top_k(vectors, queries, 5), hit_ids(index.search(queries, k=5))
+    overlap = np.mean([len(set(e) & set(f)) / 5 for e, f in zip(expected, found)])
+    assert overlap >= (1.0 if dtype == "float16" else 0.9)
+
+
+def test_upsert_replaces_and_delete_removes(make_index):
+    vectors = clustered_vectors(100)
+    index = make_index()
+    fill(index, vectors)
+    index.upsert(["c0"], -vectors[:1], ["moved"], [{"source": "http://fixture/page/0"}])
+    index.delete(["c1"])
+    assert len(index) == 99
+    top = hit_ids(index.search(vectors[:2], k=3))
+    assert "c0" not in top[0] and "c1" not in top[1]
+    assert hit_ids(index.search(-vectors[:1], k=1)) == [["c0"]]
+    assert index.get(ids=["c0"])["documents"] == ["moved"]
+    assert set(index.get(where={"source": "http://fixture/page/1"})["ids"]) == {f"c{row}" for row in range(6, 100, 5)}
+
+
+def test_source_filter(make_index):
+    vectors = clustered_vectors(100)
+    index = make_index()
+    fill(index, vectors)
+    hits = index.search(vectors[:3], k=4, sources=["http://fixture/page/2"])
+    assert all(document.metadata["source"] == "http://fixture/page/2" for found in hits for document, _ in found)
+    assert [len(found) for found in hits] == [4, 4, 4]
+
+
+def test_compaction_drops_deleted_rows_and_keeps_results(make_index):
+    vectors = clustered_vectors(400)
+    index = make_index()
+    fill(index, vectors)
+    index.delete([f"c{row}" for row in range(0, 400, 3)])
+    queries = clustered_vectors(10, seed=2)
+    before = hit_ids(index.search(queries, k=5))
+    index.compact()
+    assert len(index.segments) == 1
+    assert index.segments[0].rows == len(index) == 400 - len(range(0, 400, 3))
+    assert hit_ids(index.search(queries, k=5)) == before
+
+
+def test_ivf_search_after_compaction(make_index):
+    vectors = clustered_vectors(2000)
+    index = make_index(search="ivf", nprobe=12, ivf_min_rows=500)
+    fill(index, vectors, segment_rows=500)
+    index.compact()
+    assert index.centroids is not None and index.segments[0].offsets is not None
+    queries = clustered_vectors(30, seed=3)
+    expected, found = exact_top_k(vectors, queries, 10), hit_ids(index.search(queries, k=10))
+    assert np.mean([len(set(e) & set(f)) / 10 for e, f in zip(expected, found)]) >= 0.9
+
+
+def test_search_during_compaction_returns_k_hits(make_index):
+    vectors = clustered_vectors(300)
+    index = make_index()
+    fill(index, vectors)
+    queries = clustered_vectors(5, seed=4)
+    expected = hit_ids(index.search(queries, k=6))
+    scan_segment = index._scan_segment
+    compacted = []
+
+    # The first segment scanned starts (and finishes) a compaction that moves every row
+    def scan_then_compact(*args):
+        found = scan_segment(*args)
+        if not compacted:
+            compacted.append(True)
+            index.compact()
+        return found
+
+    index._scan_segment = scan_then_compact
+    assert hit_ids(index.search(queries, k=6)) == expected
+
+
+def test_index_survives_reopening(make_index):
+    vectors = clustered_vectors(200)
+    index = make_index()
+    fill(index, vectors)
+    index.compact()
+    index.upsert(["extra"], vectors[:1], ["extra chunk"], [{"source": "http://fixture/page/9"}])
+    queries = clustered_vectors(5, seed=5)
+    before = hit_ids(index.search(queries, k=4))
+    index.close()
+    reopened = make_index()
+    assert len(reopened) == 201
+    assert hit_ids(reopened.search(queries, k=4)) == before
@@ -0,0 +1,31 @@
+import functools
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Encoding used by GPT-4 and the OpenAI embedding models
+DEFAULT_ENCODING = "cl100k_base"
+
+# Fallback estimate: about four characters of English per token, and never fewer tokens than words
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+# Function to load a tiktoken encoding once; returns None when tiktoken or its BPE file is unavailable
+@functools.lru_cache(maxsize=None)
+def get_encoding(name=DEFAULT_ENCODING):
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(name)
+    except Exception as e:  # not installed, or the BPE file cannot be downloaded (offline)
+        logger.warning(f"tiktoken encoding {name} unavailable ({e}); using approximate token counts")
+        return None
+
+
+# Function to count tokens with the local tokenizer, falling back to an estimate
+def count_tokens(text, encoding=DEFAULT_ENCODING):
+    enc = get_encoding(encoding)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return max(len(text) // 4, len(_WORD_PATTERN.findall(text)))
@@ -0,0 +1,557 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Compact local vector index, an alternative to Chroma (SMARTSEARCH_VECTOR_BACKEND=mmap).
+# Vectors are L2-normalised and quantized (float16, or int8 with one scale per row) into
+# append-only segment files that are memory-mapped, so opening the index reads no vectors and
+# only the pages a search touches become resident. Chunk texts and metadata live in SQLite
+# beside the segments. Every upsert appends a segment; a background compaction merges them,
+# drops deleted rows and, once the index is large enough, trains IVF centroids and sorts the
+# merged rows by list, so that approximate search scores only the rows of the `nprobe` closest
+# lists. Segments appended since the last compaction are small and always scanned exactly.
+
+_BLOCK_ROWS = 65536  # rows dequantized at a time, bounding the scratch memory of a scan
+_SQL_BATCH = 500
+
+
+# Function to L2-normalise rows so dot products are cosine similarities
+def normalize_rows(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+# Function to quantize unit vectors; returns (codes, per-row scales or None)
+def quantize(vectors, dtype):
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    if dtype in ("float16", "float32"):
+        return vectors.astype(dtype), None
+    raise ValueError(f"Unsupported vector dtype: {dtype}")
+
+
+# Function to turn quantized rows back into float32 vectors
+def dequantize(codes, scales=None):
+    vectors = np.asarray(codes, dtype=np.float32)
+    return vectors * np.asarray(scales, dtype=np.float32)[:, None] if scales is not None else vectors
+
+
+# Function to train spherical k-means centroids for IVF search
+def train_centroids(vectors, nlist, iterations=10, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        filled = np.bincount(assignments, minlength=nlist) > 0  # empty lists keep their old centroid
+        centroids[filled] = normalize_rows(sums[filled])
+    return centroids
+
+
+# Function to read the source restriction of a Chroma-style filter ({"source": url} or
+# {"source": {"$in": [...]}}); None means no restriction
+def filter_sources(where):
+    if not where:
+        return None
+    if set(where) != {"source"}:
+        raise ValueError(f"Unsupported filter: {where}")
+    value = where["source"]
+    return list(value["$in"]) if isinstance(value, dict) else [value]
+
+
+# One immutable segment: quantized vectors and optional int8 scales. Compacted segments of an
+# IVF-trained index are sorted by list, with `offsets` giving each list's row range.
+class _Segment:
+    def __init__(self, directory, number):
+        self.number = number
+        self.base = os.path.join(directory, f"{number:06d}")
+        self.codes = np.load(f"{self.base}.codes.npy", mmap_mode="r")
+        self.scales = self._load_optional("scales")
+        self.offsets = self._load_optional("offsets")
+        self.rows = len(self.codes)
+
+    def _load_optional(self, part):
+        path = f"{self.base}.{part}.npy"
+        return np.load(path, mmap_mode="r") if os.path.exists(path) else None
+
+    def vectors(self, rows):
+        return dequantize(self.codes[rows], self.scales[rows] if self.scales is not None else None)
+
+    def files(self):
+        return [f"{self.base}.{part}.npy" for part in ("codes", "scales", "offsets")]
+
+
+class VectorIndex:
+    def __init__(self, path, dtype=config.VECTOR_INDEX_DTYPE, search=config.VECTOR_INDEX_SEARCH,
+                 nprobe=config.VECTOR_INDEX_NPROBE, ivf_min_rows=config.VECTOR_INDEX_IVF_MIN_ROWS,
+                 compact_segments=config.VECTOR_INDEX_COMPACT_SEGMENTS):
+        self.path = path
+        self.dtype = dtype
+        self.search_mode = search
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        self.compact_segments = compact_segments
+        self.segments_path = os.path.join(path, "segments")
+        os.makedirs(self.segments_path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._compaction_lock = threading.Lock()
+        self._generation = 0  # compactions so far: rows only change location in a compaction
+        self._conn = sqlite3.connect(os.path.join(path, config.VECTOR_INDEX_DB_NAME), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS segments (number INTEGER PRIMARY KEY, rows INTEGER)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS records (id TEXT PRIMARY KEY, segment INTEGER, row INTEGER, "
+            "source TEXT, document TEXT, metadata TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_location ON records (segment, row)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_source ON records (source)")
+        self._conn.commit()
+        numbers = [number for number, in self._conn.execute("SELECT number FROM segments ORDER BY number")]
+        self.segments = [_Segment(self.segments_path, number) for number in numbers]
+        self._next_number = (numbers[-1] + 1) if numbers else 1
+        centroids_path = os.path.join(self.segments_path, "centroids.npy")
+        self.centroids = np.load(centroids_path) if os.path.exists(centroids_path) else None
+        self._alive = None  # per-segment masks of live rows, built on first use
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    # Run a query once per batch of IDs (SQLite limits the number of parameters)
+    def _select_by_ids(self, sql, ids):
+        ids = list(ids)
+        rows = []
+        for start in range(0, len(ids), _SQL_BATCH):
+            batch = ids[start:start + _SQL_BATCH]
+            rows += self._conn.execute(sql.format(",".join("?" * len(batch))), batch).fetchall()
+        return rows
+
+    # Live-row masks of every segment (callers hold the lock)
+    def _alive_masks(self):
+        if self._alive is None:
+            alive = {segment.number: np.zeros(segment.rows, dtype=bool) for segment in self.segments}
+            locations = np.array(self._conn.execute("SELECT segment, row FROM records").fetchall(), dtype=np.int64)
+            for number, mask in alive.items():
+                if len(locations):
+                    mask[locations[locations[:, 0] == number, 1]] = True
+            self._alive = alive
+        return self._alive
+
+    # Per-segment masks of the rows belonging to some sources
+    def _source_masks(self, sources):
+        masks = {segment.number: np.zeros(segment.rows, dtype=bool) for segment in self.segments}
+        for number, row in self._select_by_ids("SELECT segment, row FROM records WHERE source IN ({})", sources):
+            if number in masks:
+                masks[number][row] = True
+        return masks
+
+    def _write_segment(self, number, codes, scales):
+        base = os.path.join(self.segments_path, f"{number:06d}")
+        np.save(f"{base}.codes.npy", codes)
+        if scales is not None:
+            np.save(f"{base}.scales.npy", scales)
+
+    def _assign(self, vectors, centroids):
+        return np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+
+    # Add or replace vectors with their chunk text and metadata, as one new segment
+    def upsert(self, ids, embeddings, documents, metadatas=None):
+        metadatas = metadatas or [None] * len(ids)
+        last = {doc_id: i for i, doc_id in enumerate(ids)}  # a repeated ID keeps its last occurrence
+        keep = sorted(last.values())
+        if not keep:
+            return
+        vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32)[keep])
+        codes, scales = quantize(vectors, self.dtype)
+        records = [(ids[i], documents[i], metadatas[i] or {}) for i in keep]
+        with self._lock:
+            number = self._next_number
+            self._next_number += 1
+            self._write_segment(number, codes, scales)
+            alive = self._alive_masks()
+            for old_number, row in self._select_by_ids(
+                "SELECT segment, row FROM records WHERE id IN ({})", [doc_id for doc_id, _, _ in records]
+            ):
+                alive[old_number][row] = False
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)",
+                [(doc_id, number, row, metadata.get("source"), text, json.dumps(metadata))
+                 for row, (doc_id, text, metadata) in enumerate(records)]
+            )
+            self._conn.execute("INSERT INTO segments VALUES (?, ?)", (number, len(records)))
+            self._conn.commit()
+            self.segments.append(_Segment(self.segments_path, number))
+            alive[number] = np.ones(len(records), dtype=bool)
+        self._maybe_compact()
+
+    def delete(self, ids):
+        with self._lock:
+            alive = self._alive_masks()
+            for number, row in self._select_by_ids("SELECT segment, row FROM records WHERE id IN ({})", ids):
+                alive[number][row] = False
+            ids = list(ids)
+            for start in range(0, len(ids), _SQL_BATCH):
+                batch = ids[start:start + _SQL_BATCH]
+                self._conn.execute(f"DELETE FROM records WHERE id IN ({','.join('?' * len(batch))})", batch)
+            self._conn.commit()
+        self._maybe_compact()
+
+    # Chroma-style read of stored records by IDs and/or a source filter
+    def get(self, ids=None, where=None, include=("documents", "metadatas")):
+        sources = filter_sources(where)
+        columns = "id, segment, row, document, metadata FROM records"
+        with self._lock:
+            if ids is not None:
+                rows = self._select_by_ids(f"SELECT {columns} WHERE id IN ({{}})", ids)
+                if sources is not None:
+                    rows = [row for row in rows if json.loads(row[4]).get("source") in sources]
+            elif sources is not None:
+                rows = self._select_by_ids(f"SELECT {columns} WHERE source IN ({{}})", sources)
+            else:
+                rows = self._conn.execute(f"SELECT {columns}").fetchall()
+            segments = {segment.number: segment for segment in self.segments}
+        result = {"ids": [row[0] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [row[3] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(row[4]) for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [segments[number].vectors([row])[0] for _, number, row, _, _ in rows]
+        return result
+
+    # Score a contiguous row range for some queries, adding each query's best k to `found`
+    def _scan_rows(self, segment, queries, query_ids, start, end, mask, k, found):
+        for block_start in range(start, end, _BLOCK_ROWS):
+            block_end = min(end, block_start + _BLOCK_ROWS)
+            block_mask = mask[block_start:block_end]
+            if not block_mask.any():
+                continue
+            scores = queries[query_ids] @ segment.vectors(slice(block_start, block_end)).T
+            scores[:, ~block_mask] = -np.inf
+            count = min(k, int(block_mask.sum()))
+            top = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+            for position, query_id in enumerate(query_ids):
+                found[query_id] += [(float(scores[position, j]), segment.number, block_start + int(j)) for j in top[position]]
+
+    # Best (score, segment, row) candidates of one segment for each query. With IVF probes, a
+    # list-sorted segment is scored one list at a time for all the queries probing that list.
+    def _scan_segment(self, segment, queries, mask, k, probes):
+        found = [[] for _ in queries]
+        if probes is None or segment.offsets is None:
+            self._scan_rows(segment, queries, np.arange(len(queries)), 0, segment.rows, mask, k, found)
+            return found
+        for probed in np.unique(probes):
+            query_ids = np.flatnonzero((probes == probed).any(axis=1))
+            self._scan_rows(segment, queries, query_ids, int(segment.offsets[probed]),
+                            int(segment.offsets[probed + 1]), mask, k, found)
+        return found
+
+    # Cosine top-k for a batch of query vectors, scored segment by segment with matrix products.
+    # Returns one list of (Document, similarity) per query, best first. Scoring runs without the
+    # lock; a compaction finishing meanwhile moves the rows found, so they are scored again.
+    def search(self, vectors, k=config.RETRIEVAL_K, sources=None):
+        queries = normalize_rows(vectors)
+        while True:
+            generation, best = self._best_locations(queries, k, sources)
+            with self._lock:
+                if generation != self._generation:
+                    continue
+                records = self._records_at({(number, row) for found in best for _, number, row in found})
+            return [
+                [(records[number, row], score) for score, number, row in found if (number, row) in records]  # rows deleted
+                for found in best                                                                             # meanwhile drop out
+            ]
+
+    # Best (score, segment, row) locations for each query, with the compaction generation they belong to
+    def _best_locations(self, queries, k, sources):
+        with self._lock:
+            generation = self._generation
+            segments = list(self.segments)
+            alive = dict(self._alive_masks())
+            allowed = self._source_masks(sources) if sources is not None else None
+            centroids = self.centroids
+        probes = None
+        if self.search_mode == "ivf" and centroids is not None:
+            nprobe = min(self.nprobe, len(centroids))
+            probes = np.argpartition(-(queries @ centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        candidates = [[] for _ in queries]
+        for segment in segments:
+            mask = alive.get(segment.number)
+            if mask is None:
+                continue
+            if allowed is not None:
+                mask = mask & allowed.get(segment.number, False)
+            if not mask.any():
+                continue
+            for i, found in enumerate(self._scan_segment(segment, queries, mask, k, probes)):
+                candidates[i] += found
+
+        return generation, [sorted(found, reverse=True)[:k] for found in candidates]
+
+    # Documents stored at some (segment, row) locations, looked up one segment at a time
+    def _records_at(self, locations):
+        by_segment = {}
+        for number, row in locations:
+            by_segment.setdefault(number, []).append(row)
+        records = {}
+        with self._lock:
+            for number, rows in by_segment.items():
+                found = self._select_by_ids(
+                    f"SELECT row, id, document, metadata FROM records WHERE segment = {int(number)} AND row IN ({{}})", rows
+                )
+                for row, doc_id, text, metadata in found:
+                    records[number, row] = Document(id=doc_id, page_content=text, metadata=json.loads(metadata))
+        return records
+
+    def _maybe_compact(self):
+        with self._lock:
+            if self._compacting or not self.segments:
+                return
+            alive = self._alive_masks()
+            total = sum(segment.rows for segment in self.segments)
+            live = sum(int(mask.sum()) for mask in alive.values())
+            untrained = self.centroids is None and live >= self.ivf_min_rows
+            if len(self.segments) <= self.compact_segments and total - live <= live * 0.3 and not untrained:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact, name="vector-index-compaction", daemon=True).start()
+
+    # Merge every current segment into one without deleted rows, (re)training the IVF centroids
+    # once the index is large enough (so switching to IVF search needs no rebuild). Writers are
+    # not blocked while the merged segment is written; rows changed meanwhile keep their newer
+    # location. A compaction already running in the background is waited for first.
+    def compact(self):
+        with self._lock:
+            self._compacting = True
+        self._compact()
+
+    def _compact(self):
+        with self._compaction_lock:
+            try:
+                self._merge_segments()
+            finally:
+                self._compacting = False
+
+    def _merge_segments(self):
+        with self._lock:
+            merged = {segment.number: segment for segment in self.segments}
+            if not merged:
+                return
+            number = self._next_number
+            self._next_number += 1
+            locations = self._conn.execute(
+                f"SELECT id, segment, row FROM records WHERE segment IN ({','.join('?' * len(merged))}) "
+                "ORDER BY segment, row", list(merged)
+            ).fetchall()
+            centroids = self.centroids
+        ids = [location[0] for location in locations]
+        source_segments = np.array([location[1] for location in locations], dtype=np.int64)
+        source_rows = np.array([location[2] for location in locations], dtype=np.int64)
+
+        # Function to gather some merged rows as float32 vectors
+        def gather(indices):
+            block = np.empty((len(indices), self._dimension(merged)), dtype=np.float32)
+            for segment_number in np.unique(source_segments[indices]):
+                selected = source_segments[indices] == segment_number
+                block[selected] = merged[segment_number].vectors(source_rows[indices][selected])
+            return block
+
+        if len(ids) and len(ids) >= self.ivf_min_rows:
+            nlist = int(min(4096, len(ids), max(8, np.sqrt(len(ids)))))
+            sample = np.random.default_rng(0).choice(len(ids), min(len(ids), 50 * nlist), replace=False)
+            centroids = train_centroids(gather(np.sort(sample)), nlist)
+        order = np.arange(len(ids))
+        lists = offsets = None
+        if centroids is not None and len(ids):
+            lists = np.concatenate([
+                self._assign(gather(order[start:start + _BLOCK_ROWS]), centroids)
+                for start in range(0, len(ids), _BLOCK_ROWS)
+            ])
+            order = np.argsort(lists, kind="stable")
+            lists = lists[order]
+            offsets = np.searchsorted(lists, np.arange(len(centroids) + 1)).astype(np.int64)
+
+        base = os.path.join(self.segments_path, f"{number:06d}")
+        if len(ids):
+            dimension = self._dimension(merged)
+            codes = np.lib.format.open_memmap(f"{base}.codes.npy", mode="w+", dtype=self.dtype,
+                                              shape=(len(ids), dimension))
+            scales = np.lib.format.open_memmap(f"{base}.scales.npy", mode="w+", dtype=np.float32,
+                                               shape=(len(ids),)) if self.dtype == "int8" else None
+            for start in range(0, len(ids), _BLOCK_ROWS):
+                block_codes, block_scales = quantize(gather(order[start:start + _BLOCK_ROWS]), self.dtype)
+                codes[start:start + len(block_codes)] = block_codes
+                if scales is not None:
+                    scales[start:start + len(block_codes)] = block_scales
+            codes.flush()
+            del codes, scales
+            if offsets is not None:
+                np.save(f"{base}.offsets.npy", offsets)
+
+        with self._lock:
+            if len(ids):
+                self._conn.execute("INSERT INTO segments VALUES (?, ?)", (number, len(ids)))
+                self._conn.executemany(
+                    "UPDATE records SET segment = ?, row = ? WHERE id = ? AND segment = ? AND row = ?",
+                    [(number, new_row, ids[i], int(source_segments[i]), int(source_rows[i]))
+                     for new_row, i in enumerate(order)]
+                )
+            self._conn.execute(f"DELETE FROM segments WHERE number IN ({','.join('?' * len(merged))})", list(merged))
+            self._conn.commit()
+            if centroids is not self.centroids:
+                np.save(os.path.join(self.segments_path, "centroids.npy"), centroids)
+                self.centroids = centroids
+            alive = self._alive_masks()
+            for segment_number in merged:
+                alive.pop(segment_number, None)
+            remaining = [segment for segment in self.segments if segment.number not in merged]
+            if len(ids):
+                compacted = _Segment(self.segments_path, number)
+                mask = np.zeros(compacted.rows, dtype=bool)
+                rows = [row for row, in self._conn.execute("SELECT row FROM records WHERE segment = ?", (number,))]
+                mask[rows] = True
+                alive[number] = mask
+                remaining.insert(0, compacted)
+            self.segments = remaining
+            self._generation += 1
+        for segment in merged.values():
+            for path in segment.files():
+                try:
+                    if os.path.exists(path):
+                        os.remove(path)
+                except OSError:  # still mapped on platforms that lock open files; removed next time
+                    logger.warning(f"Could not remove compacted segment file {path}")
+
+    def _dimension(self, segments):
+        return next(iter(segments.values())).codes.shape[1]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# LangChain vector store over a VectorIndex, with the parts of Chroma's interface this project
+# uses (get / delete by IDs or source, bulk upsert of precomputed vectors), so it can replace
+# Chroma wherever the store is built (pipeline.make_vectorstore).
+class MmapVectorStore(VectorStore):
+    def __init__(self, persist_directory=config.VECTORSTORE_PATH, embedding_function=None, **index_options):
+        self.index = VectorIndex(persist_directory, **index_options)
+        self._embedding_function = embedding_function
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        ids = list(ids) if ids else [uuid.uuid4().hex for _ in texts]
+        self.index.upsert(ids, self._embedding_function.embed_documents(texts), texts, metadatas)
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=config.VECTORSTORE_PATH,
+                   **kwargs):
+        store = cls(persist_directory=persist_directory, embedding_function=embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    # Write precomputed vectors (the embedding scheduler's sink)
+    def upsert_embeddings(self, ids, embeddings, documents, metadatas=None):
+        self.index.upsert(ids, embeddings, documents, metadatas)
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas")):
+        return self.index.get(ids=ids, where=where, include=include)
+
+    def delete(self, ids=None, **kwargs):
+        if ids:
+            self.index.delete(ids)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_relevance_scores(
+            self._embedding_function.embed_query(query), k=k, filter=filter
+        )
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [document for document, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)]
+
+    # (Document, cosine distance) pairs, closest first, like Chroma's distance-based results
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, filter=None, **kwargs):
+        return self.batch_similarity_search([embedding], k=k, filter=filter)[0]
+
+    # Search many query vectors in one pass over the index
+    def batch_similarity_search(self, embeddings, k=4, filter=None):
+        return [
+            [(document, 1.0 - similarity) for document, similarity in hits]
+            for hits in self.index.search(embeddings, k=k, sources=filter_sources(filter))
+        ]
+
+    def _select_relevance_score_fn(self):
+        return lambda distance: 1.0 - distance
+
+
+# Offline recall / latency check on synthetic clustered vectors:
+#   python vector_index.py --rows 100000 --dim 1536 --dtype int8 --queries 200
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    import time
+
+    parser = argparse.ArgumentParser(description="Benchmark the memory-mapped vector index")
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--dtype", choices=["float16", "int8", "float32"], default=config.VECTOR_INDEX_DTYPE)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=config.VECTOR_INDEX_NPROBE)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(max(1, args.rows // 200), args.dim))
+    data = centers[rng.integers(0, len(centers), args.rows)] + 0.5 * rng.normal(size=(args.rows, args.dim))
+    data = normalize_rows(data)
+    queries = normalize_rows(data[rng.integers(0, args.rows, args.queries)] + 0.1 * rng.normal(size=(args.queries, args.dim)))
+    truth = np.argsort(-(queries @ data.T), axis=1)[:, :args.k]
+
+    with tempfile.TemporaryDirectory() as path:
+        index = VectorIndex(path, dtype=args.dtype, ivf_min_rows=min(args.rows, config.VECTOR_INDEX_IVF_MIN_ROWS))
+        start = time.perf_counter()
+        for begin in range(0, args.rows, 5000):
+            rows = range(begin, min(args.rows, begin + 5000))
+            index.upsert([str(i) for i in rows], data[rows.start:rows.stop], [""] * len(rows))
+        index.compact()
+        print(f"built {args.rows} x {args.dim} {args.dtype} in {time.perf_counter() - start:.1f}s, "
+              f"{sum(os.path.getsize(os.path.join(path, 'segments', name)) for name in os.listdir(os.path.join(path, 'segments'))) / 2 ** 20:.1f} MB of segments "
+              f"(float32 would be {data.nbytes / 2 ** 20:.1f} MB)")
+        index.close()
+        for mode in ("exact", "ivf"):
+            index = VectorIndex(path, dtype=args.dtype, search=mode, nprobe=args.nprobe)
+            index.search(queries[:1], args.k)  # load the row locations once
+            for batch in (1, args.queries):
+                start = time.perf_counter()
+                results = [hits for begin in range(0, args.queries, batch)
+                           for hits in index.search(queries[begin:begin + batch], args.k)]
+                elapsed = time.perf_counter() - start
+                recall = np.mean([len({int(document.id) for document, _ in hits} & set(expected.tolist())) / args.k
+                                  for hits, expected in zip(results, truth)])
+                print(f"{mode:>5} batch={batch:<4} recall@{args.k}={recall:.3f} {elapsed * 1000 / args.queries:.2f} ms/query")
+            index.close()